@@ -0,0 +1,90 @@
+"""Compares building the suggestions of a repository with 50 [cmd/*] sections with the old per call formatting
+
+The old variant copies and formats every command, loads its icon and serializes it with repr() on every suggestion,
+the data bags are read back with eval(). --icon-ms adds the time the launcher needs to load an icon from an
+executable, which the stand-in doesn't, e.g.
+
+    python bench/bench_commands.py --commands 50 --icon-ms 0.5
+"""
+import argparse
+import os
+import time
+
+import harness  # puts git.py and the stand-ins on sys.path
+import keypirinha as kp
+import legacy
+from git import CommandTemplate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--commands", type=int, default=50, help="[cmd/*] sections")
+    parser.add_argument("--icon-ms", type=float, default=0, help="milliseconds to load an icon")
+    args = harness.main_args(parser)
+
+    results = harness.Results()
+    results.set("arguments", {"commands": args.commands, "icon_ms": args.icon_ms})
+    load_icon = kp.Plugin.load_icon
+
+    def slow_load_icon(plugin, sources):
+        time.sleep(args.icon_ms / 1000)
+        return load_icon(plugin, sources)
+
+    if args.icon_ms:
+        kp.Plugin.load_icon = slow_load_icon
+    cmds = {}
+    for number in range(args.commands):
+        if number % 2:
+            cmds["Git{}".format(number)] = {"label": "Git command {}".format(number),
+                                            "cmd": "{git_exe}",
+                                            "args": "log -{} --oneline".format(number),
+                                            "cwd": "{repo_path}",
+                                            "internal": "yes"}
+        else:
+            cmds["Tool{}".format(number)] = {"label": "Open in tool {}".format(number),
+                                             "cmd": "tool{}.exe".format(number),
+                                             "args": 'open "{repo_path}"'}
+    with harness.TempDir(args.keep) as root:
+        repo = harness.make_fake_repo(os.path.join(root, "repos", "repo"))
+        plugin = harness.create_plugin(harness.settings_text({"Repos": {"paths": [os.path.dirname(repo)]}},
+                                                             cmds=cmds),
+                                       os.path.join(root, "cache"))
+        try:
+            harness.rescan(plugin)
+            plugin.on_catalog()
+            item = harness.repo_item(plugin, repo)
+            legacy_cmds = [legacy.GitCommand(name,
+                                             section["cmd"].format(git_exe=plugin._git_path),
+                                             section["label"],
+                                             section["args"],
+                                             section.get("cwd"),
+                                             section.get("internal") == "yes")
+                           for name, section in cmds.items()]
+
+            legacy_items = legacy.command_items(plugin, legacy_cmds, plugin._git_path, repo)
+            suggestions, _, _ = harness.suggest(plugin, "", [item])
+            items = [suggestion for suggestion in suggestions if suggestion.data_bag() is not None and
+                     suggestion.data_bag().startswith("[")]
+            if len(items) != len(legacy_items):
+                raise SystemExit("expected {} command items, got {}".format(len(legacy_items), len(items)))
+
+            results.add("suggest.legacy", harness.measure(lambda: legacy.command_items(plugin,
+                                                                                       legacy_cmds,
+                                                                                       plugin._git_path,
+                                                                                       repo),
+                                                          args.repeat))
+            results.add("suggest.plugin", harness.measure(lambda: harness.suggest(plugin, "", [item]), args.repeat))
+            results.add("data_bag.legacy", harness.measure(lambda: [legacy.parse_data_bag(legacy_item.data_bag())
+                                                                    for legacy_item in legacy_items],
+                                                           args.repeat))
+            results.add("data_bag.plugin", harness.measure(lambda: [CommandTemplate.parse_data_bag(item.data_bag())
+                                                                    for item in items],
+                                                           args.repeat))
+        finally:
+            harness.stop_plugin(plugin)
+            kp.Plugin.load_icon = load_icon
+    harness.finish(results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Compares the per directory cost of ExcludeMatcher with compiling the excludes for every directory
+
+The old walker created a filefilter for every exclude pattern on every directory it visited. Both variants match the
+directories of a generated tree against the same patterns, then the tree is scanned with the excludes by both
+walkers, e.g.
+
+    python bench/bench_excludes.py --patterns 24
+
+The filefilter module of the launcher is replaced by the stand-in in this directory, so the old variant is only
+comparable to itself on the same machine.
+"""
+import argparse
+import os
+
+import filefilter
+import harness
+import legacy
+from git import ExcludeMatcher, RepoScanner
+
+PATTERNS = [
+    "**/node_modules/**",
+    "**/vendor/**",
+    "**/third_party/**",
+    "**/src/github.com/**",
+    "**/.cache/**",
+    "**/build",
+    "**/build-*",
+    "**/dist",
+    "**/out",
+    "**/target",
+    "**/tmp?",
+    "**/*.bak",
+    "**/archive/**",
+    "**/backup*/**",
+    "**/site-packages/**",
+    "**/.venv/**",
+    "**/bower_components/**",
+    "**/Pods/**",
+    "**/obj",
+    "**/bin",
+    "**/.gradle/**",
+    "**/coverage",
+    "**/generated/**",
+    "**/old-*/**",
+]
+
+
+def legacy_match(patterns, path):
+    """The exclude check of the old walker for one directory"""
+    for exclude in patterns:
+        if filefilter.create_filter(exclude).match(path):
+            return True
+    return False
+
+
+def make_excluded_tree(root, repos, excluded_repos):
+    """Creates repos fake repositories in the tree, and excluded_repos in subtrees that the excludes rule out"""
+    harness.make_tree(os.path.join(root, "work"), repos, 3)
+    harness.make_tree(os.path.join(root, "work", "node_modules"), excluded_repos // 2, 3)
+    harness.make_tree(os.path.join(root, "go", "src", "github.com"), excluded_repos - excluded_repos // 2, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--patterns", type=int, default=len(PATTERNS), help="exclude patterns, at most {}"
+                        .format(len(PATTERNS)))
+    parser.add_argument("--repos", type=int, default=1000, help="fake repositories outside of excluded directories")
+    parser.add_argument("--excluded-repos", type=int, default=1000, help="fake repositories in excluded directories")
+    args = harness.main_args(parser)
+
+    patterns = PATTERNS[:args.patterns]
+    results = harness.Results()
+    results.set("arguments", {"patterns": len(patterns), "repos": args.repos, "excluded_repos": args.excluded_repos})
+    with harness.TempDir(args.keep) as root:
+        make_excluded_tree(root, args.repos, args.excluded_repos)
+        directories = [dir_path for dir_path, _, _ in os.walk(root)]
+        matcher = ExcludeMatcher(patterns)
+        results.set("directories", len(directories))
+        results.set("excluded.legacy", sum(1 for path in directories if legacy_match(patterns, path)))
+        results.set("excluded.matcher", sum(1 for path in directories if matcher.match(path)))
+
+        legacy_timing = harness.measure(lambda: [legacy_match(patterns, path) for path in directories], args.repeat)
+        compile_timing = harness.measure(lambda: ExcludeMatcher(patterns), args.repeat)
+        matcher_timing = harness.measure(lambda: [matcher.match(path) for path in directories], args.repeat)
+        results.add("match.legacy", legacy_timing)
+        results.add("match.matcher.compile", compile_timing)
+        results.add("match.matcher", matcher_timing)
+        results.set("match.legacy.per_directory_us", round(legacy_timing["median"] * 1000 / len(directories), 2))
+        results.set("match.matcher.per_directory_us", round(matcher_timing["median"] * 1000 / len(directories), 2))
+
+        def scan():
+            return list(RepoScanner(1, matcher.match).scan([root], -1))
+
+        found = scan()
+        results.set("scan.repositories", len(found))
+        results.add("scan.legacy", harness.measure(lambda: list(legacy.scan_path(root, 0, -1, patterns)),
+                                                   args.repeat))
+        results.add("scan.matcher", harness.measure(scan, args.repeat))
+    harness.finish(results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Times rescans, on_catalog, on_suggest and cmd_all of the plugin end to end
+
+A synthetic tree of fake repositories is scanned and cataloged, a set of real git repositories is used for the
+suggestions and cmd_all. Run it from the package directory, e.g.
+
+    python bench/bench_plugin.py --repos 5000 --depth 4 --save before.json
+    python bench/bench_plugin.py --repos 5000 --depth 4 --baseline before.json
+"""
+import argparse
+import os
+
+import harness
+
+
+def bench_scan(results, args, root):
+    tree = os.path.join(root, "tree")
+    harness.make_tree(tree, args.repos, args.depth, args.noise_dirs)
+    plugin = harness.create_plugin(harness.settings_text({"Tree": {"paths": [tree]}}),
+                                   os.path.join(root, "cache-scan"))
+    try:
+        results.add("rescan.full", harness.measure(lambda: harness.rescan(plugin, full=True), args.repeat))
+        results.add("rescan.unchanged", harness.measure(lambda: harness.rescan(plugin), args.repeat))
+        results.set("rescan.repositories", len(plugin._git_repos))
+        results.add("on_catalog.cold",
+                    harness.measure(plugin.on_catalog, args.repeat, lambda: plugin._catalog_items.clear()))
+        results.add("on_catalog.warm", harness.measure(plugin.on_catalog, args.repeat))
+    finally:
+        harness.stop_plugin(plugin)
+
+
+def bench_repos(results, args, root):
+    real = os.path.join(root, "real")
+    repo_paths = [harness.make_real_repo(os.path.join(real, "repo{}".format(number)), args.files)
+                  for number in range(args.real_repos)]
+    cmds = dict(("Cmd{}".format(number), {"label": "Command {}".format(number), "cmd": "echo"})
+                for number in range(args.commands))
+    cmds_all = {"Status": {"label": "Status on all", "cmd": "{git_exe}", "args": "status --short",
+                           "internal": "yes", "workers": args.workers}}
+    settings = harness.settings_text({"Real": {"paths": [real]}},
+                                     main={"profile": "yes"},
+                                     cmds=cmds,
+                                     cmds_all=cmds_all,
+                                     files={"Text": {"pattern": ["**/*.txt"]}})
+    plugin = harness.create_plugin(settings, os.path.join(root, "cache-repos"))
+    try:
+        harness.rescan(plugin, full=True)
+        plugin.on_catalog()
+        repos_item = harness.keyword_item(plugin, plugin.COMMAND_REPOS)
+        item = harness.repo_item(plugin, repo_paths[0])
+
+        def reset_files():
+            plugin.on_deactivated()
+            plugin._file_index.clear()
+
+        first = []
+        last = []
+
+        def suggest_repo():
+            _, first_ms, last_ms = harness.suggest(plugin, "", [item])
+            first.append(first_ms)
+            last.append(last_ms)
+
+        results.add("on_suggest.repos", harness.measure(lambda: harness.suggest(plugin, "re", [repos_item]),
+                                                        args.repeat,
+                                                        plugin.on_deactivated))
+        results.add("on_suggest.repo.cold", harness.measure(suggest_repo, args.repeat, reset_files))
+        results.set("on_suggest.repo.cold.first_suggestions_ms", round(min(first), 2))
+        results.add("on_suggest.repo.indexed",
+                    harness.measure(lambda: harness.suggest(plugin, "", [item]), args.repeat, plugin.on_deactivated))
+        results.add("on_suggest.repo.typing", harness.measure(lambda: harness.suggest(plugin, "fi", [item]),
+                                                              args.repeat))
+
+        template = plugin._cmds_all["Status"]
+        with plugin._repos_lock:
+            git_repos = list(plugin._git_repos)
+        results.add("cmd_all", harness.measure(lambda: plugin._run_command_all(template, git_repos), args.repeat))
+        spawns = plugin._perf.to_dict().get("counters", {})
+        results.set("spawns", dict((name, count) for name, count in spawns.items() if name.startswith("spawns.")))
+    finally:
+        harness.stop_plugin(plugin)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--repos", type=int, default=2000, help="fake repositories in the synthetic tree")
+    parser.add_argument("--depth", type=int, default=4, help="directory level of the fake repositories")
+    parser.add_argument("--noise-dirs", type=int, default=2, help="directories without repositories per directory")
+    parser.add_argument("--real-repos", type=int, default=20, help="real git repositories")
+    parser.add_argument("--files", type=int, default=500, help="files per real git repository")
+    parser.add_argument("--commands", type=int, default=10, help="[cmd/*] sections")
+    parser.add_argument("--workers", type=int, default=4, help="workers of the cmd_all command")
+    args = harness.main_args(parser)
+
+    results = harness.Results()
+    results.set("arguments", dict((name, value) for name, value in vars(args).items()
+                                  if name not in ("repeat", "save", "baseline", "keep")))
+    with harness.TempDir(args.keep) as root:
+        bench_scan(results, args, root)
+        if harness.GIT_EXE:
+            bench_repos(results, args, root)
+        else:
+            print("git not found, skipping the benchmarks with real repositories")
+    harness.finish(results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Times the reconciliation of the found repositories with the known ones at the end of a rescan
+
+The scan itself is replaced by a list of found repositories: 1% of the known ones are gone, as many are new, and a
+second scan path finds 10% of them again. The rescan of the plugin is timed including saving the repository cache and
+updating the catalog. The old list based reconciliation is quadratic, so it is timed with fewer repositories and
+extrapolated, e.g.
+
+    python bench/bench_reconcile.py --repos 50000 --legacy-repos 1000 2000 4000
+"""
+import argparse
+import os
+
+import harness  # puts git.py and the stand-ins on sys.path
+import git
+import legacy
+
+
+def scenario(root, count):
+    """Returns the known repository paths and the paths found in the scan paths A and B"""
+    known = [os.path.join(root, "a", "repo{}".format(number)) for number in range(count)]
+    changed = max(count // 100, 1)
+    found_a = known[changed:] + [os.path.join(root, "a", "new{}".format(number)) for number in range(changed)]
+    found_b = found_a[:count // 10]
+    return known, found_a, found_b
+
+
+def bench_plugin(results, args, root, count):
+    known, found_a, found_b = scenario(root, count)
+    found = {os.path.join(root, "a"): found_a, os.path.join(root, "b"): found_b}
+    plugin = harness.create_plugin(harness.settings_text({"A": {"paths": [os.path.join(root, "a")]},
+                                                          "B": {"paths": [os.path.join(root, "b")]}}),
+                                   os.path.join(root, "cache-{}".format(count)))
+    # the found repositories don't exist, nothing below reads them from the file system
+    plugin._scan_path = lambda scanner, paths, max_depth: [os.path.join(path, ".git")
+                                                           for root_path in paths for path in found[root_path]]
+    plugin._resolve_top_level = os.path.dirname
+
+    def reset():
+        with plugin._repos_lock:
+            plugin._git_repos[:] = [git.GitRepo("A: " + os.path.basename(path), path, "A") for path in known]
+
+    try:
+        reset()
+        harness.rescan(plugin)
+        if len(plugin._git_repos) != len(found_a):
+            raise SystemExit("expected {} repositories, got {}".format(len(found_a), len(plugin._git_repos)))
+        timing = harness.measure(lambda: harness.rescan(plugin), args.repeat, reset)
+        results.add("rescan.{}".format(count), timing)
+        known_repos = [git.GitRepo("A: " + os.path.basename(path), path, "A") for path in known]
+        found_repos = [git.GitRepo("A: " + os.path.basename(path), path, "A") for path in found_a + found_b]
+
+        def merge():
+            plugin._git_repos[:] = known_repos
+            plugin._merge_repos(found_repos)
+
+        results.add("merge.{}".format(count), harness.measure(merge, args.repeat))
+    finally:
+        harness.stop_plugin(plugin)
+    return timing
+
+
+def bench_legacy(results, args, root, count):
+    known, found_a, found_b = scenario(root, count)
+    found_repos = [legacy.GitRepo(os.path.basename(path), path) for path in found_a + found_b]
+    known_repos = []
+
+    def reset():
+        known_repos[:] = [legacy.GitRepo(os.path.basename(path), path) for path in known]
+
+    timing = harness.measure(lambda: legacy.reconcile(known_repos, found_repos), args.repeat, reset)
+    results.add("legacy.reconcile.{}".format(count), timing)
+    return timing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--repos", type=int, default=50000, help="known repositories")
+    parser.add_argument("--legacy-repos", type=int, nargs="+", default=[1000, 2000, 4000],
+                        help="known repositories for the old reconciliation")
+    args = harness.main_args(parser)
+
+    results = harness.Results()
+    results.set("arguments", {"repos": args.repos, "legacy_repos": args.legacy_repos})
+    with harness.TempDir(args.keep) as root:
+        for count in args.legacy_repos:
+            bench_plugin(results, args, root, count)
+            legacy_timing = bench_legacy(results, args, root, count)
+        timing = bench_plugin(results, args, root, args.repos)
+    estimate = legacy_timing["median"] * (args.repos / args.legacy_repos[-1]) ** 2
+    results.set("legacy.reconcile.{}.estimated_ms".format(args.repos), round(estimate))
+    results.set("speedup.estimated", round(estimate / timing["median"]))
+    harness.finish(results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Compares RepoCache with the old repos.json at 100k repositories
+
+Times loading, saving, a rename and the check whether the cache changed, e.g.
+
+    python bench/bench_repo_cache.py --repos 100000
+"""
+import argparse
+import os
+
+import harness  # puts git.py and the stand-ins on sys.path
+import legacy
+from git import GitRepo, RepoCache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--repos", type=int, default=100000, help="repositories in the cache")
+    args = harness.main_args(parser)
+
+    results = harness.Results()
+    results.set("arguments", {"repos": args.repos})
+    with harness.TempDir(args.keep) as root:
+        paths = [os.path.join(root, "dev", "group{}".format(number // 100), "repo{}".format(number))
+                 for number in range(args.repos)]
+        legacy_repos = [legacy.GitRepo("Dev: " + os.path.basename(path), path) for path in paths]
+        git_repos = [GitRepo("Dev: " + os.path.basename(path), path, "Dev") for path in paths]
+
+        legacy_path = os.path.join(root, "legacy", "repos.json")
+        os.makedirs(os.path.dirname(legacy_path))
+        results.add("legacy.save", harness.measure(lambda: legacy.save_repos(legacy_path, legacy_repos), args.repeat))
+        results.add("legacy.load", harness.measure(lambda: legacy.load_repos(legacy_path), args.repeat))
+        results.set("legacy.bytes", os.path.getsize(legacy_path))
+
+        cache_path = os.path.join(root, "cache")
+        os.makedirs(cache_path)
+        cache = RepoCache(cache_path)
+        results.add("cache.save", harness.measure(lambda: cache.save(git_repos), args.repeat))
+        results.add("cache.load", harness.measure(lambda: RepoCache(cache_path).load(), args.repeat))
+        results.set("cache.bytes", os.path.getsize(cache.snapshot_path))
+        if len(RepoCache(cache_path).load()) != args.repos:
+            raise SystemExit("the cache didn't return all repositories")
+
+        renames = iter(range(RepoCache.COMPACT_THRESHOLD * args.repeat))
+        results.add("cache.append_rename",
+                    harness.measure(lambda: cache.append_rename(paths[0], "renamed{}".format(next(renames)), git_repos),
+                                    args.repeat))
+        results.add("cache.changed", harness.measure(cache.changed, args.repeat))
+
+        migrate_path = os.path.join(root, "migrate")
+        os.makedirs(migrate_path)
+
+        def copy_legacy():
+            with open(legacy_path, "rb") as source, open(os.path.join(migrate_path, "repos.json"), "wb") as target:
+                target.write(source.read())
+            for name in (RepoCache.SNAPSHOT_NAME, RepoCache.LOG_NAME):
+                if os.path.exists(os.path.join(migrate_path, name)):
+                    os.remove(os.path.join(migrate_path, name))
+
+        results.add("cache.migrate", harness.measure(lambda: RepoCache(migrate_path).load(), args.repeat, copy_legacy))
+    harness.finish(results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Compares GitDirResolver with one "git rev-parse --show-toplevel" process per repository
+
+Both resolve the ".git" directories of a generated tree of fake repositories, e.g.
+
+    python bench/bench_resolver.py --repos 3000
+"""
+import argparse
+import os
+
+import harness
+import legacy
+from git import GitDirResolver
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--repos", type=int, default=3000, help="fake repositories in the tree")
+    parser.add_argument("--depth", type=int, default=3, help="directory level of the fake repositories")
+    parser.add_argument("--spawn-repeat", type=int, default=1, help="runs of the subprocess variant")
+    args = harness.main_args(parser)
+    if not harness.GIT_EXE:
+        parser.error("git not found")
+
+    results = harness.Results()
+    results.set("arguments", {"repos": args.repos, "depth": args.depth})
+    with harness.TempDir(args.keep) as root:
+        repo_paths = harness.make_tree(root, args.repos, args.depth, noise_dirs=0)
+        dot_gits = [os.path.join(path, ".git") for path in repo_paths]
+
+        resolved = [GitDirResolver.top_level(dot_git) for dot_git in dot_gits]
+        spawned = [legacy.get_top_level(harness.GIT_EXE, path) for path in repo_paths[:20]]
+        mismatches = [(mine, theirs) for mine, theirs in zip(resolved, spawned)
+                      if os.path.realpath(mine) != os.path.realpath(theirs)]
+        if mismatches:
+            raise SystemExit("resolver and git disagree: {}".format(mismatches[:5]))
+
+        resolver = harness.measure(lambda: [GitDirResolver.top_level(dot_git) for dot_git in dot_gits], args.repeat)
+        results.add("resolver", resolver)
+        subprocess_timing = harness.measure(lambda: [legacy.get_top_level(harness.GIT_EXE, path)
+                                                     for path in repo_paths],
+                                            args.spawn_repeat)
+        results.add("subprocess", subprocess_timing)
+        results.set("resolver.per_repo_us", round(resolver["median"] * 1000 / args.repos, 2))
+        results.set("subprocess.per_repo_us", round(subprocess_timing["median"] * 1000 / args.repos, 2))
+        results.set("speedup", round(subprocess_timing["median"] / resolver["median"], 1))
+    harness.finish(results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Compares RepoScanner with the old recursive walker on a generated deep tree
+
+The tree has fake repositories at the deepest level and directories without repositories as well as files on every
+level. --latency adds a delay to every directory listing of both walkers, like a network share, e.g.
+
+    python bench/bench_walker.py --repos 2000 --depth 8 --workers 1 8 32
+    python bench/bench_walker.py --repos 200 --depth 4 --latency 2
+"""
+import argparse
+import contextlib
+import os
+import time
+
+import harness
+import legacy
+from git import RepoScanner
+
+
+def scan(workers, root, index=None):
+    scanner = RepoScanner(workers, index=index)
+    return list(scanner.scan([root], -1)), scanner
+
+
+@contextlib.contextmanager
+def listing_latency(seconds):
+    """Delays every os.listdir() and os.scandir() call by seconds"""
+    listdir = os.listdir
+    scandir = os.scandir
+
+    def slow_listdir(*args):
+        time.sleep(seconds)
+        return listdir(*args)
+
+    def slow_scandir(*args):
+        time.sleep(seconds)
+        return scandir(*args)
+
+    if seconds:
+        os.listdir = slow_listdir
+        os.scandir = slow_scandir
+    try:
+        yield
+    finally:
+        os.listdir = listdir
+        os.scandir = scandir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--repos", type=int, default=2000, help="fake repositories in the tree")
+    parser.add_argument("--depth", type=int, default=8, help="directory level of the fake repositories")
+    parser.add_argument("--noise-dirs", type=int, default=3, help="directories without repositories per directory")
+    parser.add_argument("--files", type=int, default=5, help="files per directory")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8], help="thread pool sizes of RepoScanner")
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds added to every directory listing")
+    args = harness.main_args(parser)
+
+    results = harness.Results()
+    results.set("arguments", {"repos": args.repos, "depth": args.depth, "noise_dirs": args.noise_dirs,
+                              "files": args.files, "latency": args.latency})
+    with harness.TempDir(args.keep) as root:
+        harness.make_tree(root, args.repos, args.depth, args.noise_dirs, args.files)
+        expected = sorted(legacy.scan_path(root, 0, -1))
+        found, scanner = scan(args.workers[0], root)
+        if sorted(found) != expected:
+            raise SystemExit("RepoScanner found {} repositories, the old walker {}".format(len(found), len(expected)))
+        results.set("directories", len(scanner.new_index))
+        results.set("repositories", len(found))
+
+        with listing_latency(args.latency / 1000):
+            results.add("legacy.scan_path",
+                        harness.measure(lambda: list(legacy.scan_path(root, 0, -1)), args.repeat))
+            for workers in args.workers:
+                results.add("RepoScanner.{}_workers".format(workers),
+                            harness.measure(lambda: scan(workers, root), args.repeat))
+            index = scanner.new_index
+            results.add("RepoScanner.{}_workers.unchanged".format(args.workers[-1]),
+                        harness.measure(lambda: scan(args.workers[-1], root, index), args.repeat))
+    harness.finish(results, args)
+
+
+if __name__ == "__main__":
+    main()
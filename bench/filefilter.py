@@ -0,0 +1,27 @@
+"""Stand-in for the filefilter module of the launcher, based on fnmatch
+
+Like the launcher, "**" matches across directories and a pattern matches paths with either kind of separator.
+"""
+import fnmatch
+import os
+import re
+
+
+class Filter(object):
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._regex = re.compile(fnmatch.translate(self._normalize(pattern)), re.IGNORECASE)
+
+    def __repr__(self):
+        return "Filter({!r})".format(self.pattern)
+
+    @staticmethod
+    def _normalize(path):
+        return path.replace("\\", "/").replace(os.sep, "/")
+
+    def match(self, path):
+        return self._regex.match(self._normalize(path)) is not None
+
+
+def create_filter(pattern):
+    return Filter(pattern)
@@ -0,0 +1,12 @@
+"""Stand-in for the globex module of the launcher, based on glob"""
+import glob
+
+
+class GlobexEntry(object):
+    def __init__(self, path):
+        self.path = path
+
+
+def iglobex(pattern, recursivity=False):
+    for path in glob.iglob(pattern, recursive=bool(recursivity)):
+        yield GlobexEntry(path)
@@ -0,0 +1,433 @@
+"""Headless harness that runs git.py outside of Keypirinha
+
+Importing this module puts the stand-in modules of this directory (keypirinha, keypirinha_util, globex and filefilter)
+on sys.path and imports git.py with them. On other systems than Windows the Windows-only parts of subprocess that
+git.py relies on are shimmed: STARTUPINFO is a dummy and string commands are split like a Windows command line.
+
+The helpers create synthetic directory trees with fake repositories (only a ".git" directory with HEAD and config),
+real git repositories with commits, bare remotes and a git daemon that serves them, plugin instances with their own
+settings and cache directory, and time callables. CmdAllTestCase is the common fixture of the cmd_all tests.
+Benchmark results are saved as JSON and can be compared to an earlier run.
+"""
+import json
+import os
+import shlex
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCH_DIR)
+for path in (PACKAGE_DIR, BENCH_DIR):
+    if path in sys.path:
+        sys.path.remove(path)
+    sys.path.insert(0, path)
+
+if not hasattr(subprocess, "STARTUPINFO"):
+    class STARTUPINFO(object):
+        def __init__(self):
+            self.dwFlags = 0
+            self.wShowWindow = 0
+
+    class PosixPopen(subprocess.Popen):
+        """Popen that accepts the Windows command lines of git.py"""
+
+        def __init__(self, args, *popenargs, startupinfo=None, **kwargs):
+            if isinstance(args, str):
+                args = shlex.split(args)
+            super().__init__(args, *popenargs, **kwargs)
+
+    subprocess.STARTUPINFO = STARTUPINFO
+    subprocess.STARTF_USESHOWWINDOW = 1
+    subprocess.Popen = PosixPopen
+
+import keypirinha as kp  # noqa: E402
+import git  # noqa: E402
+
+GIT_EXE = shutil.which("git")
+GIT_ENV = dict(os.environ,
+               GIT_AUTHOR_NAME="Bench",
+               GIT_AUTHOR_EMAIL="bench@example.com",
+               GIT_COMMITTER_NAME="Bench",
+               GIT_COMMITTER_EMAIL="bench@example.com",
+               GIT_CONFIG_NOSYSTEM="1",
+               GIT_TERMINAL_PROMPT="0")
+
+
+def settings_text(scan_paths=None, main=None, cmds=None, cmds_all=None, files=None):
+    """Returns the text of a package configuration
+
+    scan_paths maps section names to dicts with paths (list), depth and excludes (list), the other arguments map
+    section names to dicts of settings. main is merged into the defaults of the [main] section, which disable the
+    background work that would disturb measurements.
+    """
+    main_settings = {"git_exe": GIT_EXE or "git",
+                     "show_status": "no",
+                     "health_check_interval": "0",
+                     "watch": "no"}
+    main_settings.update(main or {})
+    lines = ["[main]"]
+    lines.extend("{} = {}".format(key, value) for key, value in main_settings.items())
+    for name, scan_path in (scan_paths or {}).items():
+        lines.append("[scan_path/{}]".format(name))
+        lines.append("paths =")
+        lines.extend("    " + path for path in scan_path["paths"])
+        lines.append("depth = {}".format(scan_path.get("depth", -1)))
+        if scan_path.get("excludes"):
+            lines.append("excludes =")
+            lines.extend("    " + pattern for pattern in scan_path["excludes"])
+    for prefix, sections in (("cmd/", cmds), ("cmd_all/", cmds_all), ("file/", files)):
+        for name, section in (sections or {}).items():
+            lines.append("[{}{}]".format(prefix, name))
+            for key, value in section.items():
+                if isinstance(value, (list, tuple)):
+                    lines.append("{} =".format(key))
+                    lines.extend("    " + line for line in value)
+                else:
+                    lines.append("{} = {}".format(key, value))
+    return "\n".join(lines) + "\n"
+
+
+def create_plugin(settings, cache_path):
+    """Returns a started plugin instance that reads settings (see settings_text()) and caches in cache_path"""
+    plugin = git.Git()
+    plugin.settings_text = settings
+    plugin.cache_path = cache_path
+    plugin.on_start()
+    return plugin
+
+
+def configure(plugin, settings):
+    """Changes the configuration of a running plugin like an edit of the package configuration"""
+    plugin.settings_text = settings
+    plugin.on_events(kp.Events.PACKCONFIG)
+
+
+def stop_plugin(plugin):
+    """Ends the background threads and processes of plugin"""
+    wait_rescan(plugin)
+    if plugin._watcher is not None:
+        plugin._watcher.stop()
+        plugin._watcher = None
+    if plugin._health_stop is not None:
+        plugin._health_stop.set()
+        plugin._health_stop = None
+    plugin._git_runner.close()
+
+
+def rescan(plugin, full=False, scan_paths=None):
+    """Rescans like the keyword items do and waits for it, a direct _rescan() call would race with the rescan the
+    plugin starts itself when the catalog is updated without a repository cache"""
+    wait_rescan(plugin)
+    plugin._start_rescan(full, scan_paths)
+    wait_rescan(plugin)
+
+
+def wait_rescan(plugin, timeout=None):
+    """Waits for the running rescan of plugin, returns False if it is still running after timeout seconds"""
+    thread = plugin._rescan_thread
+    if thread is None:
+        return True
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+def repo_item(plugin, repo_path):
+    """Returns the catalog item of the repository at repo_path"""
+    return plugin._catalog_items[git.GitRepo.path_key(repo_path)][1]
+
+
+def keyword_item(plugin, target):
+    """Returns the catalog item of a keyword command, e.g. Git.COMMAND_REPOS"""
+    return plugin._catalog_items[target][1]
+
+
+def suggest(plugin, user_input, items_chain):
+    """Runs on_suggest like the launcher and returns the suggestions and the milliseconds until the first and the last
+    set_suggestions() call"""
+    plugin.suggestion_times = []
+    plugin.suggestions = None
+    start_time = time.perf_counter()
+    plugin.on_suggest(user_input, items_chain)
+    times = [(suggested - start_time) * 1000 for suggested in plugin.suggestion_times]
+    return plugin.suggestions, times[0] if times else None, times[-1] if times else None
+
+
+def make_fake_repo(path):
+    """Creates the minimal ".git" directory that the scanner and GitDirResolver accept, without running git"""
+    git_dir = os.path.join(path, ".git")
+    os.makedirs(os.path.join(git_dir, "refs", "heads"), exist_ok=True)
+    os.makedirs(os.path.join(git_dir, "objects"), exist_ok=True)
+    with open(os.path.join(git_dir, "HEAD"), "w") as head:
+        head.write("ref: refs/heads/master\n")
+    with open(os.path.join(git_dir, "config"), "w") as config:
+        config.write("[core]\n\trepositoryformatversion = 0\n\tbare = false\n")
+    return path
+
+
+def make_tree(root, repos, depth, noise_dirs=2, files_per_dir=0):
+    """Creates repos fake repositories spread evenly over a tree of directories below root
+
+    The repositories are depth levels below root. Every directory on the way gets noise_dirs extra sub directories
+    without repositories and files_per_dir files, which the scanner has to list as well. Returns the repository
+    paths.
+    """
+    depth = max(depth, 1)
+    fanout = 2
+    while fanout ** depth < repos:
+        fanout += 1
+    paths = []
+    parents = set()
+    for number in range(repos):
+        parts = []
+        rest = number
+        for _ in range(depth - 1):
+            parts.append("d{}".format(rest % fanout))
+            rest //= fanout
+        parent = os.path.join(root, *reversed(parts))
+        parents.add(parent)
+        paths.append(make_fake_repo(os.path.join(parent, "repo{}".format(number))))
+    filled = set()
+    for parent in parents:
+        while parent not in filled and len(parent) >= len(root):
+            filled.add(parent)
+            for number in range(noise_dirs):
+                os.makedirs(os.path.join(parent, "noise{}".format(number), "sub"), exist_ok=True)
+            for number in range(files_per_dir):
+                open(os.path.join(parent, "file{}.txt".format(number)), "w").close()
+            parent = os.path.dirname(parent)
+    return paths
+
+
+def run_git(args, cwd=None):
+    """Runs git with the arguments in the list args and returns its output, raises CalledProcessError on errors"""
+    return subprocess.run([GIT_EXE] + list(args),
+                          cwd=cwd,
+                          env=GIT_ENV,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT,
+                          check=True,
+                          universal_newlines=True).stdout
+
+
+def make_real_repo(path, files=3, remote=None):
+    """Creates a git repository at path with one commit of files files, remote is added as origin if given"""
+    os.makedirs(path, exist_ok=True)
+    run_git(["init", "-q"], path)
+    # independent of init.defaultBranch
+    run_git(["symbolic-ref", "HEAD", "refs/heads/master"], path)
+    for number in range(files):
+        file_path = os.path.join(path, "src" if number % 2 else "", "file{}.txt".format(number))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w") as file:
+            file.write("content {}\n".format(number))
+    run_git(["add", "-A"], path)
+    run_git(["commit", "-q", "-m", "Initial commit"], path)
+    if remote:
+        run_git(["remote", "add", "origin", remote], path)
+    return path
+
+
+def make_bare_remote(path, source):
+    """Creates a bare clone of the repository source at path that git daemon may export, returns path"""
+    run_git(["clone", "-q", "--bare", source, path])
+    open(os.path.join(path, "git-daemon-export-ok"), "w").close()
+    return path
+
+
+class GitDaemon(object):
+    """A "git daemon" that serves the exported bare repositories below base_path on a free port of 127.0.0.1"""
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.port = None
+        self._proc = None
+
+    def start(self, timeout=10):
+        """Starts the daemon and waits until it accepts connections, returns False if it doesn't"""
+        with socket.socket() as free:
+            free.bind(("127.0.0.1", 0))
+            self.port = free.getsockname()[1]
+        self._proc = subprocess.Popen([GIT_EXE,
+                                       "daemon",
+                                       "--reuseaddr",
+                                       "--listen=127.0.0.1",
+                                       "--port={}".format(self.port),
+                                       "--base-path=" + self.base_path],
+                                      env=GIT_ENV,
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+        deadline = time.time() + timeout
+        while time.time() < deadline and self._proc.poll() is None:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), 1).close()
+                return True
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        return False
+
+    def url(self, name):
+        """Returns the git:// url of the repository name below base_path"""
+        return "git://127.0.0.1:{}/{}".format(self.port, name)
+
+    def stop(self):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+            self._proc.wait()
+
+
+class CmdAllTestCase(unittest.TestCase):
+    """Base class of the tests of cmd_all commands
+
+    Every test gets REPOS clones of a bare remote below its own temporary directory, the remote has one commit more
+    than the clones. The plugins of the tests have a single [cmd_all/Cmd] section with the settings in CMD_ALL.
+    """
+    REPOS = 6
+    CMD_ALL = {"label": "Run on all", "cmd": "{git_exe}", "args": "fetch --all", "internal": "yes"}
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="git-bench-")
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.remotes = os.path.join(self.root, "remotes")
+        source = make_real_repo(os.path.join(self.root, "source"))
+        self.remote = make_bare_remote(os.path.join(self.remotes, "upstream.git"), source)
+        self.repos = []
+        for number in range(self.REPOS):
+            path = os.path.join(self.root, "repos", "clone{}".format(number))
+            run_git(["clone", "-q", self.remote, path])
+            self.repos.append(path)
+        with open(os.path.join(source, "new.txt"), "w") as new_file:
+            new_file.write("new\n")
+        run_git(["add", "new.txt"], source)
+        run_git(["commit", "-q", "-m", "New commit"], source)
+        run_git(["push", "-q", self.remote, "HEAD"], source)
+        self.head = run_git(["rev-parse", "HEAD"], source).strip()
+
+    def create_plugin(self, **cmd_all):
+        """Returns a plugin that found the clones, cmd_all overrides CMD_ALL"""
+        section = dict(self.CMD_ALL)
+        section.update(cmd_all)
+        settings = settings_text({"Repos": {"paths": [os.path.join(self.root, "repos")]}}, cmds_all={"Cmd": section})
+        plugin = create_plugin(settings, os.path.join(self.root, "cache"))
+        self.addCleanup(stop_plugin, plugin)
+        rescan(plugin)
+        self.assertEqual(len(plugin._git_repos), len(self.repos))
+        return plugin
+
+    def run_cmd_all(self, plugin, repos=None):
+        """Runs the command on the repositories of plugin with a path in repos (all if None), returns the messages"""
+        with plugin._repos_lock:
+            git_repos = [repo for repo in plugin._git_repos if repos is None or repo.path in repos]
+        plugin.log = []
+        plugin._run_command_all(plugin._cmds_all["Cmd"], git_repos)
+        return [message for _, message in plugin.log]
+
+    def summary(self, messages):
+        summaries = [message for message in messages if " finished on " in message]
+        self.assertEqual(len(summaries), 1, messages)
+        return summaries[0]
+
+    def assert_fetched(self, repos=None):
+        for repo in repos or self.repos:
+            self.assertEqual(run_git(["rev-parse", "origin/HEAD"], repo).strip(), self.head)
+
+
+class TempDir(object):
+    """Temporary directory that is removed when the context is left, unless keep is set"""
+
+    def __init__(self, keep=False):
+        self.keep = keep
+        self.path = None
+
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix="git-bench-")
+        return self.path
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.keep:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def measure(function, repeat=5, setup=None):
+    """Calls setup() (if given) and function() repeat times, returns the timings of function in milliseconds as a
+    dict with min, median and max"""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start_time) * 1000)
+    return {"min": min(timings), "median": statistics.median(timings), "max": max(timings), "runs": len(timings)}
+
+
+class Results(object):
+    """Named benchmark timings that can be printed, saved and compared to a saved baseline"""
+
+    def __init__(self):
+        self.timings = {}
+        self.values = {}
+
+    def add(self, name, timing):
+        self.timings[name] = timing
+        print("{:<48} median {:>10.2f} ms  min {:>10.2f} ms  max {:>10.2f} ms".format(name,
+                                                                                 timing["median"],
+                                                                                 timing["min"],
+                                                                                 timing["max"]))
+
+    def set(self, name, value):
+        self.values[name] = value
+        print("{:<48} {}".format(name, value))
+
+    def to_dict(self):
+        return {"python": sys.version.split()[0],
+                "platform": sys.platform,
+                "timings": self.timings,
+                "values": self.values}
+
+    def save(self, path):
+        with open(path, "w") as results_file:
+            json.dump(self.to_dict(), results_file, indent=4, sort_keys=True)
+        print("Results saved to", path)
+
+    def compare(self, baseline_path):
+        """Prints the change of every median compared to the baseline saved at baseline_path"""
+        with open(baseline_path, "r") as baseline_file:
+            saved = json.load(baseline_file)
+        baseline = saved.get("timings", {})
+        print("Compared to", baseline_path)
+        arguments = saved.get("values", {}).get("arguments")
+        if arguments != self.values.get("arguments"):
+            print("The baseline was run with other arguments:", arguments)
+        for name, timing in sorted(self.timings.items()):
+            before = baseline.get(name)
+            if not before or not before.get("median"):
+                print("{:<48} new".format(name))
+                continue
+            change = (timing["median"] - before["median"]) / before["median"] * 100
+            print("{:<48} {:>10.2f} ms -> {:>10.2f} ms ({:+.1f}%)".format(name,
+                                                                         before["median"],
+                                                                         timing["median"],
+                                                                         change))
+
+
+def main_args(parser):
+    """Adds the options shared by the benchmark scripts to the argparse parser and returns the parsed arguments"""
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+    parser.add_argument("--save", metavar="PATH", help="save the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare the results to a saved run")
+    parser.add_argument("--keep", action="store_true", help="keep the generated directories")
+    return parser.parse_args()
+
+
+def finish(results, args):
+    if args.save:
+        results.save(args.save)
+    if args.baseline:
+        results.compare(args.baseline)
@@ -0,0 +1,249 @@
+"""Stand-in for the keypirinha module of the launcher, just enough to run git.py headless
+
+Items are plain objects, the catalog and the suggestions are stored on the plugin instead of being shown, and the
+settings are parsed from the ini text in Plugin.settings_text.
+"""
+import configparser
+import os
+import threading
+import time
+
+
+class Events(object):
+    APPCONFIG = 1
+    PACKCONFIG = 2
+
+
+class ItemCategory(object):
+    KEYWORD = 1
+    FILE = 2
+
+
+class ItemArgsHint(object):
+    FORBIDDEN = 0
+    ACCEPTED = 1
+    REQUIRED = 2
+
+
+class ItemHitHint(object):
+    KEEPALL = 0
+    NOARGS = 1
+    IGNORE = 2
+
+
+class Match(object):
+    ANY = 0
+    FUZZY = 1
+    DEFAULT = 2
+
+
+class Sort(object):
+    NONE = 0
+    DEFAULT = 1
+    SCORE_DESC = 2
+
+
+class Settings(object):
+    """Read-only access to an ini text with the getters of keypirinha.Settings
+
+    Values outside of min and max are replaced by the fallback like in the launcher.
+    """
+    TRUE_VALUES = ("1", "y", "yes", "true", "on")
+    FALSE_VALUES = ("0", "n", "no", "false", "off")
+
+    def __init__(self, text=""):
+        self._parser = configparser.ConfigParser(interpolation=None, strict=False)
+        self._parser.optionxform = str
+        self._parser.read_string(text)
+
+    def sections(self):
+        return self._parser.sections()
+
+    def keys(self, section):
+        if not self._parser.has_section(section):
+            return []
+        return list(self._parser[section].keys())
+
+    def get(self, key, section=None, fallback=None, unquote=False):
+        if not self._parser.has_section(section) or not self._parser.has_option(section, key):
+            return fallback
+        value = self._parser.get(section, key)
+        if unquote and len(value) > 1 and value[0] == value[-1] and value[0] in "\"'":
+            value = value[1:-1]
+        return value
+
+    def get_stripped(self, key, section=None, fallback=None, unquote=False):
+        value = self.get(key, section, None, unquote)
+        if value is None:
+            return fallback
+        return value.strip()
+
+    def get_bool(self, key, section=None, fallback=None):
+        value = self.get_stripped(key, section)
+        if value is None:
+            return fallback
+        if value.lower() in self.TRUE_VALUES:
+            return True
+        if value.lower() in self.FALSE_VALUES:
+            return False
+        return fallback
+
+    def get_int(self, key, section=None, fallback=None, min=None, max=None):
+        value = self.get_stripped(key, section)
+        try:
+            value = int(value, 0)
+        except (TypeError, ValueError):
+            return fallback
+        if (min is not None and value < min) or (max is not None and value > max):
+            return fallback
+        return value
+
+    def get_float(self, key, section=None, fallback=None, min=None, max=None):
+        value = self.get_stripped(key, section)
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return fallback
+        if (min is not None and value < min) or (max is not None and value > max):
+            return fallback
+        return value
+
+    def get_multiline(self, key, section=None, fallback=[], keep_empty_lines=False):
+        value = self.get(key, section)
+        if value is None:
+            return fallback
+        lines = [line.strip() for line in value.splitlines()]
+        if not keep_empty_lines:
+            lines = [line for line in lines if line]
+        return lines
+
+    def get_enum(self, key, section=None, fallback=None, enum=[], case_sensitive=False, unquote=False):
+        value = self.get_stripped(key, section, None, unquote)
+        if value is None:
+            return fallback
+        for candidate in enum:
+            if candidate == value or (not case_sensitive and candidate.lower() == value.lower()):
+                return candidate
+        return fallback
+
+
+class CatalogItem(object):
+    """Item created by Plugin.create_item(), keeps the keyword arguments it was created with"""
+
+    def __init__(self, **kwargs):
+        self._props = kwargs
+        self._args = ""
+
+    def __repr__(self):
+        return "CatalogItem({!r}, {!r})".format(self.label(), self.target())
+
+    def category(self):
+        return self._props.get("category")
+
+    def label(self):
+        return self._props.get("label", "")
+
+    def set_label(self, label):
+        self._props["label"] = label
+
+    def short_desc(self):
+        return self._props.get("short_desc", "")
+
+    def set_short_desc(self, short_desc):
+        self._props["short_desc"] = short_desc
+
+    def target(self):
+        return self._props.get("target", "")
+
+    def data_bag(self):
+        return self._props.get("data_bag")
+
+    def raw_args(self):
+        return self._args
+
+    def displayed_args(self):
+        return self._args
+
+    def set_args(self, raw_args, displayed_args=None):
+        self._args = raw_args
+
+    def clone(self):
+        item = CatalogItem(**self._props)
+        item._args = self._args
+        return item
+
+
+class IconHandle(object):
+    def __init__(self, source):
+        self.source = source
+
+    def free(self):
+        pass
+
+
+class Plugin(object):
+    """Base class of the plugins
+
+    The catalog and every set of suggestions are kept in catalog and suggestions, suggestion_times holds the
+    time.perf_counter() of each set_suggestions() call of the current on_suggest(). Setting terminate makes
+    should_terminate() return True, like a launcher that already has newer input.
+    """
+    settings_text = ""
+    cache_path = None
+
+    def __init__(self):
+        self._debug = False
+        self.catalog = None
+        self.suggestions = None
+        self.suggestion_times = []
+        self.terminate = threading.Event()
+        self.log = []
+        self.quiet = True
+
+    def _log(self, level, *args):
+        message = " ".join(str(arg) for arg in args)
+        self.log.append((level, message))
+        if not self.quiet:
+            print(level, message)
+
+    def dbg(self, *args):
+        if self._debug:
+            self._log("DBG", *args)
+
+    def info(self, *args):
+        self._log("INFO", *args)
+
+    def warn(self, *args):
+        self._log("WARN", *args)
+
+    def err(self, *args):
+        self._log("ERR", *args)
+
+    def load_settings(self):
+        return Settings(self.settings_text)
+
+    def get_package_cache_path(self, create=False):
+        if create:
+            os.makedirs(self.cache_path, exist_ok=True)
+        return self.cache_path
+
+    def create_item(self, **kwargs):
+        return CatalogItem(**kwargs)
+
+    def set_catalog(self, catalog_items):
+        self.catalog = list(catalog_items)
+
+    def set_suggestions(self, suggestions, match=Match.ANY, sort=Sort.SCORE_DESC):
+        self.suggestions = list(suggestions)
+        self.suggestion_times.append(time.perf_counter())
+
+    def load_icon(self, sources):
+        return IconHandle(sources)
+
+    def set_default_icon(self, icon_handle):
+        pass
+
+    def should_terminate(self, wait=None):
+        if wait:
+            return self.terminate.wait(wait)
+        return self.terminate.is_set()
@@ -0,0 +1,17 @@
+"""Stand-in for the keypirinha_util module of the launcher, records the calls instead of executing anything"""
+
+calls = []
+
+
+def shell_execute(thing, args="", working_dir="", verb="", try_runas=True, detect_nongui=True, api_flags=None,
+                  terminal_cmd=None, show=-1):
+    calls.append(("shell_execute", thing, args, working_dir))
+    return True
+
+
+def set_clipboard(text):
+    calls.append(("set_clipboard", text))
+
+
+def execute_default_action(plugin, catalog_item, catalog_action):
+    calls.append(("execute_default_action", catalog_item.target()))
@@ -0,0 +1,162 @@
+"""Implementations of the plugin before the performance work, kept to compare the current ones against
+
+The functions are taken from the Git class of the original git.py with the plugin state turned into arguments.
+"""
+import copy
+import json
+import os
+import subprocess
+
+import filefilter
+import keypirinha as kp
+
+ARGS_TOP_LEVEL = "rev-parse --show-toplevel"
+
+
+def get_top_level(git_path, dir):
+    """Git._get_top_level(): one "git rev-parse --show-toplevel" process per repository"""
+    if not os.path.exists(dir):
+        return ""
+    if not os.path.isdir(dir):
+        cwd = os.path.dirname(dir)
+    else:
+        cwd = dir
+
+    command = '"{}" {}'.format(git_path, ARGS_TOP_LEVEL)
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    proc = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE, startupinfo=startupinfo)
+    if proc.returncode == 0:
+        return os.path.normpath(proc.stdout.decode().rstrip("\r\n"))
+    return None
+
+
+def scan_path(path, depth, max_depth, excludes=[]):
+    """Git._scan_path(): recursive walk with os.listdir() and os.path.isdir(), the excludes are compiled for every
+    directory"""
+    if max_depth >= 0 and depth-1 > max_depth:
+        return
+    for exclude in excludes:
+        filter = filefilter.create_filter(exclude)
+        if filter.match(path):
+            return
+
+    for dir in os.listdir(path):
+        dir_path = os.path.join(path, dir)
+        if not os.path.isdir(dir_path):
+            continue
+        if dir == ".git":
+            yield dir_path
+            break
+        for dir2 in scan_path(dir_path, depth+1, max_depth, excludes):
+            yield dir2
+
+
+class GitRepo(object):
+    """GitRepo with equality by path and without hash, as the lists of the old reconciliation required"""
+    __slots__ = ("name", "path")
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+    def __eq__(self, other):
+        return self.path == other.path
+
+
+class GitRepoEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, GitRepo):
+            return {"name": o.name, "path": o.path}
+        return super().default(o)
+
+
+class GitRepoDecoder(json.JSONDecoder):
+    def __init__(self):
+        super().__init__(object_hook=self.dict_to_obj)
+
+    def dict_to_obj(self, decoded):
+        if "name" in decoded and "path" in decoded:
+            return GitRepo(decoded["name"], decoded["path"])
+        return decoded
+
+
+def save_repos(repos_path, git_repos):
+    """Git._save_repos(): the whole list as indented JSON, on every rename, removal and rescan"""
+    with open(repos_path, "w") as repos:
+        json.dump(git_repos, repos, indent=4, sort_keys=True, cls=GitRepoEncoder)
+
+
+def load_repos(repos_path):
+    """The repository list as Git.on_catalog() read it every time"""
+    with open(repos_path, "r") as repos:
+        return json.load(repos, cls=GitRepoDecoder)
+
+
+def reconcile(known_repos, git_repos):
+    """The end of Git._rescan(): removes the known repositories that weren't found and appends the new ones, with a
+    linear search for each repository. Returns the number of added and removed repositories."""
+    remove_repos = []
+    for repo in known_repos:
+        if repo not in git_repos:
+            remove_repos.append(repo)
+    removed = 0
+    for repo in remove_repos:
+        known_repos.remove(repo)
+        removed += 1
+    added = 0
+    for repo in git_repos:
+        if repo not in known_repos:
+            known_repos.append(repo)
+            added += 1
+    return added, removed
+
+
+class GitCommand(object):
+    """GitCommand as it was serialized into the data bags with repr() and read back with eval()"""
+    __slots__ = ("name", "label", "cmd", "args", "cwd", "internal")
+
+    def __init__(self, name, cmd, label=None, args=None, cwd=None, internal=False):
+        self.name = name
+        self.cmd = cmd
+        self.label = label
+        self.args = args
+        self.cwd = cwd
+        self.internal = internal
+
+    def __repr__(self):
+        return "GitCommand(name={}, label={}, cmd={}, args={}, cwd={}, internal={})" \
+            .format(repr(self.name),
+                    repr(self.label),
+                    repr(self.cmd),
+                    repr(self.args),
+                    repr(self.cwd),
+                    repr(self.internal))
+
+
+def command_items(plugin, cmds, git_path, repo_path):
+    """The command items of Git.on_suggest(): every command is copied and formatted, its icon is loaded and it is
+    serialized with repr()"""
+    items = []
+    for command in cmds:
+        copy_cmd = copy.copy(command)
+        copy_cmd.cwd = copy_cmd.cwd.format(repo_path=repo_path) if copy_cmd.cwd else None
+        command_item = plugin.create_item(
+            category=kp.ItemCategory.KEYWORD,
+            label=copy_cmd.label,
+            short_desc=copy_cmd.cmd,
+            target=copy_cmd.name + repo_path,
+            args_hint=kp.ItemArgsHint.REQUIRED,
+            hit_hint=kp.ItemHitHint.IGNORE,
+            icon_handle=plugin.load_icon("@{},0".format(copy_cmd.cmd)) if copy_cmd.cmd != git_path else None,
+            data_bag=repr(copy_cmd)
+        )
+        command_item.set_args(copy_cmd.args.format(repo_path=repo_path))
+        command_item.set_short_desc("{} {}".format(copy_cmd.cmd, command_item.raw_args()))
+        items.append(command_item)
+    return items
+
+
+def parse_data_bag(data_bag):
+    """The command of a data bag in Git.on_execute()"""
+    return eval(data_bag)
@@ -0,0 +1,73 @@
+"""Tests of the internal commands, the cmd_all ones run against local bare repositories as remotes
+
+Run from the package directory with
+
+    python -m unittest discover -s bench
+"""
+import os
+import shutil
+import threading
+import time
+import unittest
+
+import harness
+
+
+@unittest.skipUnless(harness.GIT_EXE, "git not found")
+class CmdAllTest(harness.CmdAllTestCase):
+    def test_fetch_all_repositories(self):
+        plugin = self.create_plugin(workers=4)
+        messages = self.run_cmd_all(plugin)
+        self.assert_fetched()
+        self.assertIn("{} succeeded, 0 failed".format(self.REPOS), self.summary(messages))
+
+    def test_output_of_each_repository_is_one_block(self):
+        plugin = self.create_plugin(workers=4, args="fetch --all --verbose")
+        messages = self.run_cmd_all(plugin)
+        for repo in self.repos:
+            blocks = [message for message in messages if message.startswith(repo + ":")]
+            self.assertEqual(len(blocks), 1, blocks)
+            self.assertIn("-> origin/master", blocks[0])
+
+    def test_failures_are_summarized(self):
+        harness.run_git(["remote", "set-url", "origin", os.path.join(self.root, "missing.git")], self.repos[0])
+        plugin = self.create_plugin(workers=4)
+        messages = self.run_cmd_all(plugin)
+        self.assertIn("{} succeeded, 1 failed (0 timed out)".format(self.REPOS - 1), self.summary(messages))
+        self.assertIn("  failed: " + self.repos[0], messages)
+
+    def test_timeout_kills_the_command(self):
+        plugin = self.create_plugin(cmd=shutil.which("sleep") or "sleep", args="10", workers=self.REPOS, timeout=1)
+        messages = self.run_cmd_all(plugin)
+        self.assertIn("0 succeeded, {0} failed ({0} timed out)".format(self.REPOS), self.summary(messages))
+
+    def test_timeout_kills_the_started_processes(self):
+        # the shell waits for sleep, which keeps the output pipe open if only the shell is killed
+        plugin = self.create_plugin(cmd=shutil.which("sh") or "sh", args='-c "sleep 6; true"', workers=self.REPOS,
+                                    timeout=1)
+        start_time = time.time()
+        messages = self.run_cmd_all(plugin)
+        self.assertLess(time.time() - start_time, 4)
+        self.assertIn("0 succeeded, {0} failed ({0} timed out)".format(self.REPOS), self.summary(messages))
+
+    def test_no_icon_is_loaded(self):
+        plugin = self.create_plugin(cmd=shutil.which("sleep") or "sleep", args="0")
+        self.assertIsNone(plugin._cmds_all["Cmd"].icon_handle)
+        self.assertEqual(plugin._icons, {})
+
+    def test_interactive_command_does_not_wait_for_background_work(self):
+        plugin = self.create_plugin()
+        plugin._git_runner.set_max_processes(1)
+        plugin.log = []
+        # a background process holds the only slot
+        with plugin._git_runner._semaphore:
+            thread = threading.Thread(target=plugin._run_command,
+                                      args=(plugin._git_path, "rev-parse HEAD", True, self.repos[0]))
+            thread.start()
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertIn("returned 0", plugin.log[-1][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
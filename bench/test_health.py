@@ -0,0 +1,52 @@
+"""Tests of the checks of the volumes and repositories
+
+Run from the package directory with
+
+    python -m unittest discover -s bench
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import harness
+
+
+class HealthCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="git-bench-")
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.checker = harness.git.RepoHealthChecker(0.2)
+        self.volume = self.checker.volume(self.root)
+
+    def hang(self):
+        """Makes the last check of the volume hang, returns the check and the event that ends it"""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        check = harness.git.VolumeCheck(self.volume, [])
+        check._thread = threading.Thread(target=release.wait, daemon=True)
+        check._thread.start()
+        check.progress = time.monotonic() - 1
+        self.checker._checks[self.volume] = check
+        return check, release
+
+    def test_missing_paths(self):
+        missing = os.path.join(self.root, "missing")
+        self.assertEqual(self.checker.check([self.root, missing]), ({missing}, frozenset()))
+
+    def test_hanging_volume_is_not_checked_again(self):
+        check, release = self.hang()
+        missing = os.path.join(self.root, "missing")
+        self.assertEqual(self.checker.check([missing]), (set(), frozenset([self.volume])))
+        self.assertEqual(self.checker.probe([self.root]), frozenset([self.volume]))
+        self.assertIs(self.checker._checks[self.volume], check)
+
+        release.set()
+        check._thread.join()
+        self.assertEqual(self.checker.check([missing]), ({missing}, frozenset()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Tests of the network cmd_all commands against file:// remotes and a local git daemon
+
+Run from the package directory with
+
+    python -m unittest discover -s bench
+"""
+import os
+import pathlib
+import threading
+import time
+import unittest
+
+import harness
+
+
+@unittest.skipUnless(harness.GIT_EXE, "git not found")
+class NetworkTest(harness.CmdAllTestCase):
+    CMD_ALL = dict(harness.CmdAllTestCase.CMD_ALL, label="Fetch all", network="yes", workers=4)
+    # every fetch takes at least that long, so that fetches that may overlap do
+    FETCH_SECONDS = 0.2
+
+    def start_daemon(self):
+        daemon = harness.GitDaemon(self.remotes)
+        if not daemon.start():
+            self.skipTest("git daemon didn't start")
+        self.addCleanup(daemon.stop)
+        return daemon
+
+    def set_remote(self, url, repos=None):
+        for repo in repos or self.repos:
+            harness.run_git(["remote", "set-url", "origin", url], repo)
+
+    def track_fetches(self, plugin):
+        """Makes every fetch of plugin take FETCH_SECONDS at least, returns a dict with the most fetches at a time"""
+        lock = threading.Lock()
+        fetches = {"running": 0, "max": 0}
+        run_internal = plugin._run_internal
+
+        def tracked(*args, **kwargs):
+            with lock:
+                fetches["running"] += 1
+                fetches["max"] = max(fetches["max"], fetches["running"])
+            try:
+                time.sleep(self.FETCH_SECONDS)
+                return run_internal(*args, **kwargs)
+            finally:
+                with lock:
+                    fetches["running"] -= 1
+
+        plugin._run_internal = tracked
+        return fetches
+
+    def test_fetch_over_file_urls(self):
+        self.set_remote(pathlib.Path(self.remote).as_uri())
+        harness.run_git(["remote", "remove", "origin"], self.repos[0])
+        plugin = self.create_plugin()
+        messages = self.run_cmd_all(plugin)
+        self.assert_fetched(self.repos[1:])
+        self.assertIn("(0 skipped as fresh, 1 without remotes)", messages[0])
+        self.assertIn("{} succeeded, 0 failed".format(self.REPOS - 1), self.summary(messages))
+
+    def test_fetch_from_git_daemon(self):
+        daemon = self.start_daemon()
+        self.set_remote(daemon.url("upstream.git"))
+        plugin = self.create_plugin()
+        messages = self.run_cmd_all(plugin)
+        self.assert_fetched()
+        self.assertIn("{} succeeded, 0 failed".format(self.REPOS), self.summary(messages))
+
+    def test_host_workers_limit_the_fetches_per_host(self):
+        daemon = self.start_daemon()
+        self.set_remote(daemon.url("upstream.git"))
+        plugin = self.create_plugin(host_workers=1)
+        fetches = self.track_fetches(plugin)
+        messages = self.run_cmd_all(plugin)
+        self.assert_fetched()
+        self.assertIn("{} succeeded, 0 failed".format(self.REPOS), self.summary(messages))
+        self.assertEqual(fetches["max"], 1)
+
+    def test_local_remotes_are_not_limited_per_host(self):
+        self.set_remote(pathlib.Path(self.remote).as_uri())
+        plugin = self.create_plugin(host_workers=1)
+        fetches = self.track_fetches(plugin)
+        self.run_cmd_all(plugin)
+        self.assert_fetched()
+        self.assertGreater(fetches["max"], 1)
+
+    def test_fresh_repositories_are_skipped(self):
+        self.set_remote(pathlib.Path(self.remote).as_uri())
+        plugin = self.create_plugin(fresh_for=300)
+        self.run_cmd_all(plugin)
+        messages = self.run_cmd_all(plugin)
+        self.assertIn("on 0 repositories", messages[0])
+        self.assertIn("({} skipped as fresh, 0 without remotes)".format(self.REPOS), messages[0])
+
+    def test_failures_on_a_host_are_retried(self):
+        daemon = self.start_daemon()
+        daemon.stop()
+        repos = self.repos[:2]
+        self.set_remote(daemon.url("upstream.git"), repos)
+        plugin = self.create_plugin(retries=1, retry_delay=0)
+        messages = self.run_cmd_all(plugin, repos)
+        self.assertIn("0 succeeded, 2 failed (0 timed out), 2 retries", self.summary(messages))
+        self.assertEqual(len([message for message in messages if "retrying (attempt 2 of 2)" in message]), 2)
+
+    def test_repository_errors_dont_skip_the_host(self):
+        daemon = self.start_daemon()
+        self.set_remote(daemon.url("upstream.git"), self.repos[-1:])
+        # more missing remote repositories on the host than MAX_HOST_FAILURES
+        broken = self.repos[:-1]
+        for number, repo in enumerate(broken):
+            self.set_remote(daemon.url("missing{}.git".format(number)), [repo])
+        plugin = self.create_plugin(host_workers=1, retries=1, retry_delay=0)
+        messages = self.run_cmd_all(plugin)
+        self.assert_fetched(self.repos[-1:])
+        self.assertIn("1 succeeded, {0} failed (0 timed out), {0} retries".format(len(broken)),
+                      self.summary(messages))
+        self.assertFalse([message for message in messages if "skipped" in message and "failed to connect" in message])
+
+    def test_retries_of_a_repository_count_once_against_its_host(self):
+        scheduler = harness.git.CommandScheduler(1, 1, harness.git.CommandScheduler.MAX_HOST_FAILURES * 2, 0)
+        refused = harness.git.CommandResult("", 128, "fatal: unable to connect to host: Connection refused", 0.0)
+        jobs = [harness.git.ScheduledJob(harness.git.GitRepo(name, os.path.join(self.root, name)), ("host",))
+                for name in ("unreachable", "other")]
+        results = []
+        scheduler.run(jobs,
+                      lambda job: refused,
+                      lambda job, result, final: results.append((job.repo.name, result.returncode, final)))
+        self.assertEqual(results.count(("unreachable", 128, False)), scheduler.retries)
+        self.assertEqual(results.count(("other", 128, False)), scheduler.retries)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+"""Tests of partial rescans and the scan index
+
+Run from the package directory with
+
+    python -m unittest discover -s bench
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import harness
+
+
+class RescanTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="git-bench-")
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.work = os.path.join(self.root, "work")
+        self.other = os.path.join(self.root, "other")
+        self.repos = harness.make_tree(self.work, 4, 2)
+        harness.make_tree(self.other, 4, 2)
+
+    def create_plugin(self, excludes=None):
+        plugin = harness.create_plugin(self.settings(excludes), os.path.join(self.root, "cache"))
+        self.addCleanup(harness.stop_plugin, plugin)
+        harness.rescan(plugin, True)
+        return plugin
+
+    def settings(self, excludes=None):
+        return harness.settings_text({"Work": {"paths": [self.work], "excludes": excludes or []},
+                                      "Other": {"paths": [self.other]}})
+
+    def indexed(self, plugin, root):
+        prefix = os.path.join(root, "")
+        return set(path for path in plugin._load_scan_index() if path == root or path.startswith(prefix))
+
+    def test_deleted_directories_are_dropped(self):
+        plugin = self.create_plugin()
+        deleted = os.path.join(self.work, "noise0")
+        other = self.indexed(plugin, self.other)
+        self.assertIn(deleted, self.indexed(plugin, self.work))
+        shutil.rmtree(deleted)
+        harness.rescan(plugin, scan_paths={"Work"})
+        indexed = self.indexed(plugin, self.work)
+        self.assertNotIn(deleted, indexed)
+        self.assertNotIn(os.path.join(deleted, "sub"), indexed)
+        self.assertEqual(self.indexed(plugin, self.other), other)
+
+    def test_excluded_directories_are_dropped(self):
+        plugin = self.create_plugin()
+        excluded = os.path.join(self.work, "noise1")
+        self.assertIn(excluded, self.indexed(plugin, self.work))
+        harness.configure(plugin, self.settings([os.path.join(self.work, "noise1")]))
+        harness.rescan(plugin, scan_paths={"Work"})
+        self.assertNotIn(excluded, self.indexed(plugin, self.work))
+        self.assertIn(os.path.join(self.work, "noise0"), self.indexed(plugin, self.work))
+
+    def test_excluded_subtree_is_not_walked(self):
+        plugin = self.create_plugin([os.path.join("**", "noise1", "**")])
+        indexed = self.indexed(plugin, self.work)
+        self.assertNotIn(os.path.join(self.work, "noise1"), indexed)
+        self.assertNotIn(os.path.join(self.work, "noise1", "sub"), indexed)
+        self.assertIn(os.path.join(self.work, "noise0", "sub"), indexed)
+
+    def test_excludes_are_matched_with_filefilter(self):
+        plugin = self.create_plugin([os.path.join("**", "noise[1]")])
+        indexed = self.indexed(plugin, self.work)
+        self.assertNotIn(os.path.join(self.work, "noise1"), indexed)
+        self.assertIn(os.path.join(self.work, "noise0"), indexed)
+
+    def test_rescan_of_directories_keeps_the_repositories_outside_of_them(self):
+        plugin = self.create_plugin()
+        added = harness.make_fake_repo(os.path.join(self.work, "d0", "added"))
+        shutil.rmtree(self.repos[1])
+        plugin._on_scan_paths_changed({"Work"}, {"Work": {os.path.join(self.work, "d0")}})
+        harness.wait_rescan(plugin)
+        paths = set(repo.path for repo in plugin._git_repos)
+        self.assertIn(added, paths)
+        self.assertIn(self.repos[1], paths)
+        self.assertIn(self.repos[0], paths)
+        self.assertIn(added, self.indexed(plugin, self.work))
+
+    def test_walks_of_changed_directories(self):
+        walks = harness.git.Git._subtree_walks
+        d0 = os.path.join(self.work, "d0")
+        self.assertEqual(walks([self.work], 1, {d0, os.path.join(d0, "noise0"), os.path.join(self.other, "d0")}),
+                         [([d0], 0)])
+        # the scan of the scan path doesn't list anything below d0/noise0
+        self.assertEqual(walks([self.work], 1, {os.path.join(d0, "noise0", "sub")}), [])
+        self.assertEqual(walks([self.work], -1, {os.path.join(d0, "noise0", "sub"), os.path.join(d0, "gone")}),
+                         [([d0], -1)])
+        self.assertEqual(walks([self.work], 2, {os.path.join(d0, "noise0", "sub"), os.path.join(self.work, "d1")}),
+                         [([os.path.join(d0, "noise0")], 0), ([os.path.join(self.work, "d1")], 1)])
+
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="git-bench-")
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.missing = os.path.join(self.root, "missing")
+        os.makedirs(self.missing)
+        # the index keeps the entry like it does for offline volumes
+        self.index = {self.root: [os.stat(self.root).st_mtime_ns, 0, None, ["missing"]],
+                      self.missing: [os.stat(self.missing).st_mtime_ns, 0, None, []]}
+        self.changes = []
+
+    def watch(self, seconds):
+        watcher = harness.git.RepoWatcher({"Root": [self.root]}, lambda: self.index, self.changes.append, 0.02, 0)
+        watcher.start()
+        try:
+            time.sleep(seconds)
+        finally:
+            watcher.stop()
+
+    def test_missing_directory_is_reported_once(self):
+        os.rmdir(self.missing)
+        self.index[self.root][0] = os.stat(self.root).st_mtime_ns
+        self.watch(0.3)
+        self.assertEqual(self.changes, [{"Root"}])
+
+    def test_missing_directory_is_reported_again_when_it_changes(self):
+        changed = harness.git.RepoWatcher._changed
+        missing = set()
+        os.rmdir(self.missing)
+        self.index[self.root][0] = os.stat(self.root).st_mtime_ns
+        self.assertTrue(changed(self.index, [self.root], missing))
+        self.assertFalse(changed(self.index, [self.root], missing))
+        os.makedirs(self.missing)
+        self.index[self.root][0] = os.stat(self.root).st_mtime_ns
+        os.utime(self.missing, ns=(0, 0))
+        self.assertTrue(changed(self.index, [self.root], missing))
+        self.assertEqual(missing, set())
+
+    def test_changes_inside_repositories_and_excluded_directories_are_dropped(self):
+        repo = os.path.join(self.root, "repo")
+        self.index[repo] = [0, 0, os.path.join(repo, ".git"), []]
+        excludes = {"Root": harness.git.ExcludeMatcher([os.path.join("**", "build")]).match}
+        watcher = harness.git.RepoWatcher({"Root": [self.root]}, lambda: self.index, self.changes.append, 0.02, 0,
+                                          excludes)
+
+        def changed(*parts):
+            return watcher._changed_directory("Root", self.root, os.path.join(*parts))
+
+        self.assertEqual(changed("added"), self.root)
+        self.assertEqual(changed("added", "sub"), os.path.join(self.root, "added"))
+        self.assertEqual(changed("added", ".git", "refs"), os.path.join(self.root, "added"))
+        self.assertEqual(changed("repo", ".git"), repo)
+        self.assertIsNone(changed("repo", "src"))
+        self.assertIsNone(changed("repo", ".git", "refs"))
+        self.assertIsNone(changed("build"))
+        self.assertIsNone(changed("added", "build", "out"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+"""Tests of the repository status shown in the repository items
+
+Run from the package directory with
+
+    python -m unittest discover -s bench
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import harness
+
+
+@unittest.skipUnless(harness.GIT_EXE, "git not found")
+class StatusTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="git-bench-")
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.repo = harness.make_real_repo(os.path.join(self.root, "repo"))
+        self.cache = harness.git.RepoStatusCache(1)
+
+    def status(self):
+        git_repo = harness.git.GitRepo("repo", self.repo)
+        self.assertTrue(self.cache._refresh_repo(git_repo, harness.GIT_EXE))
+        return self.cache.get(git_repo)
+
+    def test_clean_repository(self):
+        status = self.status()
+        self.assertEqual(status.branch, "master")
+        self.assertFalse(status.dirty)
+
+    def test_headers_of_a_long_status_are_kept(self):
+        harness.run_git(["checkout", "-q", "-b", "topic"], self.repo)
+        # more output than the megabyte GitProcessRunner.run() keeps
+        for number in range(6000):
+            open(os.path.join(self.repo, "untracked-{:0>200}.txt".format(number)), "w").close()
+        status = self.status()
+        self.assertEqual(status.branch, "topic")
+        self.assertTrue(status.dirty)
+
+
+if __name__ == "__main__":
+    unittest.main()
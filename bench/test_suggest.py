@@ -0,0 +1,124 @@
+"""Tests of the suggestions of repositories
+
+Run from the package directory with
+
+    python -m unittest discover -s bench
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import harness
+import keypirinha_util
+
+
+@unittest.skipUnless(harness.GIT_EXE, "git not found")
+class SuggestTest(unittest.TestCase):
+    FILES = 300
+    MAX_FILE_SUGGESTIONS = 100
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="git-bench-")
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.repos_path = os.path.join(self.root, "repos")
+        self.repo = harness.make_real_repo(os.path.join(self.repos_path, "big"), self.FILES)
+
+    def create_plugin(self):
+        settings = harness.settings_text({"Repos": {"paths": [self.repos_path]}},
+                                         main={"profile": "yes",
+                                               "max_file_suggestions": self.MAX_FILE_SUGGESTIONS},
+                                         files={"Text": {"pattern": ["**/*.txt"]}})
+        plugin = harness.create_plugin(settings, os.path.join(self.root, "cache"))
+        self.addCleanup(harness.stop_plugin, plugin)
+        harness.rescan(plugin)
+        plugin.on_catalog()
+        return plugin
+
+    @staticmethod
+    def files(suggestions):
+        return [item.target() for item in suggestions if item.category() == harness.kp.ItemCategory.FILE]
+
+    @staticmethod
+    def spawns(plugin, name):
+        return plugin._perf.to_dict()["counters"].get("spawns." + name, 0)
+
+    def ls_files_spawns(self, plugin):
+        return self.spawns(plugin, "git.ls_files")
+
+    def test_files_are_capped(self):
+        plugin = self.create_plugin()
+        suggestions, _, _ = harness.suggest(plugin, "", [harness.repo_item(plugin, self.repo)])
+        self.assertEqual(len(self.files(suggestions)), self.MAX_FILE_SUGGESTIONS)
+
+    def test_capped_listing_is_indexed(self):
+        plugin = self.create_plugin()
+        item = harness.repo_item(plugin, self.repo)
+        harness.suggest(plugin, "", [item])
+        plugin.on_deactivated()
+        indexed = plugin._file_index.lookup(self.repo, plugin._file_matcher)
+        self.assertEqual(len(indexed), self.FILES)
+
+        suggestions, _, _ = harness.suggest(plugin, "", [item])
+        self.assertEqual(len(self.files(suggestions)), self.MAX_FILE_SUGGESTIONS)
+        self.assertEqual(self.ls_files_spawns(plugin), 1)
+
+    def test_abandoned_listing_is_not_indexed(self):
+        plugin = self.create_plugin()
+        plugin.terminate.set()
+        harness.suggest(plugin, "", [harness.repo_item(plugin, self.repo)])
+        self.assertIsNone(plugin._file_index.lookup(self.repo, plugin._file_matcher))
+
+    def test_listing_without_matches_yields_after_every_chunk(self):
+        index = harness.git.RepoFileIndex(1)
+        matcher = harness.git.FilePatternMatcher(["**/*.none"])
+        batches = index.stream(self.repo, harness.GIT_EXE, matcher)
+        self.assertEqual(next(batches), [])
+        batches.close()
+        self.assertIsNone(index.lookup(self.repo, matcher))
+
+    def test_head_commit_is_read_when_it_is_copied(self):
+        plugin = self.create_plugin()
+        suggestions, _, _ = harness.suggest(plugin, "", [harness.repo_item(plugin, self.repo)])
+        copy_head = [item for item in suggestions if item.target() == plugin.COMMAND_COPY_HEAD]
+        self.assertEqual(len(copy_head), 1)
+        self.assertEqual(self.spawns(plugin, "git.cat_file"), 0)
+
+        del keypirinha_util.calls[:]
+        plugin.on_execute(copy_head[0], None)
+        head = harness.run_git(["rev-parse", "HEAD"], self.repo).strip()
+        self.assertEqual(keypirinha_util.calls, [("set_clipboard", head)])
+
+    def test_files_of_another_repository_are_listed(self):
+        other = harness.make_real_repo(os.path.join(self.repos_path, "other"))
+        plugin = self.create_plugin()
+        harness.suggest(plugin, "", [harness.repo_item(plugin, self.repo)])
+        repos_item = harness.keyword_item(plugin, plugin.COMMAND_REPOS)
+        harness.suggest(plugin, "", [repos_item])
+        suggestions, _, _ = harness.suggest(plugin, "", [repos_item, harness.repo_item(plugin, other)])
+        self.assertEqual(sorted(self.files(suggestions)),
+                         sorted(os.path.join(other, os.path.normpath(file))
+                                for file in harness.run_git(["ls-files"], other).split()))
+
+    def test_files_of_a_worktree_are_listed(self):
+        worktree = os.path.join(self.repos_path, "big-feature")
+        harness.run_git(["worktree", "add", "-q", "-b", "feature", worktree], self.repo)
+        with open(os.path.join(worktree, "feature.txt"), "w") as feature_file:
+            feature_file.write("feature\n")
+        harness.run_git(["add", "feature.txt"], worktree)
+        harness.run_git(["commit", "-q", "-m", "Feature"], worktree)
+        plugin = self.create_plugin()
+        item = harness.repo_item(plugin, self.repo)
+        suggestions, _, _ = harness.suggest(plugin, "", [item])
+        self.assertNotIn(os.path.join(self.repo, "feature.txt"), self.files(suggestions))
+        worktree_item = harness.repo_item(plugin, worktree)
+        self.assertIn(worktree_item, suggestions)
+
+        suggestions, _, _ = harness.suggest(plugin, "", [item, worktree_item])
+        files = self.files(suggestions)
+        self.assertIn(os.path.join(worktree, "feature.txt"), files)
+        self.assertFalse([file for file in files if not file.startswith(os.path.join(worktree, ""))])
+
+
+if __name__ == "__main__":
+    unittest.main()
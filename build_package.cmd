@@ -42,6 +42,7 @@ echo Using "%SEVENZIP%" to pack
     -tzip "%PACKAGE_NAME%.keypirinha-package" ^
     -x!%~nx0 ^
     -xr!.git ^
+    -xr!bench ^
     -xr!usage.gif ^
     -xr@.gitignore ^
     -x!.gitignore ^
@@ -6,7 +6,18 @@ import subprocess
 import os
 import json
 import time
+import re
 import copy
+import signal
+import itertools
+import bisect
+import string
+import zlib
+import struct
+import ctypes
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
 class Git(kp.Plugin):
@@ -15,31 +26,115 @@ class Git(kp.Plugin):
     CONFIG_PREFIX_CMD_ALL = "cmd_all/"
     CONFIG_PREFIX_FILE = "file/"
     COMMAND_RESCAN = "rescan"
+    COMMAND_RESCAN_FULL = "rescan_full"
     COMMAND_REMOVE_OLD = "remove_old"
     COMMAND_OPEN_GIT_BASH = "open_git_bash"
     COMMAND_CMD_ALL = "cmd_all"
     COMMAND_RENAME = "rename"
     COMMAND_COPY_PATH = "copy_path"
+    COMMAND_COPY_HEAD = "copy_head"
+    COMMAND_REPOS = "repos"
+    COMMAND_SHOW_STATS = "show_stats"
     ARGS_TOP_LEVEL = "rev-parse --show-toplevel"
+    DEFAULT_SCAN_WORKERS = 8
+    DEFAULT_STATUS_WORKERS = 4
+    DEFAULT_FILE_INDEX_SIZE = 32
+    DEFAULT_MAX_FILE_SUGGESTIONS = 100
+    DEFAULT_WATCH_INTERVAL = 60
+    DEFAULT_WATCH_DELAY = 5
+    DEFAULT_HEALTH_CHECK_INTERVAL = 600
+    DEFAULT_HEALTH_CHECK_TIMEOUT = 5
+    DEFAULT_MAX_PROCESSES = 8
+    DEFAULT_MAX_BATCH_PROCESSES = 8
+    DEFAULT_FRECENCY_HALF_LIFE = 14
+    DEFAULT_MAX_REPO_SUGGESTIONS = 100
 
     def __init__(self):
         super().__init__()
         self._git_path = "git"
+        self._git_path_found = None
         self._git_bash_path = None
+        self._config_fingerprints = {}
+        self._scan_workers = self.DEFAULT_SCAN_WORKERS
+        self._show_status = True
+        self._perf = PerfStats()
+        self._status_cache = RepoStatusCache(self.DEFAULT_STATUS_WORKERS)
+        self._git_runner = GitProcessRunner(self.DEFAULT_MAX_PROCESSES, self.DEFAULT_MAX_BATCH_PROCESSES)
+        self._git_runner.perf = self._perf
+        self._status_cache.runner = self._git_runner
         self._scan_paths = []
-        self._cmds = []
-        self._cmds_all = []
+        self._cmds = {}
+        self._cmds_all = {}
+        self._icons = {}
         self._file_patterns = []
         self._git_repos = []
+        self._repos_lock = threading.RLock()
+        self._repo_cache = None
+        self._catalog_lock = threading.RLock()
+        self._catalog_items = {}
+        self._catalog_signatures = None
+        self._catalog_created = 0
+        self._rescan_lock = threading.Lock()
+        self._rescan_thread = None
+        self._rescan_cancel = None
+        self._rescan_full = False
+        self._rescan_scan_paths = None
+        self._rescan_directories = {}
+        self._rescan_git_spawns = 0
+        self._file_matcher = FilePatternMatcher([])
+        self._scan_index = None
+        self._watch = False
+        self._watch_interval = self.DEFAULT_WATCH_INTERVAL
+        self._watch_delay = self.DEFAULT_WATCH_DELAY
+        self._watcher = None
+        self._watcher_config = None
+        self._health_checker = RepoHealthChecker(self.DEFAULT_HEALTH_CHECK_TIMEOUT)
+        self._health_lock = threading.Lock()
+        self._health_check_interval = self.DEFAULT_HEALTH_CHECK_INTERVAL
+        self._health_stop = None
+        self._health_stop_interval = None
+        self._offline_volumes = frozenset()
+        self._frecency_half_life = self.DEFAULT_FRECENCY_HALF_LIFE
+        self._max_repo_suggestions = self.DEFAULT_MAX_REPO_SUGGESTIONS
+        self._ranked_repos = None
+        self._repo_children = {}
+        self._command_results_lock = threading.Lock()
+        self._file_index = RepoFileIndex(self.DEFAULT_FILE_INDEX_SIZE)
+        self._file_index.runner = self._git_runner
+        self._max_file_suggestions = self.DEFAULT_MAX_FILE_SUGGESTIONS
+        # (path key, files) of the repository whose files were suggested last in this session
         self._files = None
 
     def on_start(self):
         self._read_config()
+        self._update_watcher()
+        self._update_health_check()
 
     def on_events(self, flags):
         if flags & kp.Events.PACKCONFIG:
-            self._read_config()
-            self.on_catalog()
+            changed_scan_paths = self._read_config()
+            if changed_scan_paths and self._get_repo_cache().exists():
+                self._rescan_changed(changed_scan_paths)
+            self._update_watcher()
+            self._update_health_check()
+            self._update_catalog()
+
+    def _rescan_changed(self, changed_scan_paths):
+        """Removes the repositories of removed scan paths and rescans the scan paths that were added or changed"""
+        scan_path_names = set(scan_path["name"] for scan_path in self._scan_paths)
+        removed_scan_paths = changed_scan_paths - scan_path_names
+        if removed_scan_paths:
+            self._load_repos()
+            with self._repos_lock:
+                keep_repos = [repo for repo in self._git_repos if repo.scan_path not in removed_scan_paths]
+                if len(keep_repos) != len(self._git_repos):
+                    self.info("Removing", len(self._git_repos) - len(keep_repos), "repositories of removed scan paths")
+                    self._git_repos[:] = keep_repos
+                    self._save_repos()
+        rescan = changed_scan_paths & scan_path_names
+        if rescan:
+            self.info("Configuration of", ", ".join(sorted(rescan)), "changed")
+            self._start_rescan(scan_paths=rescan)
 
     def _check_git_path(self):
         self.dbg("_check_git_path")
@@ -47,12 +142,11 @@ class Git(kp.Plugin):
             self._try_set_default_icon(self._git_path)
             return True
         else:
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            proc = subprocess.run("where " + self._git_path, stdout=subprocess.PIPE, startupinfo=startupinfo)
-            if proc.returncode != 0:
+            # the plugin can't do anything without git, the check doesn't queue behind background processes
+            result = self._git_runner.run("where", "where " + self._git_path, throttle=False)
+            if result.returncode != 0:
                 return False
-            lines = proc.stdout.decode().splitlines()
+            lines = result.output.splitlines()
             if len(lines) == 0:
                 return False
             self._try_set_default_icon(lines[0])
@@ -83,26 +177,89 @@ class Git(kp.Plugin):
             return
 
     def _read_config(self):
+        """Reads the configuration, only sections that changed since the last call are processed again
+
+        Returns the names of the scan paths that were added, changed or removed.
+        """
         self.dbg("Reading config")
         settings: kp.Settings = self.load_settings()
 
         self._debug = settings.get_bool("debug", "main", False)
-
-        self._git_path = settings.get("git_exe", "main", "git")
-        if not self._check_git_path():
-            self.err("no git executable found!")
-
+        self._perf.enabled = settings.get_bool("profile", "main", False)
+        self._watch = settings.get_bool("watch", "main", False)
+        self._watch_interval = settings.get_int("watch_interval", "main", self.DEFAULT_WATCH_INTERVAL, min=1)
+        self._watch_delay = settings.get_int("watch_delay", "main", self.DEFAULT_WATCH_DELAY, min=0)
+        self._health_check_interval = settings.get_int("health_check_interval",
+                                                       "main",
+                                                       self.DEFAULT_HEALTH_CHECK_INTERVAL,
+                                                       min=0)
+        self._health_checker.timeout = settings.get_int("health_check_timeout",
+                                                        "main",
+                                                        self.DEFAULT_HEALTH_CHECK_TIMEOUT,
+                                                        min=1)
+
+        self._scan_workers = settings.get_int("scan_workers", "main", self.DEFAULT_SCAN_WORKERS, min=1)
+        self._show_status = settings.get_bool("show_status", "main", True)
+        self._status_cache.workers = settings.get_int("status_workers", "main", self.DEFAULT_STATUS_WORKERS, min=1)
+        self._git_runner.set_max_processes(settings.get_int("max_processes",
+                                                            "main",
+                                                            self.DEFAULT_MAX_PROCESSES,
+                                                            min=1))
+        self._git_runner.max_batch_processes = settings.get_int("max_batch_processes",
+                                                                "main",
+                                                                self.DEFAULT_MAX_BATCH_PROCESSES,
+                                                                min=1)
+        self._frecency_half_life = settings.get_int("frecency_half_life",
+                                                    "main",
+                                                    self.DEFAULT_FRECENCY_HALF_LIFE,
+                                                    min=1)
+        if self._repo_cache is not None:
+            self._repo_cache.frecency.half_life = self._frecency_half_life * 24 * 60 * 60
+        self._max_repo_suggestions = settings.get_int("max_repo_suggestions",
+                                                      "main",
+                                                      self.DEFAULT_MAX_REPO_SUGGESTIONS,
+                                                      min=1)
+        self._file_index.max_size = settings.get_int("file_index_size", "main", self.DEFAULT_FILE_INDEX_SIZE, min=1)
+        self._max_file_suggestions = settings.get_int("max_file_suggestions",
+                                                      "main",
+                                                      self.DEFAULT_MAX_FILE_SUGGESTIONS,
+                                                      min=0)
+
+        git_path = settings.get("git_exe", "main", "git")
+        git_path_changed = git_path != self._git_path or self._git_path_found is None
+        self._git_path = git_path
+        if git_path_changed:
+            self._git_runner.close()
+            self._git_path_found = self._check_git_path()
+            if not self._git_path_found:
+                self.err("no git executable found!")
+
+        old_fingerprints = self._config_fingerprints
+        self._config_fingerprints = {}
+        old_scan_paths = dict((scan_path["name"], scan_path) for scan_path in self._scan_paths)
+        old_cmds = self._cmds
+        old_cmds_all = self._cmds_all
         self._scan_paths = []
-        self._cmds = []
-        self._cmds_all = []
-        self._file_patterns = []
+        self._cmds = {}
+        self._cmds_all = {}
+        old_icons = self._icons
+        self._icons = {}
+        file_patterns = []
+        changed_scan_paths = set()
         for section in settings.sections():
+            fingerprint = tuple((key, settings.get(key, section)) for key in settings.keys(section))
+            self._config_fingerprints[section] = fingerprint
+            unchanged = old_fingerprints.get(section) == fingerprint
             if section.startswith(self.CONFIG_PREFIX_SCAN_PATH):
                 keys = settings.keys(section)
                 scan_path = {}
                 if "paths" not in keys:
                     continue
-                scan_path["name"] = section.lstrip(self.CONFIG_PREFIX_SCAN_PATH)
+                scan_path["name"] = section[len(self.CONFIG_PREFIX_SCAN_PATH):]
+                if unchanged and scan_path["name"] in old_scan_paths:
+                    self._scan_paths.append(old_scan_paths[scan_path["name"]])
+                    continue
+                changed_scan_paths.add(scan_path["name"])
 
                 paths = []
                 paths_val = settings.get_multiline("paths", section)
@@ -119,8 +276,13 @@ class Git(kp.Plugin):
                 excludes = settings.get_multiline("excludes", section)
                 if excludes:
                     scan_path["excludes"] = excludes
+                    scan_path["exclude_matcher"] = ExcludeMatcher(excludes)
                 self._scan_paths.append(scan_path)
             elif section.startswith(self.CONFIG_PREFIX_CMD):
+                name = section[len(self.CONFIG_PREFIX_CMD):]
+                if unchanged and not git_path_changed and name in old_cmds:
+                    self._reuse_command(old_cmds[name], self._cmds, old_icons)
+                    continue
                 cmd = settings.get_stripped("cmd", section)
                 if not cmd:
                     self.err(section, "has no 'cmd'")
@@ -128,15 +290,21 @@ class Git(kp.Plugin):
                 if os.path.isabs(cmd) and not os.path.exists(cmd):
                     self.dbg(section, "cmd is absolute path and does not exist", cmd)
                     continue
-                command = GitCommand(section.lstrip(self.CONFIG_PREFIX_CMD),
+                command = GitCommand(name,
                                      cmd.format(git_exe=self._git_path),
-                                     settings.get("label", section, section.lstrip(self.CONFIG_PREFIX_CMD)),
+                                     settings.get("label", section, name),
                                      settings.get("args", section, '"{repo_path}"'),
                                      settings.get("cwd", section, None),
                                      settings.get_bool("internal", section, False))
                 self.dbg(repr(command))
-                self._cmds.append(command)
+                template = self._compile_command(section, command, old_icons)
+                if template:
+                    self._cmds[command.name] = template
             elif section.startswith(self.CONFIG_PREFIX_CMD_ALL):
+                name = section[len(self.CONFIG_PREFIX_CMD_ALL):]
+                if unchanged and not git_path_changed and name in old_cmds_all:
+                    self._reuse_command(old_cmds_all[name], self._cmds_all, old_icons)
+                    continue
                 cmd = settings.get_stripped("cmd", section)
                 if not cmd:
                     self.err(section, "has no 'cmd'")
@@ -144,91 +312,490 @@ class Git(kp.Plugin):
                 if os.path.isabs(cmd) and not os.path.exists(cmd):
                     self.dbg(section, "cmd is absolute path and does not exist", cmd)
                     continue
-                command = GitCommand(section.lstrip(self.CONFIG_PREFIX_CMD_ALL),
+                command = GitCommand(name,
                                      cmd.format(git_exe=self._git_path),
-                                     settings.get("label", section, section.lstrip(self.CONFIG_PREFIX_CMD_ALL)),
+                                     settings.get("label", section, name),
                                      settings.get("args", section, ""),
-                                     internal=settings.get_bool("internal", section, False))
-                self._cmds_all.append(command)
+                                     internal=settings.get_bool("internal", section, False),
+                                     workers=settings.get_int("workers", section, 1, min=1),
+                                     timeout=settings.get_int("timeout", section, 0, min=0),
+                                     network=settings.get_bool("network", section, False),
+                                     host_workers=settings.get_int("host_workers", section, 2, min=1),
+                                     retries=settings.get_int("retries", section, 0, min=0),
+                                     retry_delay=settings.get_int("retry_delay", section, 5, min=0),
+                                     fresh_for=settings.get_int("fresh_for", section, 0, min=0))
+                # the items of cmd_all commands have no icon of their own
+                template = self._compile_command(section, command, old_icons, icon=False)
+                if template:
+                    self._cmds_all[command.name] = template
             elif section.startswith(self.CONFIG_PREFIX_FILE):
                 pattern = settings.get_multiline("pattern", section)
                 if not pattern:
                     self.err(section, "has no 'pattern'")
                     continue
-                self._file_patterns.extend(pattern)
+                file_patterns.extend(pattern)
+
+        scan_path_names = set(scan_path["name"] for scan_path in self._scan_paths)
+        changed_scan_paths.update(name for name in old_scan_paths if name not in scan_path_names)
 
         self.dbg("scan_paths", self._scan_paths)
         self.dbg("cmds", self._cmds)
         self.dbg("cmds_all", self._cmds_all)
+        if file_patterns != self._file_patterns:
+            self._file_patterns = file_patterns
+            self._file_matcher = FilePatternMatcher(self._file_patterns)
         self.dbg("file_patterns", self._file_patterns)
 
-    def _scan_path(self, path, depth, max_depth, excludes=[]):
-        if max_depth >= 0 and depth-1 > max_depth:
-            return
-        for exclude in excludes:
-            filter = filefilter.create_filter(exclude)
-            if filter.match(path):
-                return
-
-        for dir in os.listdir(path):
-            dir_path = os.path.join(path, dir)
-            if not os.path.isdir(dir_path):
+        for icon_handle in old_icons.values():
+            if icon_handle not in self._icons.values():
+                icon_handle.free()
+
+        return changed_scan_paths
+
+    def _reuse_command(self, template, cmds, old_icons):
+        if template.icon_handle is not None:
+            self._icons[template.command.cmd] = old_icons.get(template.command.cmd, template.icon_handle)
+        cmds[template.command.name] = template
+
+    def _compile_command(self, section, command, old_icons, icon=True):
+        """Returns the CommandTemplate for command or None if its placeholders are invalid, the icon of the executable
+        is only loaded if icon is set"""
+        try:
+            template = CommandTemplate(command)
+        except ValueError as ex:
+            self.err(section, "has invalid placeholders:", ex)
+            return None
+        if icon and command.cmd != self._git_path:
+            icon_handle = self._icons.get(command.cmd)
+            if icon_handle is None:
+                icon_handle = old_icons.get(command.cmd)
+                if icon_handle is None:
+                    icon_handle = self.load_icon("@{},0".format(command.cmd))
+                self._icons[command.cmd] = icon_handle
+            template.icon_handle = icon_handle
+        return template
+
+    def _scan_path(self, scanner, paths, max_depth):
+        for path in paths:
+            if not os.path.isdir(path):
+                self.warn(path, "does not exist or is not a directory.")
+        return scanner.scan(paths, max_depth)
+
+    def _start_rescan(self, full=False, scan_paths=None, directories=None):
+        """Starts a rescan of the given scan path names (None for all) on a background thread
+
+        directories limits the rescan of a scan path name to the given directories below its paths, the scan paths
+        without an entry are rescanned completely. If the running rescan already covers the request, the request is
+        merged into it. Otherwise the running rescan is cancelled and replaced by one that covers both.
+        """
+        with self._rescan_lock:
+            scan_paths = set(scan_paths) if scan_paths is not None else None
+            directories = self._merge_directories(scan_paths or (), directories or {}, (), {})
+            running = self._rescan_thread is not None and self._rescan_thread.is_alive()
+            if running:
+                if scan_paths is not None and self._rescan_scan_paths is not None:
+                    directories = self._merge_directories(scan_paths, directories,
+                                                          self._rescan_scan_paths, self._rescan_directories)
+                    scan_paths = scan_paths | self._rescan_scan_paths
+                else:
+                    scan_paths = None
+                    directories = {}
+                covered = scan_paths == self._rescan_scan_paths and directories == self._rescan_directories
+                if covered and (self._rescan_full or not full):
+                    self.info("Rescan is already running")
+                    return
+                self.info("Cancelling running rescan in favor of a more complete one")
+                self._rescan_cancel.set()
+                full = full or self._rescan_full
+            cancel = threading.Event()
+            thread = threading.Thread(target=self._rescan_worker,
+                                      args=(full,
+                                            cancel,
+                                            self._rescan_thread if running else None,
+                                            scan_paths,
+                                            directories),
+                                      name="GitRescan",
+                                      daemon=True)
+            self._rescan_thread = thread
+            self._rescan_cancel = cancel
+            self._rescan_full = full
+            self._rescan_scan_paths = scan_paths
+            self._rescan_directories = directories
+            thread.start()
+
+    @staticmethod
+    def _merge_directories(scan_paths, directories, other_scan_paths, other_directories):
+        """Returns the directories to rescan per scan path name for two rescan requests, a scan path that one of them
+        rescans completely has no entry"""
+        merged = {}
+        for name in set(scan_paths) | set(other_scan_paths):
+            if (name in scan_paths and name not in directories) or \
+                    (name in other_scan_paths and name not in other_directories):
                 continue
-            if dir == ".git":
-                yield dir_path
-                break
-            for dir2 in self._scan_path(dir_path, depth+1, max_depth, excludes):
-                yield dir2
-
-    def _rescan(self):
-        self.info("Rescanning", len(self._scan_paths), "scan paths for repositories...")
+            merged[name] = set(directories.get(name, ())) | set(other_directories.get(name, ()))
+        return merged
+
+    def _is_rescanning(self):
+        with self._rescan_lock:
+            return self._rescan_thread is not None and self._rescan_thread.is_alive()
+
+    def _rescan_worker(self, full, cancel, previous, scan_paths, directories):
+        if previous is not None:
+            previous.join()
+        try:
+            if self._rescan(full, cancel, scan_paths, directories):
+                self._update_catalog()
+        except Exception as ex:
+            self.err("Rescan failed:", ex)
+
+    def _rescan(self, full=False, cancel=None, scan_paths=None, directories=None):
+        """Scans the configured paths for git repositories and updates the repository list
+
+        Only the scan paths whose names are in scan_paths are scanned, all if it's None. A scan path with an entry in
+        directories is only scanned below those directories. Repositories found in a scan path are published to the
+        catalog as soon as the scan path is finished. Returns False if the rescan was cancelled.
+        """
+        directories = directories or {}
+        rescan_paths = [scan_path for scan_path in self._scan_paths
+                        if scan_paths is None or scan_path["name"] in scan_paths]
+        self.info("Rescanning", len(rescan_paths), "scan paths for repositories...")
         start_time = time.time()
-        git_repos = []
-        remove_repos = []
-        for scan_path in self._scan_paths:
+        git_repos = {}
+        scan_index = self._load_scan_index() if not full or scan_paths is not None else {}
+        # a partial rescan keeps the index entries of the other scan paths
+        new_scan_index = dict(scan_index) if scan_paths is not None else {}
+        if full:
+            scan_index = {}
+        # don't let sleeping network drives block the scan, and keep their repositories
+        roots = [path for scan_path in rescan_paths for path in scan_path["paths"]]
+        offline = self._health_checker.probe(roots)
+        self._offline_volumes = frozenset((self._offline_volumes - set(map(RepoHealthChecker.volume, roots)))
+                                          | offline)
+        # index entries below the paths of the other scan paths stay, even where they overlap a rescanned one
+        other_roots = [path for scan_path in self._scan_paths if scan_path not in rescan_paths
+                       for path in scan_path["paths"]]
+        progress = RescanProgress(self, start_time)
+        self._rescan_git_spawns = 0
+        fs_time = 0.0
+        added = 0
+        # the directories that limited rescans walked, repositories outside of them are kept
+        subtrees = {}
+        for scan_path in rescan_paths:
             self.info("Rescanning", scan_path["name"], "with", len(scan_path["paths"]), "paths for repositories...")
             start_time_scan_path = time.time()
             scan_path_repos = []
+            exclude_matcher = scan_path.get("exclude_matcher")
+            scanner = RepoScanner(self._scan_workers,
+                                  exclude_matcher.match if exclude_matcher else None,
+                                  scan_index,
+                                  new_scan_index,
+                                  cancel,
+                                  progress.directory_visited)
+            paths = []
             for path in scan_path["paths"]:
-                if "excludes" in scan_path:
-                    excludes = scan_path["excludes"]
+                if RepoHealthChecker.volume(path) in offline:
+                    self.warn(path, "is offline, skipping it.")
                 else:
-                    excludes = []
-                for entry in self._scan_path(path, 0, scan_path["depth"], excludes):
-                    git_repo = self._get_top_level(os.path.dirname(entry))
-                    if git_repo:
-                        scan_path_repos.append(GitRepo("{}: {}".format(scan_path["name"], os.path.basename(git_repo)), git_repo))
-            git_repos.extend(scan_path_repos)
+                    paths.append(path)
+            walks = [(paths, scan_path["depth"])]
+            if scan_path["name"] in directories:
+                walks = self._subtree_walks(paths, scan_path["depth"], directories[scan_path["name"]])
+                subtrees[scan_path["name"]] = tuple(path for walk_paths, _ in walks for path in walk_paths)
+            if scan_paths is not None:
+                # the walk adds back what still exists, deleted and newly excluded directories drop out
+                self._prune_scan_index(new_scan_index, [path for walk_paths, _ in walks for path in walk_paths],
+                                       other_roots)
+            entries = itertools.chain.from_iterable(self._scan_path(scanner, walk_paths, max_depth)
+                                                    for walk_paths, max_depth in walks)
+            for entry in entries:
+                git_repo = self._resolve_top_level(entry)
+                if not git_repo:
+                    continue
+                kind, parent = GitDirResolver.kind(entry)
+                found = [(kind, git_repo, parent)]
+                found.extend(GitDirResolver.related(git_repo, entry))
+                for kind, path, parent in found:
+                    repo = GitRepo("{}: {}".format(scan_path["name"], os.path.basename(path)),
+                                   path,
+                                   scan_path["name"],
+                                   kind,
+                                   parent)
+                    # overlapping scan paths and worktrees find the same repository more than once, the first one wins
+                    if repo.key in git_repos:
+                        continue
+                    git_repos[repo.key] = repo
+                    scan_path_repos.append(repo)
+                    progress.repo_found()
+            fs_time += scanner.fs_time
+            if cancel is not None and cancel.is_set():
+                self.info("Rescan cancelled after {:0.1f} seconds".format(time.time() - start_time))
+                return False
             elapsed = time.time() - start_time_scan_path
-            self.info('Found {} git repositories in "{}" in {:0.1f} seconds'.format(len(scan_path_repos),
-                                                                                    scan_path["name"],
-                                                                                    elapsed))
+            self.info('Found {} git repositories in "{}" in {:0.1f} seconds ({} directories listed, {} unchanged)'
+                      .format(len(scan_path_repos), scan_path["name"], elapsed, scanner.listed, scanner.unchanged))
 
-        self.dbg(git_repos)
-        for repo in self._git_repos:
-            if repo not in git_repos:
-                remove_repos.append(repo)
-        self.dbg(remove_repos)
-        removed = 0
-        for repo in remove_repos:
-            self._git_repos.remove(repo)
-            removed += 1
-        added = 0
-        for repo in git_repos:
-            if repo not in self._git_repos:
-                self._git_repos.append(repo)
-                added += 1
+            # publish the partial result, repositories that don't exist anymore are removed when all paths are done
+            added += self._merge_repos(scan_path_repos)
+            self._update_catalog()
 
-        self.dbg(self._git_repos)
-        self._save_repos()
+        self.dbg(git_repos)
+        rescanned = set(scan_path["name"] for scan_path in rescan_paths)
+        with self._repos_lock:
+            keep_repos = []
+            for repo in self._git_repos:
+                found = git_repos.get(repo.key)
+                if found is not None:
+                    if repo.scan_path is None or repo.scan_path in rescanned:
+                        repo.scan_path = found.scan_path
+                        repo.kind = found.kind
+                        repo.parent = found.parent
+                    keep_repos.append(repo)
+                elif scan_paths is not None and repo.scan_path not in rescanned:
+                    keep_repos.append(repo)
+                elif repo.scan_path in subtrees and not self._is_below(repo.path, subtrees[repo.scan_path]):
+                    keep_repos.append(repo)
+                elif RepoHealthChecker.volume(repo.path) in offline:
+                    keep_repos.append(repo)
+            removed = len(self._git_repos) - len(keep_repos)
+            self._git_repos[:] = keep_repos
+
+            self.dbg(self._git_repos)
+            self._save_repos()
+        self._save_scan_index(new_scan_index)
 
         elapsed = time.time() - start_time
-        self.info("Found {} git repositories in {:0.1f} seconds ({} added, {} removed)".format(len(self._git_repos), elapsed, added, removed))
+        self.info("Found {} git repositories in {:0.1f} seconds ({} added, {} removed, {} directories visited)"
+                  .format(len(self._git_repos), elapsed, added, removed, progress.directories))
+        self._perf.record("rescan", elapsed)
+        self._perf.count("rescan.directories", progress.directories)
+        self._perf.count("rescan.git_spawns", self._rescan_git_spawns)
+        self._perf.set("last_rescan", {"seconds": elapsed,
+                                       "directories": progress.directories,
+                                       "repositories": progress.repos,
+                                       "file_system_seconds": fs_time,
+                                       "git_spawns": self._rescan_git_spawns})
+        return True
+
+    def _merge_repos(self, git_repos):
+        """Adds the repositories that aren't known yet, returns the number of added repositories
+
+        Known repositories keep their position and name, new ones are appended in the given order.
+        """
+        added = 0
+        with self._repos_lock:
+            known = dict((repo.key, repo) for repo in self._git_repos)
+            for repo in git_repos:
+                known_repo = known.get(repo.key)
+                if known_repo is None:
+                    known[repo.key] = repo
+                    self._git_repos.append(repo)
+                    added += 1
+                elif known_repo.scan_path is None:
+                    known_repo.scan_path = repo.scan_path
+        return added
+
+    def _get_repo_cache(self):
+        if self._repo_cache is None:
+            self._repo_cache = RepoCache(self.get_package_cache_path(True))
+            self._repo_cache.frecency.half_life = self._frecency_half_life * 24 * 60 * 60
+        return self._repo_cache
+
+    def _record_use(self, *keys):
+        """Counts a use of keys (see Frecency) for the ranking of the suggestions"""
+        with self._repos_lock:
+            self._get_repo_cache().append_use(keys, self._git_repos)
 
     def _save_repos(self):
+        self._get_repo_cache().save(self._git_repos)
+
+    def _load_repos(self):
+        """Loads the repositories from the cache if it changed since it was last read or written
+
+        Returns False if there is no cache yet.
+        """
+        repo_cache = self._get_repo_cache()
+        if not repo_cache.exists():
+            return False
+        if not repo_cache.changed():
+            return True
+        try:
+            git_repos = repo_cache.load()
+        except (OSError, ValueError) as ex:
+            self.err("Failed to read repository cache:", ex)
+            return False
+        with self._repos_lock:
+            self._git_repos = git_repos
+        return True
+
+    def _load_scan_index(self):
+        if self._scan_index is not None:
+            return self._scan_index
+        cache_path = self.get_package_cache_path(False)
+        index_path = os.path.join(cache_path, "scan_index.json")
+        if not os.path.exists(index_path):
+            return {}
+        try:
+            with open(index_path, "r") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError) as ex:
+            self.warn("Failed to read scan index, doing a full rescan:", ex)
+            return {}
+        if not isinstance(index, dict) or index.get("version") != RepoScanner.INDEX_VERSION:
+            return {}
+        self._scan_index = index.get("dirs", {})
+        return self._scan_index
+
+    @classmethod
+    def _subtree_walks(cls, paths, max_depth, directories):
+        """Returns the (paths, max_depth) pairs that scan the given directories below paths like a scan of paths with
+        max_depth would
+
+        Directories that the scan of paths wouldn't list are dropped, and so are those below another one. A directory
+        that doesn't exist anymore is replaced by its closest existing parent.
+        """
+        walks = {}
+        for directory in directories:
+            root = next((path for path in paths if cls._is_below(directory, (path,))), None)
+            if root is None:
+                continue
+            level = len(os.path.relpath(directory, root).split(os.sep)) if directory != root else 0
+            if 0 <= max_depth < level - 1:
+                continue
+            while directory != root and (level > max_depth >= 0 or not os.path.isdir(directory)):
+                directory = os.path.dirname(directory)
+                level -= 1
+            walks[directory] = max_depth - level if max_depth >= 0 else -1
+        # a walk covers the directories below it, its depth always reaches as deep as theirs
+        depths = {}
+        for directory in sorted(walks):
+            if not cls._is_below(directory, [path for walk_paths in depths.values() for path in walk_paths]):
+                depths.setdefault(walks[directory], []).append(directory)
+        return [(walk_paths, depth) for depth, walk_paths in sorted(depths.items())]
+
+    @staticmethod
+    def _is_below(path, directories):
+        """Returns True if path is one of directories or below one of them"""
+        directories = tuple(directories)
+        return path in directories or path.startswith(tuple(os.path.join(directory, "") for directory in directories))
+
+    @staticmethod
+    def _prune_scan_index(scan_index, paths, keep_paths):
+        """Removes the entries of the directories below paths from scan_index, except those below keep_paths that are
+        inside paths"""
+        prefixes = tuple(os.path.join(path, "") for path in paths)
+        keep_paths = [path for path in keep_paths if path.startswith(prefixes)]
+        keep_prefixes = tuple(os.path.join(path, "") for path in keep_paths)
+        stale = [path for path in scan_index
+                 if (path in paths or path.startswith(prefixes))
+                 and path not in keep_paths and not path.startswith(keep_prefixes)]
+        for path in stale:
+            del scan_index[path]
+
+    def _save_scan_index(self, scan_index):
         cache_path = self.get_package_cache_path(True)
-        with open(os.path.join(cache_path, "repos.json"), "w") as repos:
-            json.dump(self._git_repos, repos, indent=4, sort_keys=True, cls=GitRepoEncoder)
+        data = json.dumps({"version": RepoScanner.INDEX_VERSION, "dirs": scan_index}, separators=(",", ":"))
+        RepoCache.atomic_write(os.path.join(cache_path, "scan_index.json"), data.encode("utf-8"))
+        self._scan_index = scan_index
+
+    def _update_watcher(self):
+        """Starts, restarts or stops watching the scan paths according to the configuration"""
+        config = (self._watch,
+                  self._watch_interval,
+                  self._watch_delay,
+                  tuple((scan_path["name"], tuple(scan_path["paths"]), tuple(scan_path.get("excludes", ())))
+                        for scan_path in self._scan_paths))
+        if config == self._watcher_config:
+            return
+        self._watcher_config = config
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+        if self._watch and self._scan_paths:
+            self._watcher = RepoWatcher(dict((scan_path["name"], scan_path["paths"]) for scan_path in self._scan_paths),
+                                        self._load_scan_index,
+                                        self._on_scan_paths_changed,
+                                        self._watch_interval,
+                                        self._watch_delay,
+                                        dict((scan_path["name"], scan_path["exclude_matcher"].match)
+                                             for scan_path in self._scan_paths if "exclude_matcher" in scan_path))
+            self._watcher.start()
+            self.dbg("watching", len(self._scan_paths), "scan paths", "natively" if self._watcher.native else "")
+
+    def _on_scan_paths_changed(self, scan_paths, directories=None):
+        self.dbg("directories changed in", scan_paths, directories or "")
+        self._start_rescan(scan_paths=scan_paths, directories=directories)
+
+    def _update_health_check(self):
+        """Starts, restarts or stops the periodic health check according to the configuration"""
+        if self._health_check_interval == self._health_stop_interval:
+            return
+        if self._health_stop is not None:
+            self._health_stop.set()
+            self._health_stop = None
+        self._health_stop_interval = self._health_check_interval
+        if self._health_check_interval > 0:
+            self._health_stop = threading.Event()
+            threading.Thread(target=self._health_check_worker,
+                             args=(self._health_stop, self._health_check_interval),
+                             name="GitHealthCheck",
+                             daemon=True).start()
+
+    def _health_check_worker(self, stop, interval):
+        while not stop.wait(interval):
+            try:
+                self._check_health(False)
+            except Exception as ex:
+                self.err("Health check failed:", ex)
+
+    def _check_health(self, prune):
+        """Checks which repositories still exist and which volumes are offline
+
+        If prune is True the repositories that don't exist anymore are removed, repositories on offline volumes are
+        always kept. Returns the number of removed repositories and the offline volumes.
+        """
+        with self._health_lock:
+            with self._repos_lock:
+                paths = [repo.path for repo in self._git_repos]
+            start_time = time.time()
+            missing, offline = self._health_checker.check(paths)
+            self._perf.record("health_check", time.time() - start_time)
+            for volume in offline - self._offline_volumes:
+                self.warn(volume, "is offline, its repositories are kept")
+            changed = offline != self._offline_volumes
+            self._offline_volumes = offline
+            removed = 0
+            if prune and missing:
+                with self._repos_lock:
+                    keep_repos = [repo for repo in self._git_repos if repo.path not in missing]
+                    removed = len(self._git_repos) - len(keep_repos)
+                    self._git_repos[:] = keep_repos
+                    self._save_repos()
+        if changed or removed:
+            self._update_catalog()
+        return removed, offline
+
+    def _remove_old(self):
+        removed, offline = self._check_health(True)
+        if offline:
+            self.info("Removed", removed, "repositories that don't exist anymore, skipped offline", sorted(offline))
+        else:
+            self.info("Removed", removed, "repositories that don't exist anymore.")
+
+    def _is_offline(self, git_repo):
+        return RepoHealthChecker.volume(git_repo.path) in self._offline_volumes
+
+    def _resolve_top_level(self, git_dir):
+        """Returns the top level directory of the working tree that belongs to git_dir
+
+        The repository layout is read directly from the file system, git itself is only asked if the layout can't be
+        decided that way (e.g. bare repositories or broken git directories).
+        """
+        top_level = GitDirResolver.top_level(git_dir)
+        if top_level is not None:
+            return top_level
+        self.dbg("can't resolve", git_dir, "in-process, asking git")
+        self._rescan_git_spawns += 1
+        return self._get_top_level(os.path.dirname(git_dir))
 
     def _get_top_level(self, dir):
         self.dbg("get_top_level", dir)
@@ -240,84 +807,176 @@ class Git(kp.Plugin):
             cwd = dir
 
         command = '"{}" {}'.format(self._git_path, self.ARGS_TOP_LEVEL)
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        proc = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE, startupinfo=startupinfo)
-        if proc.returncode == 0:
-            return os.path.normpath(proc.stdout.decode().rstrip("\r\n"))
+        result = self._git_runner.run("git.top_level", command, cwd)
+        if result.returncode == 0:
+            return os.path.normpath(result.output.rstrip("\n"))
         else:
-            self.dbg("command returned", proc.returncode, "for", cwd)
+            self.dbg("command returned", result.returncode, "for", cwd)
 
         return None
 
     def on_catalog(self):
-        cache_path = self.get_package_cache_path(False)
-        repos_path = os.path.join(cache_path, "repos.json")
-        if os.path.exists(repos_path):
-            with open(repos_path, "r") as repos:
-                self._git_repos = json.load(repos, cls=GitRepoDecoder)
-        else:
-            self._rescan()
+        with self._perf.span("on_catalog"):
+            self._update_catalog(force=True)
+
+    def _update_catalog(self, force=False):
+        """Updates the catalog, only items whose content changed are created again
+
+        The catalog isn't set at all if nothing changed, unless force is set.
+        """
+        if not self._load_repos() and not self._is_rescanning():
+            self._start_rescan()
+
+        with self._catalog_lock:
+            self._catalog_created = 0
+            items = {}
+            catalog = []
+            signatures = []
+
+            def add(key, signature, create):
+                cached = self._catalog_items.get(key)
+                if cached is not None and cached[0] == signature:
+                    item = cached[1]
+                else:
+                    item = create()
+                    self._catalog_created += 1
+                items[key] = (signature, item)
+                catalog.append(item)
+                signatures.append((key, signature))
 
-        catalog = []
-        catalog.append(self.create_item(
-            category=kp.ItemCategory.KEYWORD,
-            label="Git: Rescan for Git Repositories",
-            short_desc="Rescans the configured paths for git repositories",
-            target=self.COMMAND_RESCAN,
-            args_hint=kp.ItemArgsHint.FORBIDDEN,
-            hit_hint=kp.ItemHitHint.KEEPALL,
-        ))
-        catalog.append(self.create_item(
-            category=kp.ItemCategory.KEYWORD,
-            label="Git: Remove not existing Git Repositories",
-            short_desc="Removes not existing Git Repositories",
-            target=self.COMMAND_REMOVE_OLD,
-            args_hint=kp.ItemArgsHint.FORBIDDEN,
-            hit_hint=kp.ItemHitHint.KEEPALL,
-        ))
-        for cmd in self._cmds_all:
-            item = self.create_item(
+            add(self.COMMAND_REPOS, None, lambda: self.create_item(
                 category=kp.ItemCategory.KEYWORD,
-                label=cmd.label,
-                short_desc='Run "{} {}" on all Git Repositories'.format(cmd.cmd, cmd.args),
-                target=self.COMMAND_CMD_ALL + cmd.name,
+                label="Git: Repositories",
+                short_desc="Lists the Git Repositories, the most frequently and recently used first",
+                target=self.COMMAND_REPOS,
+                args_hint=kp.ItemArgsHint.REQUIRED,
+                hit_hint=kp.ItemHitHint.NOARGS,
+            ))
+            add(self.COMMAND_RESCAN, None, lambda: self.create_item(
+                category=kp.ItemCategory.KEYWORD,
+                label="Git: Rescan for Git Repositories",
+                short_desc="Rescans the configured paths for git repositories",
+                target=self.COMMAND_RESCAN,
                 args_hint=kp.ItemArgsHint.FORBIDDEN,
                 hit_hint=kp.ItemHitHint.KEEPALL,
-                data_bag=repr(cmd)
-            )
-            catalog.append(item)
+            ))
+            add(self.COMMAND_RESCAN_FULL, None, lambda: self.create_item(
+                category=kp.ItemCategory.KEYWORD,
+                label="Git: Full rescan for Git Repositories",
+                short_desc="Rescans the configured paths for git repositories, including unchanged directories",
+                target=self.COMMAND_RESCAN_FULL,
+                args_hint=kp.ItemArgsHint.FORBIDDEN,
+                hit_hint=kp.ItemHitHint.KEEPALL,
+            ))
+            if self._perf.enabled:
+                add(self.COMMAND_SHOW_STATS, None, lambda: self.create_item(
+                    category=kp.ItemCategory.KEYWORD,
+                    label="Git: Show performance statistics",
+                    short_desc="Prints the collected timings to the console and saves them in the package cache",
+                    target=self.COMMAND_SHOW_STATS,
+                    args_hint=kp.ItemArgsHint.FORBIDDEN,
+                    hit_hint=kp.ItemHitHint.KEEPALL,
+                ))
+            add(self.COMMAND_REMOVE_OLD, None, lambda: self.create_item(
+                category=kp.ItemCategory.KEYWORD,
+                label="Git: Remove not existing Git Repositories",
+                short_desc="Removes not existing Git Repositories",
+                target=self.COMMAND_REMOVE_OLD,
+                args_hint=kp.ItemArgsHint.FORBIDDEN,
+                hit_hint=kp.ItemHitHint.KEEPALL,
+            ))
+            for template in self._cmds_all.values():
+                cmd = template.command
+                add(self.COMMAND_CMD_ALL + cmd.name,
+                    (cmd.label, cmd.cmd, cmd.args),
+                    lambda cmd=cmd: self._create_cmd_all_item(cmd))
+
+            with self._repos_lock:
+                git_repos = list(self._git_repos)
+            if self._show_status:
+                self._status_cache.refresh([git_repo for git_repo in git_repos if not self._is_offline(git_repo)],
+                                           self._git_path,
+                                           self._on_status_changed)
+            names = dict((git_repo.key, git_repo.name) for git_repo in git_repos)
+            children = collections.defaultdict(list)
+            for git_repo in git_repos:
+                details = []
+                if git_repo.parent:
+                    parent_key = GitRepo.path_key(git_repo.parent)
+                    children[parent_key].append(git_repo.key)
+                    details.append("{} of {}".format(git_repo.kind, names.get(parent_key, git_repo.parent)))
+                if self._is_offline(git_repo):
+                    details.append("offline")
+                else:
+                    status = self._status_cache.get(git_repo) if self._show_status else None
+                    if status:
+                        details.append(str(status))
+                short_desc = "{} ({})".format(git_repo.path, ", ".join(details)) if details else git_repo.path
+                add(git_repo.key,
+                    (git_repo.name, git_repo.path, short_desc),
+                    lambda git_repo=git_repo, short_desc=short_desc: self._create_repo_item(git_repo, short_desc))
+
+            self._catalog_items = items
+            self._repo_children = children
+            if not force and signatures == self._catalog_signatures:
+                self.dbg("catalog unchanged")
+                return
+            self._catalog_signatures = signatures
+            self.dbg("setting catalog with", len(catalog), "items,", self._catalog_created, "created")
+            self.set_catalog(catalog)
 
-        catalog.extend(self._create_repo_items())
+    def _create_cmd_all_item(self, cmd):
+        return self.create_item(
+            category=kp.ItemCategory.KEYWORD,
+            label=cmd.label,
+            short_desc='Run "{} {}" on all Git Repositories'.format(cmd.cmd, cmd.args),
+            target=self.COMMAND_CMD_ALL + cmd.name,
+            args_hint=kp.ItemArgsHint.FORBIDDEN,
+            hit_hint=kp.ItemHitHint.KEEPALL,
+            data_bag=cmd.name
+        )
 
-        self.set_catalog(catalog)
+    def _create_repo_item(self, git_repo, short_desc):
+        return self.create_item(
+            category=kp.ItemCategory.KEYWORD,
+            label='Git: Repository "{}"'.format(git_repo.name),
+            short_desc=short_desc,
+            target=git_repo.path,
+            args_hint=kp.ItemArgsHint.REQUIRED,
+            hit_hint=kp.ItemHitHint.NOARGS,
+            data_bag=git_repo.name
+        )
 
-    def _create_repo_items(self):
-        items = []
-        for git_repo in self._git_repos:
-            # self.dbg(git_repo)
-            items.append(self.create_item(
-                category=kp.ItemCategory.KEYWORD,
-                label='Git: Repository "{}"'.format(git_repo.name),
-                short_desc=git_repo.path,
-                target=git_repo.path,
-                args_hint=kp.ItemArgsHint.REQUIRED,
-                hit_hint=kp.ItemHitHint.NOARGS,
-                data_bag=git_repo.name
-            ))
-        return items
+    def _on_status_changed(self, changed):
+        self.dbg("status of", changed, "repositories changed")
+        self._update_catalog()
 
     def _cleanup(self):
         self._files = None
+        self._ranked_repos = None
 
     def on_suggest(self, user_input, items_chain):
+        with self._perf.span("on_suggest"):
+            self._on_suggest(user_input, items_chain)
+
+    def _on_suggest(self, user_input, items_chain):
         if not items_chain:
             if self._files is not None:
                 self._cleanup()
             return
 
+        start_time = time.perf_counter()
         suggestions = []
 
+        # "Git: Repositories" and the worktrees and submodules of a repository lead to another repository
+        if items_chain[0].target() == self.COMMAND_REPOS:
+            if len(items_chain) == 1:
+                self._suggest_repos(user_input)
+                return
+            items_chain = items_chain[1:]
+        while len(items_chain) > 1 and self._is_repo_item(items_chain[1]):
+            items_chain = items_chain[1:]
+
         if len(items_chain) > 1:
             rename_item = items_chain[1].clone()
             rename_item.set_short_desc('{} "{}" to "{}"'.format(rename_item.label(),
@@ -363,94 +1022,258 @@ class Git(kp.Plugin):
         )
         suggestions.append(copy_path)
 
-        for command in self._cmds:
-            copy_cmd = copy.copy(command)
-            copy_cmd.cwd = copy_cmd.cwd.format(repo_path=items_chain[0].target()) if copy_cmd.cwd else None
+        if self._git_path_found:
+            # the commit id is read when the item is executed, the suggestions don't wait for git
+            copy_head = self.create_item(
+                category=kp.ItemCategory.KEYWORD,
+                label="Copy HEAD commit id",
+                short_desc="Copies the object id of the commit checked out in the repository into clipboard",
+                target=self.COMMAND_COPY_HEAD,
+                args_hint=kp.ItemArgsHint.FORBIDDEN,
+                hit_hint=kp.ItemHitHint.IGNORE,
+                data_bag=items_chain[0].target()
+            )
+            suggestions.append(copy_head)
+
+        # the repository part of the data bags is the same for all commands, see CommandTemplate.data_bag()
+        repo_data_bag = json.dumps([items_chain[0].target()])[1:]
+        # the most frequently and recently used commands first, the others sorted by label
+        frecency = self._get_repo_cache().frecency
+        now = time.time()
+        ranks = dict((item.target(), -frecency.score(item.target(), now)) for item in suggestions)
+        for template in self._cmds.values():
+            command = template.command
+            args = template.args.render(repo_path=items_chain[0].target())
             command_item = self.create_item(
                 category=kp.ItemCategory.KEYWORD,
-                label=copy_cmd.label,
-                short_desc=copy_cmd.cmd,
-                target=copy_cmd.name + items_chain[0].target(),
+                label=command.label,
+                short_desc="{} {}".format(command.cmd, args),
+                target=command.name + items_chain[0].target(),
                 args_hint=kp.ItemArgsHint.REQUIRED,
                 hit_hint=kp.ItemHitHint.IGNORE,
-                icon_handle=self.load_icon("@{},0".format(copy_cmd.cmd)) if copy_cmd.cmd != self._git_path else None,
-                data_bag=repr(copy_cmd)
+                icon_handle=template.icon_handle,
+                data_bag=template.data_bag_prefix + repo_data_bag
             )
-            command_item.set_args(copy_cmd.args.format(repo_path=items_chain[0].target()))
-            command_item.set_short_desc("{} {}".format(copy_cmd.cmd, command_item.raw_args()))
+            command_item.set_args(args)
             suggestions.append(command_item)
+            ranks[command_item.target()] = -frecency.score(Frecency.COMMAND + command.name, now)
+        with self._catalog_lock:
+            catalog_items = self._catalog_items
+        for child_key in self._repo_children.get(GitRepo.path_key(items_chain[0].target()), []):
+            cached = catalog_items.get(child_key)
+            if cached is not None:
+                suggestions.append(cached[1])
+                ranks[cached[1].target()] = -frecency.score(Frecency.REPO + child_key, now)
+        suggestions.sort(key=lambda item: (ranks[item.target()], item.label().lower()))
+
+        # the commands are shown right away, the files follow in batches
+        self.set_suggestions(suggestions, kp.Match.DEFAULT, kp.Sort.NONE)
+        self.dbg("first suggestions after {:0.1f} ms".format((time.perf_counter() - start_time) * 1000))
+
+        repo_path = items_chain[0].target()
+
+        # the session may have moved on to another repository, e.g. a worktree or through "Git: Repositories"
+        repo_key = GitRepo.path_key(repo_path)
+        if self._files is not None and self._files[0] == repo_key:
+            suggestions.extend(self._create_file_item(file, repo_path) for file in self._files[1])
+            self.set_suggestions(suggestions, kp.Match.DEFAULT, kp.Sort.NONE)
+            return
+        if not self._file_patterns or not os.path.exists(repo_path):
+            self._files = (repo_key, [])
+            return
 
-        if self._files is None:
-            self._files = []
-            if os.path.exists(items_chain[0].target()):
-                for pattern in self._file_patterns:
-                    self.dbg(items_chain[0].target() + "/" + pattern)
-                    files = globex.iglobex(items_chain[0].target() + "/" + pattern, recursivity=True)
-                    self._files.extend(files)
-
-        for file in self._files:
-            command = GitCommand("",
-                                 file.path,
-                                 label=os.path.relpath(file.path, items_chain[0].target()))
-            suggestions.append(self.create_item(
-                category=kp.ItemCategory.FILE,
-                label=command.label,
-                short_desc="",
-                target=command.cmd,
-                args_hint=kp.ItemArgsHint.FORBIDDEN,
-                hit_hint=kp.ItemHitHint.IGNORE,
-                data_bag=repr(command)
-            ))
+        files = []
+        batches = self._find_files(repo_path, self._max_file_suggestions)
+        try:
+            # the batches after max_file_suggestions are still read, so that the file index gets the complete list,
+            # the listing yields after every chunk, so that it can be abandoned at any time
+            for batch in batches:
+                if self.should_terminate():
+                    self.dbg("file search abandoned after {:0.1f} ms".format((time.perf_counter() - start_time) * 1000))
+                    return
+                if self._max_file_suggestions:
+                    batch = batch[:self._max_file_suggestions - len(files)]
+                if not batch:
+                    continue
+                files.extend(batch)
+                suggestions.extend(self._create_file_item(file, repo_path) for file in batch)
+                self.set_suggestions(suggestions, kp.Match.DEFAULT, kp.Sort.NONE)
+        finally:
+            batches.close()
+        self._files = (repo_key, files)
+        self.dbg("all suggestions after {:0.1f} ms".format((time.perf_counter() - start_time) * 1000))
+
+    def _suggest_repos(self, user_input):
+        """Suggests the repositories whose name contains the characters of user_input in order, ranked by frecency
+
+        The ranking is computed once per session of the launcher, at most max_repo_suggestions are suggested.
+        """
+        if self._ranked_repos is None:
+            frecency = self._get_repo_cache().frecency
+            now = time.time()
+            with self._repos_lock:
+                git_repos = list(self._git_repos)
+            scores = dict((repo.key, frecency.score(Frecency.REPO + repo.key, now)) for repo in git_repos)
+            self._ranked_repos = sorted(git_repos, key=lambda repo: (-scores[repo.key], repo.name.lower()))
+
+        needle = user_input.lower()
+        with self._catalog_lock:
+            catalog_items = self._catalog_items
+        suggestions = []
+        for repo in self._ranked_repos:
+            if needle and not self._is_subsequence(needle, repo.name.lower()):
+                continue
+            cached = catalog_items.get(repo.key)
+            if cached is None:
+                continue
+            suggestions.append(cached[1])
+            if len(suggestions) >= self._max_repo_suggestions:
+                break
+        self.set_suggestions(suggestions, kp.Match.DEFAULT, kp.Sort.NONE)
+
+    def _is_repo_item(self, item):
+        target = item.target()
+        return os.path.isabs(target) and GitRepo.path_key(target) in self._catalog_items
+
+    @staticmethod
+    def _is_subsequence(needle, text):
+        chars = iter(text)
+        return all(char in chars for char in needle)
+
+    def _get_head_commit_id(self, repo_path):
+        """Returns the object id of the HEAD commit of repo_path or None"""
+        if not self._git_path_found or RepoHealthChecker.volume(repo_path) in self._offline_volumes:
+            return None
+        try:
+            head = self._git_runner.cat_file(repo_path, self._git_path, contents=False).query("HEAD")
+        except OSError as ex:
+            self.dbg("can't read HEAD of", repo_path, ex)
+            return None
+        if head is None or head[1] != "commit":
+            return None
+        return head[0]
+
+    def _create_file_item(self, file, repo_path):
+        return self.create_item(
+            category=kp.ItemCategory.FILE,
+            label=os.path.relpath(file, repo_path),
+            short_desc="",
+            target=file,
+            args_hint=kp.ItemArgsHint.FORBIDDEN,
+            hit_hint=kp.ItemHitHint.IGNORE
+        )
 
-        self.set_suggestions(suggestions)
+    def _find_files(self, repo_path, limit=0):
+        """Yields batches of paths of the files in repo_path that match the [file/*] patterns
+
+        The files are looked up in the file index, globex is only used if git can't list the files of the repository.
+        The listing of git is always yielded completely, so that it is added to the file index, its batches may be
+        empty. Globex stops after limit files, '0' means no limit.
+        """
+        files = self._file_index.lookup(repo_path, self._file_matcher)
+        if files is not None:
+            yield files
+            return
+        try:
+            for batch in self._file_index.stream(repo_path, self._git_path, self._file_matcher):
+                yield batch
+            return
+        except OSError as ex:
+            self.dbg("can't list files with git:", ex)
+        found = 0
+        for pattern in self._file_patterns:
+            self.dbg(repo_path + "/" + pattern)
+            batch = []
+            for file in globex.iglobex(repo_path + "/" + pattern, recursivity=True):
+                batch.append(file.path)
+                if len(batch) >= RepoFileIndex.BATCH_SIZE or (limit and found + len(batch) >= limit):
+                    yield batch
+                    found += len(batch)
+                    batch = []
+                    if limit and found >= limit:
+                        return
+            if batch:
+                yield batch
+                found += len(batch)
 
     def on_deactivated(self):
         self._cleanup()
 
     def on_execute(self, item, action):
+        with self._perf.span("on_execute"):
+            self._on_execute(item, action)
+
+    def _on_execute(self, item, action):
         self.dbg("on_execute", item.target(), item.raw_args(), item.data_bag())
 
-        if item.target() == self.COMMAND_RESCAN:
-            self._rescan()
-            self.on_catalog()
+        if item.target() == self.COMMAND_SHOW_STATS:
+            self._show_stats()
+        elif item.target() == self.COMMAND_RESCAN:
+            self._start_rescan()
+        elif item.target() == self.COMMAND_RESCAN_FULL:
+            self._start_rescan(full=True)
         elif item.target() == self.COMMAND_OPEN_GIT_BASH:
+            self._record_use(self.COMMAND_OPEN_GIT_BASH, Frecency.REPO + GitRepo.path_key(item.raw_args()))
             self._run_command(self._git_bash_path, None, False, item.raw_args())
         elif item.target() == self.COMMAND_REMOVE_OLD:
-            remove_repos = []
-            for repo in self._git_repos:
-                if not os.path.exists(repo.path):
-                    remove_repos.append(repo)
-            for repo in remove_repos:
-                self._git_repos.remove(repo)
-            self._save_repos()
-            self.on_catalog()
-            self.info("Removed", len(remove_repos), "repositories that don't exist anymore.")
+            threading.Thread(target=self._remove_old, name="GitRemoveOld", daemon=True).start()
         elif item.target() == self.COMMAND_RENAME:
             new_name = item.raw_args()
             repo_path = item.data_bag()
-            for repo in self._git_repos:
-                if repo.path == repo_path:
-                    self.info("renaming", repo.name, "to", new_name, repo_path)
-                    repo.name = new_name
-                    break
-            self._save_repos()
-            self.on_catalog()
+            with self._repos_lock:
+                for repo in self._git_repos:
+                    if repo.path == repo_path:
+                        self.info("renaming", repo.name, "to", new_name, repo_path)
+                        repo.name = new_name
+                        self._get_repo_cache().append_rename(repo.path, new_name, self._git_repos)
+                        break
+            self._update_catalog()
         elif item.target() == self.COMMAND_COPY_PATH:
             repo_path = item.data_bag()
+            self._record_use(self.COMMAND_COPY_PATH, Frecency.REPO + GitRepo.path_key(repo_path))
             kpu.set_clipboard(repo_path)
+        elif item.target() == self.COMMAND_COPY_HEAD:
+            repo_path = item.data_bag()
+            self._record_use(self.COMMAND_COPY_HEAD)
+            oid = self._get_head_commit_id(repo_path)
+            if oid is None:
+                self.warn("No HEAD commit in", repo_path)
+                return
+            kpu.set_clipboard(oid)
         elif item.target().startswith(self.COMMAND_CMD_ALL):
-            cmd = eval(item.data_bag())
+            template = self._cmds_all.get(item.data_bag())
+            if template is None:
+                self.warn("Command", item.data_bag(), "is not configured anymore")
+                return
+            cmd = template.command
             self.dbg(cmd)
-            args = cmd.args
-            for repo in self._git_repos:
-                cmd.args = args.format(repo_path=repo.path)
-                self.dbg(cmd)
-                self._run_command(cmd.cmd, cmd.args, cmd.internal, repo.path)
+            self._record_use(Frecency.COMMAND_ALL + cmd.name)
+            with self._repos_lock:
+                git_repos = list(self._git_repos)
+            if cmd.internal:
+                threading.Thread(target=self._run_command_all,
+                                 args=(template, git_repos),
+                                 name="GitCmdAll",
+                                 daemon=True).start()
+                return
+            for repo in git_repos:
+                if cmd.network and not GitRemotes.urls(repo.path):
+                    self.dbg(repo.path, "has no remotes, skipping it")
+                    continue
+                args = template.args.render(repo_path=repo.path)
+                self.dbg(cmd.cmd, args)
+                self._run_command(cmd.cmd, args, cmd.internal, repo.path)
         elif item.category() == kp.ItemCategory.FILE:
             kpu.execute_default_action(self, item, action)
         else:
-            cmd = eval(item.data_bag())
-            self._run_command(cmd.cmd, item.raw_args(), cmd.internal, cmd.cwd)
+            name, repo_path = CommandTemplate.parse_data_bag(item.data_bag())
+            template = self._cmds.get(name)
+            if template is None:
+                self.warn("Command", name, "is not configured anymore")
+                return
+            self._record_use(Frecency.COMMAND + name, Frecency.REPO + GitRepo.path_key(repo_path))
+            cwd = template.cwd.render(repo_path=repo_path) if template.cwd else None
+            self._run_command(template.command.cmd, item.raw_args(), template.command.internal, cwd)
 
     def _run_command(self, cmd, args, internal, cwd=None):
         if cwd and not os.path.isdir(cwd):
@@ -459,19 +1282,12 @@ class Git(kp.Plugin):
 
         if internal:
             command = "{} {}".format(cmd, args)
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
             self.info("running", command, "in", cwd)
-            proc = subprocess.Popen(command,
-                                    cwd=cwd,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT,
-                                    universal_newlines=True,
-                                    startupinfo=startupinfo)
-            output, _ = proc.communicate()
-            if output:
-                self.info(output)
-            self.info(command, "returned", proc.returncode)
+            # the user started it, it doesn't queue behind background processes
+            result = self._run_internal(command, cwd, throttle=False)
+            if result.output:
+                self.info(result.output)
+            self.info(command, "returned", result.returncode)
         else:
             self.dbg("running", cmd, args)
             self.dbg(cwd)
@@ -480,13 +1296,674 @@ class Git(kp.Plugin):
             else:
                 kpu.shell_execute(cmd, args)
 
+    def _show_stats(self):
+        for line in self._perf.summary_lines():
+            self.info(line)
+        stats_path = os.path.join(self.get_package_cache_path(True), "perf_stats.json")
+        data = json.dumps(self._perf.to_dict(), indent=4, sort_keys=True)
+        RepoCache.atomic_write(stats_path, data.encode("utf-8"))
+        self.info("Performance statistics saved to", stats_path)
+
+    def _run_internal(self, command, cwd, timeout=None, throttle=True):
+        """Runs command without a window and returns its CommandResult, the process is killed after timeout seconds
+
+        The command waits for a free process slot unless throttle is cleared, see GitProcessRunner.run().
+        """
+        return self._git_runner.run("internal", command, cwd, timeout, stderr=True, throttle=throttle)
+
+    def _run_command_all(self, template, git_repos):
+        """Runs an internal cmd_all command on all repositories with cmd.workers parallel processes
+
+        Network commands skip repositories without remotes and run on at most cmd.host_workers repositories of the same
+        remote host at a time, see CommandScheduler. Repositories the command succeeded on within the last
+        cmd.fresh_for seconds are skipped. The output of each repository is logged as one block when its command
+        finished, a summary is logged at the end.
+        """
+        cmd = template.command
+        start_time = time.time()
+        last_succeeded = self._load_command_results().get(cmd.name, {}) if cmd.fresh_for else {}
+        jobs = []
+        fresh = 0
+        no_remotes = 0
+        for repo in git_repos:
+            if self._is_offline(repo):
+                self.warn(repo.path, "is offline.")
+                continue
+            if not os.path.isdir(repo.path):
+                self.warn(repo.path, " does not exist.")
+                continue
+            if start_time - last_succeeded.get(repo.key, 0) < cmd.fresh_for:
+                fresh += 1
+                continue
+            hosts = ()
+            if cmd.network:
+                urls = GitRemotes.urls(repo.path)
+                if not urls:
+                    no_remotes += 1
+                    continue
+                hosts = GitRemotes.hosts(urls)
+            jobs.append(ScheduledJob(repo, hosts))
+        self.info('Running "{} {}" on {} repositories with {} workers ({} skipped as fresh, {} without remotes)'
+                  .format(cmd.cmd, cmd.args, len(jobs), cmd.workers, fresh, no_remotes))
+
+        def run_job(job):
+            command = "{} {}".format(cmd.cmd, template.args.render(repo_path=job.repo.path))
+            return self._run_internal(command, job.repo.path, cmd.timeout)
+
+        results = []
+
+        def on_result(job, result, final):
+            if result.timed_out:
+                status = "timed out after {:0.1f} seconds".format(result.duration)
+            elif result.returncode is None:
+                status = "not run"
+            else:
+                status = "returned {} in {:0.1f} seconds".format(result.returncode, result.duration)
+            if not final:
+                status += ", retrying (attempt {} of {})".format(job.attempts + 2, cmd.retries + 1)
+            else:
+                results.append((job.repo, result))
+            if result.output:
+                self.info("{}: {}\n{}".format(result.cwd, status, result.output.rstrip()))
+            else:
+                self.info("{}: {}".format(result.cwd, status))
+
+        scheduler = CommandScheduler(cmd.workers,
+                                     cmd.host_workers if cmd.network else 0,
+                                     cmd.retries,
+                                     cmd.retry_delay)
+        scheduler.run(jobs, run_job, on_result)
+        if cmd.fresh_for:
+            self._save_command_results(cmd.name, [repo.key for repo, result in results if result.succeeded])
+
+        failed = [result for _, result in results if not result.succeeded]
+        timed_out = sum(1 for result in failed if result.timed_out)
+        durations = sorted(result.duration for _, result in results)
+        self.info('"{}" finished on {} repositories in {:0.1f} seconds: {} succeeded, {} failed ({} timed out), '
+                  '{} retries, slowest {:0.1f} seconds, median {:0.1f} seconds'
+                  .format(cmd.label,
+                          len(results),
+                          time.time() - start_time,
+                          len(results) - len(failed),
+                          len(failed),
+                          timed_out,
+                          scheduler.retried,
+                          durations[-1] if durations else 0.0,
+                          durations[len(durations) // 2] if durations else 0.0))
+        for result in failed:
+            self.info("  failed:", result.cwd)
+
+    def _load_command_results(self):
+        """Returns the times of the last successful runs of the cmd_all commands as {name: {repository key: time}}"""
+        results_path = os.path.join(self.get_package_cache_path(False), "cmd_all.json")
+        if not os.path.exists(results_path):
+            return {}
+        try:
+            with open(results_path, "r", encoding="utf-8") as results_file:
+                results = json.load(results_file)
+        except (OSError, ValueError) as ex:
+            self.warn("Failed to read cmd_all results:", ex)
+            return {}
+        if not isinstance(results, dict) or results.get("version") != 1:
+            return {}
+        return results.get("commands", {})
+
+    def _save_command_results(self, name, succeeded):
+        """Records that the cmd_all command name just succeeded on the repositories with the keys in succeeded"""
+        if not succeeded:
+            return
+        now = time.time()
+        with self._command_results_lock:
+            commands = self._load_command_results()
+            last_succeeded = commands.setdefault(name, {})
+            for key in succeeded:
+                last_succeeded[key] = now
+            data = json.dumps({"version": 1, "commands": commands}, separators=(",", ":"), ensure_ascii=False)
+            RepoCache.atomic_write(os.path.join(self.get_package_cache_path(True), "cmd_all.json"),
+                                   data.encode("utf-8"))
+
+
+class RepoStatus(object):
+    __slots__ = ("fingerprint", "branch", "dirty", "ahead", "behind")
+
+    def __init__(self, fingerprint, branch=None, dirty=False, ahead=0, behind=0):
+        self.fingerprint = fingerprint
+        self.branch = branch
+        self.dirty = dirty
+        self.ahead = ahead
+        self.behind = behind
+
+    def __str__(self):
+        parts = [self.branch or "unknown branch"]
+        if self.dirty:
+            parts.append("dirty")
+        if self.ahead:
+            parts.append("ahead {}".format(self.ahead))
+        if self.behind:
+            parts.append("behind {}".format(self.behind))
+        return ", ".join(parts)
 
-class GitRepo(object):
-    __slots__ = ("name", "path")
+    def __repr__(self):
+        return "RepoStatus(branch={}, dirty={}, ahead={}, behind={})".format(repr(self.branch),
+                                                                           repr(self.dirty),
+                                                                           repr(self.ahead),
+                                                                           repr(self.behind))
+
+    @classmethod
+    def parse(cls, fingerprint, output):
+        """Creates a RepoStatus from the output of ARGS_STATUS"""
+        status = cls(fingerprint)
+        for line in output.splitlines():
+            if line.startswith("# branch.head "):
+                branch = line[len("# branch.head "):]
+                status.branch = "detached HEAD" if branch == "(detached)" else branch
+            elif line.startswith("# branch.ab "):
+                for count in line[len("# branch.ab "):].split():
+                    if count.startswith("+"):
+                        status.ahead = int(count[1:])
+                    elif count.startswith("-"):
+                        status.behind = int(count[1:])
+            elif line and not line.startswith("#"):
+                status.dirty = True
+        return status
+
+
+class RepoStatusCache(object):
+    """Status snapshots (branch, dirty, ahead/behind) of repositories, collected on a background worker pool
+
+    A snapshot is only collected again if the mtime of HEAD, the index, FETCH_HEAD, packed-refs or one of the refs
+    directories of the repository changed. The output of git status is only read up to its first entry, the
+    "# branch.*" headers come before the entries and one entry is enough to know that the repository is dirty.
+    """
+    # without optional locks git doesn't refresh the index, which would change the fingerprint again
+    ARGS_STATUS = "--no-optional-locks status --porcelain=v2 --branch"
+    ENTRY = re.compile(rb"(?:^|\n)[^#\n]")
+    FINGERPRINT_FILES = ("HEAD", "index", "FETCH_HEAD")
+    FINGERPRINT_COMMON_FILES = ("packed-refs", os.path.join("refs", "heads"), os.path.join("refs", "remotes"))
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.runner = GitProcessRunner(workers)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = None
+
+    def get(self, git_repo):
+        return self._entries.get(git_repo.key)
+
+    def refresh(self, git_repos, git_path, on_changed):
+        """Refreshes the snapshots of git_repos in the background, on_changed is called with the number of changed
+        snapshots if there were any. Never blocks, a refresh that is requested during another one runs afterwards."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                self._pending = (git_repos, git_path, on_changed)
+                return
+            self._thread = threading.Thread(target=self._refresh,
+                                            args=(git_repos, git_path, on_changed),
+                                            name="GitStatus",
+                                            daemon=True)
+            self._thread.start()
+
+    def _refresh(self, git_repos, git_path, on_changed):
+        while True:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                changed = sum(pool.map(lambda repo: self._refresh_repo(repo, git_path), git_repos))
+            keys = set(repo.key for repo in git_repos)
+            for key in [key for key in self._entries if key not in keys]:
+                del self._entries[key]
+            if changed:
+                on_changed(changed)
+            with self._lock:
+                if self._pending is None:
+                    self._thread = None
+                    return
+                git_repos, git_path, on_changed = self._pending
+                self._pending = None
+
+    def _refresh_repo(self, git_repo, git_path):
+        fingerprint = self.fingerprint(git_repo.path)
+        if fingerprint is None:
+            self._entries.pop(git_repo.key, None)
+            return False
+        entry = self._entries.get(git_repo.key)
+        if entry is not None and entry.fingerprint == fingerprint:
+            return False
+
+        output = b""
+        try:
+            chunks = self.runner.stream("git.status", '"{}" {}'.format(git_path, self.ARGS_STATUS), git_repo.path)
+            try:
+                for chunk in chunks:
+                    output += chunk
+                    if self.ENTRY.search(output):
+                        break
+            finally:
+                chunks.close()
+        except OSError:
+            return False
+        self._entries[git_repo.key] = RepoStatus.parse(fingerprint, output.decode("utf-8", "replace"))
+        return True
+
+    @classmethod
+    def fingerprint(cls, repo_path):
+        """Returns the mtimes of the files that change with the status of the repository or None"""
+        git_dir = GitDirResolver.git_dir(os.path.join(repo_path, ".git"))
+        if not git_dir:
+            return None
+        common_dir = GitDirResolver.common_dir(git_dir)
+        fingerprint = []
+        for base, names in ((git_dir, cls.FINGERPRINT_FILES), (common_dir, cls.FINGERPRINT_COMMON_FILES)):
+            for name in names:
+                try:
+                    fingerprint.append(os.stat(os.path.join(base, name)).st_mtime_ns)
+                except OSError:
+                    fingerprint.append(None)
+        return tuple(fingerprint)
+
+
+class GitProcessRunner(object):
+    """Runs the git processes of the plugin without a window
+
+    At most max_processes processes run at the same time, further calls wait for a free slot. Streamed processes feed
+    the suggestions of the launcher and the commands the user runs aren't throttled, they never wait for background
+    work. A process that times out is killed together with the processes it started. Only the tail of the output of a
+    process is kept (max_output bytes). Long-lived "git cat-file --batch" and "--batch-check" processes are kept for
+    the max_batch_processes most recently used repositories. Spawns and run times are recorded in perf.
+    """
+    DEFAULT_MAX_OUTPUT = 1024 * 1024
+    READ_SIZE = 65536
+
+    def __init__(self, max_processes, max_batch_processes=1):
+        self.perf = PerfStats()
+        self.max_output = self.DEFAULT_MAX_OUTPUT
+        self.max_batch_processes = max_batch_processes
+        self._max_processes = max_processes
+        self._semaphore = threading.BoundedSemaphore(max_processes)
+        self._startupinfo = subprocess.STARTUPINFO()
+        self._startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        self._batches = collections.OrderedDict()
+        self._batches_lock = threading.Lock()
+
+    def set_max_processes(self, max_processes):
+        """Changes the number of processes that may run at the same time, running processes aren't affected"""
+        if max_processes != self._max_processes:
+            self._max_processes = max_processes
+            self._semaphore = threading.BoundedSemaphore(max_processes)
+
+    def _popen(self, name, command, cwd, stdin, stderr):
+        self.perf.count("spawns." + name)
+        # in a process group of its own the process can be killed together with the processes it starts
+        return subprocess.Popen(command,
+                                cwd=cwd,
+                                stdin=stdin,
+                                stdout=subprocess.PIPE,
+                                stderr=stderr,
+                                startupinfo=self._startupinfo,
+                                start_new_session=os.name != "nt")
+
+    def _kill_tree(self, proc):
+        """Kills proc and the processes it started, which would otherwise keep its output pipe open"""
+        if os.name == "nt":
+            # taskkill finds the children by their parent process id, so proc has to be killed last
+            self.perf.count("spawns.taskkill")
+            try:
+                subprocess.run("taskkill /F /T /PID {}".format(proc.pid),
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL,
+                               startupinfo=self._startupinfo)
+            except OSError:
+                pass
+        else:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        proc.kill()
+
+    def run(self, name, command, cwd=None, timeout=None, stderr=False, throttle=True):
+        """Runs command and returns its CommandResult, the process is killed after timeout seconds
+
+        stderr is merged into the output if set, otherwise it is discarded. Unless throttle is cleared the call waits
+        for a free slot, commands the user is waiting for don't wait for background work.
+        """
+        if not throttle:
+            return self._run(name, command, cwd, timeout, stderr)
+        semaphore = self._semaphore
+        with semaphore:
+            return self._run(name, command, cwd, timeout, stderr)
+
+    def _run(self, name, command, cwd, timeout, stderr):
+        start_time = time.time()
+        try:
+            proc = self._popen(name,
+                               command,
+                               cwd,
+                               subprocess.DEVNULL,
+                               subprocess.STDOUT if stderr else subprocess.DEVNULL)
+        except OSError as ex:
+            return CommandResult(cwd, None, str(ex), time.time() - start_time)
+        expired = threading.Event()
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, lambda: (expired.set(), self._kill_tree(proc)))
+            timer.daemon = True
+            timer.start()
+        chunks = collections.deque()
+        size = 0
+        omitted = 0
+        try:
+            while True:
+                chunk = proc.stdout.read1(self.READ_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+                while size > self.max_output and len(chunks) > 1:
+                    dropped = chunks.popleft()
+                    size -= len(dropped)
+                    omitted += len(dropped)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            proc.stdout.close()
+            proc.wait()
+        duration = time.time() - start_time
+        self.perf.record("subprocess." + name, duration)
+        output = b"".join(chunks).decode("utf-8", "replace").replace("\r\n", "\n")
+        if omitted:
+            output = "[{} bytes of output omitted]\n{}".format(omitted, output)
+        return CommandResult(cwd, proc.returncode, output, duration, expired.is_set())
+
+    def stream(self, name, command, cwd=None):
+        """Runs command and yields its output in chunks, closing the generator early kills the process
+
+        Raises OSError if the process can't be started or returns non-zero.
+        """
+        start_time = time.time()
+        proc = self._popen(name, command, cwd, subprocess.DEVNULL, subprocess.DEVNULL)
+        try:
+            while True:
+                chunk = proc.stdout.read1(self.READ_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+            self.perf.record("subprocess." + name, time.time() - start_time)
+        if proc.returncode != 0:
+            raise OSError("{} returned {} in {}".format(command, proc.returncode, cwd))
+
+    def cat_file(self, repo_path, git_path, contents=True):
+        """Returns the CatFileBatch of repo_path, "git cat-file --batch" if contents is set, else "--batch-check"
+
+        The process is started again if the references of the repository changed since it was started.
+        """
+        key = (GitRepo.path_key(repo_path), contents)
+        fingerprint = RepoStatusCache.fingerprint(repo_path)
+        closed = []
+        with self._batches_lock:
+            batch = self._batches.get(key)
+            if batch is not None and (batch.fingerprint != fingerprint or not batch.alive()):
+                closed.append(self._batches.pop(key))
+                batch = None
+            if batch is None:
+                command = '"{}" cat-file {}'.format(git_path, "--batch" if contents else "--batch-check")
+                proc = self._popen("git.cat_file", command, repo_path, subprocess.PIPE, subprocess.DEVNULL)
+                batch = CatFileBatch(proc, contents, fingerprint)
+                self._batches[key] = batch
+            self._batches.move_to_end(key)
+            while len(self._batches) > self.max_batch_processes:
+                closed.append(self._batches.popitem(last=False)[1])
+        for old_batch in closed:
+            old_batch.close()
+        return batch
+
+    def close(self):
+        """Ends all cat-file processes"""
+        with self._batches_lock:
+            batches = list(self._batches.values())
+            self._batches.clear()
+        for batch in batches:
+            batch.close()
+
+
+class CatFileBatch(object):
+    """A long-lived "git cat-file --batch" (or "--batch-check") process of one repository"""
+
+    def __init__(self, proc, contents, fingerprint):
+        self.fingerprint = fingerprint
+        self._proc = proc
+        self._contents = contents
+        self._lock = threading.Lock()
+
+    def alive(self):
+        return self._proc.poll() is None
+
+    def query(self, name):
+        """Returns the object id, type, size and the contents (None for --batch-check) of the object name
+
+        Returns None if there is no such object. Raises OSError if the process ended.
+        """
+        with self._lock:
+            try:
+                self._proc.stdin.write(name.encode("utf-8") + b"\n")
+                self._proc.stdin.flush()
+                header = self._proc.stdout.readline()
+            except ValueError as ex:
+                raise OSError(ex)
+            if not header:
+                raise OSError("git cat-file ended")
+            parts = header.split()
+            if len(parts) != 3:
+                # "<name> missing" or "<name> ambiguous"
+                return None
+            oid, type, size = parts[0].decode(), parts[1].decode(), int(parts[2])
+            data = None
+            if self._contents:
+                data = self._proc.stdout.read(size)
+                self._proc.stdout.read(1)
+            return oid, type, size, data
+
+    def close(self):
+        with self._lock:
+            try:
+                self._proc.stdin.close()
+                self._proc.wait(1)
+            except (OSError, subprocess.TimeoutExpired):
+                self._proc.kill()
+                self._proc.wait()
+            self._proc.stdout.close()
+
+
+class GitRemotes(object):
+    """Reads the remotes of a repository from its config file without starting git"""
+    SCP_RE = re.compile(r"^(?:[^@/]+@)?([^:/]+):")
+
+    @staticmethod
+    def urls(repo_path):
+        """Returns the urls of all remotes of the repository in repo_path"""
+        git_dir = GitDirResolver.git_dir(os.path.join(repo_path, ".git"))
+        if not git_dir:
+            return []
+        config = GitConfig.read(os.path.join(GitDirResolver.common_dir(git_dir), "config"))
+        urls = []
+        for key in config.keys():
+            if key.startswith("remote.") and key.endswith(".url"):
+                urls.extend(config.get_all(key))
+        return urls
+
+    @classmethod
+    def host(cls, url):
+        """Returns the lower case host name of url or None for local repositories (paths and file:// urls)"""
+        if "://" in url:
+            scheme, _, rest = url.partition("://")
+            if scheme.lower() == "file":
+                return None
+            host = rest.split("/", 1)[0].rsplit("@", 1)[-1]
+            if host.startswith("["):
+                return host.split("]", 1)[0].lstrip("[").lower()
+            return host.split(":", 1)[0].lower() or None
+        match = cls.SCP_RE.match(url)
+        # "C:/path" is a local path, not a host "C"
+        if match and len(match.group(1)) > 1:
+            return match.group(1).lower()
+        return None
+
+    @classmethod
+    def hosts(cls, urls):
+        """Returns the sorted tuple of the distinct remote hosts of urls"""
+        return tuple(sorted(set(host for host in map(cls.host, urls) if host)))
+
+
+class ScheduledJob(object):
+    __slots__ = ("repo", "hosts", "attempts", "not_before")
+
+    def __init__(self, repo, hosts):
+        self.repo = repo
+        self.hosts = hosts
+        self.attempts = 0
+        self.not_before = 0.0
+
+
+class CommandScheduler(object):
+    """Runs jobs on a pool of workers, with at most host_workers jobs per remote host at the same time
+
+    Jobs start in the given order, a job whose hosts are all busy is passed by the ones behind it. A failed job is
+    retried up to retries times, not before retry_delay seconds. Only failures to connect (see CONNECTION_ERROR) and
+    timeouts count against the hosts of the job: no job starts on them for retry_delay seconds, doubled for every
+    consecutive such failure on the same host. Once MAX_HOST_FAILURES different repositories failed to connect to a
+    host in a row it is considered unreachable and the remaining jobs on it fail right away. Other failures, like a
+    remote repository that doesn't exist, only concern their own repository. host_workers 0 means no limit per host.
+    """
+    MAX_HOST_FAILURES = 5
+    CONNECTION_ERROR = re.compile(r"could not resolve host|unable to connect|failed to connect|"
+                                  r"connection (?:refused|timed out|reset)|network is unreachable|no route to host",
+                                  re.IGNORECASE)
+
+    def __init__(self, workers, host_workers, retries, retry_delay):
+        self.workers = workers
+        self.host_workers = host_workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.retried = 0
+
+    def run(self, jobs, run_job, on_result):
+        """Runs run_job(job) for all jobs, on_result(job, result, final) is called with the CommandResult of every
+        attempt, final is False if the job is going to be retried"""
+        pending = list(jobs)
+        running = {}
+        active = collections.Counter()
+        failures = collections.Counter()
+        # host -> keys of the repositories that failed to connect to it since the last success
+        failed_repos = collections.defaultdict(set)
+        backoff = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                now = time.monotonic()
+                waiting = []
+                for job in pending:
+                    unreachable = [host for host in job.hosts if len(failed_repos[host]) >= self.MAX_HOST_FAILURES]
+                    if unreachable:
+                        message = "skipped, {} repositories failed to connect to {} in a row" \
+                            .format(len(failed_repos[unreachable[0]]), unreachable[0])
+                        on_result(job, CommandResult(job.repo.path, None, message, 0.0), True)
+                    elif len(running) < self.workers and self._ready(job, active, backoff, now):
+                        active.update(job.hosts)
+                        running[pool.submit(run_job, job)] = job
+                    else:
+                        waiting.append(job)
+                pending = waiting
+
+                timeout = None
+                if pending:
+                    delays = [until - now for until in itertools.chain(backoff.values(),
+                                                                       (job.not_before for job in pending))
+                              if until > now]
+                    timeout = min(delays) if delays else None
+                if not running:
+                    time.sleep(timeout or 0)
+                    continue
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    active.subtract(job.hosts)
+                    result = future.result()
+                    if result.succeeded:
+                        for host in job.hosts:
+                            failures[host] = 0
+                            failed_repos[host].clear()
+                        on_result(job, result, True)
+                        continue
+                    if self.connection_failed(result):
+                        for host in job.hosts:
+                            failures[host] += 1
+                            # retries of the same repository don't make a host unreachable
+                            failed_repos[host].add(job.repo.key)
+                            backoff[host] = time.monotonic() + self.retry_delay * 2 ** (failures[host] - 1)
+                    final = job.attempts >= self.retries
+                    on_result(job, result, final)
+                    if not final:
+                        job.attempts += 1
+                        job.not_before = time.monotonic() + self.retry_delay
+                        self.retried += 1
+                        pending.append(job)
+
+    @classmethod
+    def connection_failed(cls, result):
+        """Returns True if the command of result timed out or couldn't connect to a remote host"""
+        return result.timed_out or bool(result.output and cls.CONNECTION_ERROR.search(result.output))
+
+    def _ready(self, job, active, backoff, now):
+        if job.not_before > now:
+            return False
+        for host in job.hosts:
+            if self.host_workers and active[host] >= self.host_workers:
+                return False
+            if backoff.get(host, 0) > now:
+                return False
+        return True
 
-    def __init__(self, name, path):
+
+class CommandResult(object):
+    __slots__ = ("cwd", "returncode", "output", "duration", "timed_out")
+
+    def __init__(self, cwd, returncode, output, duration, timed_out=False):
+        self.cwd = cwd
+        self.returncode = returncode
+        self.output = output
+        self.duration = duration
+        self.timed_out = timed_out
+
+    @property
+    def succeeded(self):
+        return self.returncode == 0 and not self.timed_out
+
+
+class GitRepo(object):
+    """A repository in the catalog, parent is the top level directory of the main worktree of linked worktrees and of
+    the superproject of submodules"""
+    __slots__ = ("name", "path", "key", "scan_path", "kind", "parent")
+    REPOSITORY = "repository"
+    WORKTREE = "worktree"
+    SUBMODULE = "submodule"
+
+    def __init__(self, name, path, scan_path=None, kind=REPOSITORY, parent=None):
         self.name = name
         self.path = path
+        self.key = self.path_key(path)
+        self.scan_path = scan_path
+        self.kind = kind
+        self.parent = parent
+
+    @staticmethod
+    def path_key(path):
+        """Returns the normalized path used to identify a repository (case-folded on case-insensitive systems)"""
+        return os.path.normcase(os.path.normpath(path))
 
     def __str__(self):
         return "{}, {}".format(self.name, self.path)
@@ -495,26 +1972,201 @@ class GitRepo(object):
         return "GitRepo(name={}, path={})".format(repr(self.name), repr(self.path))
 
     def __eq__(self, other):
-        return self.path == other.path
+        if not isinstance(other, GitRepo):
+            return NotImplemented
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
 
     def __lt__(self, other):
-        return self.path < other.path
+        return self.key < other.key
 
     def __le__(self, other):
-        return self.path <= other.path
+        return self.key <= other.key
 
     def __gt__(self, other):
-        return self.path > other.path
+        return self.key > other.key
 
     def __ge__(self, other):
-        return self.path >= other.path
-
-
-class GitRepoEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, GitRepo):
-            return {"name": o.name, "path": o.path}
-        return super().default(o)
+        return self.key >= other.key
+
+
+class RepoCache(object):
+    """Versioned, compact cache of the repository list in the package cache
+
+    The snapshot file starts with MAGIC and a version byte followed by zlib compressed JSON. Renames and uses (see
+    Frecency) are appended to a log file that is replayed when loading and compacted into the snapshot after
+    COMPACT_THRESHOLD entries. All writes of the snapshot are atomic, a partially written last log entry is ignored. The
+    old "repos.json" is migrated on first use.
+    """
+    MAGIC = b"KPGIT"
+    VERSION = 1
+    SNAPSHOT_NAME = "repos.cache"
+    LOG_NAME = "repos.log"
+    LEGACY_NAME = "repos.json"
+    COMPACT_THRESHOLD = 100
+
+    def __init__(self, cache_path):
+        self.snapshot_path = os.path.join(cache_path, self.SNAPSHOT_NAME)
+        self.log_path = os.path.join(cache_path, self.LOG_NAME)
+        self.legacy_path = os.path.join(cache_path, self.LEGACY_NAME)
+        self.frecency = Frecency()
+        self._log_entries = 0
+        self._stamp = None
+
+    def exists(self):
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.legacy_path)
+
+    def changed(self):
+        """Returns True if the cache files were changed since they were last read or written by this instance"""
+        return self._stamp is None or self._stamp != self.stamp()
+
+    def stamp(self):
+        stamp = []
+        for path in (self.snapshot_path, self.log_path):
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def load(self):
+        if not os.path.exists(self.snapshot_path) and os.path.exists(self.legacy_path):
+            return self._migrate()
+
+        with open(self.snapshot_path, "rb") as snapshot:
+            data = snapshot.read()
+        if not data.startswith(self.MAGIC) or len(data) <= len(self.MAGIC):
+            raise ValueError("{} is not a repository cache".format(self.snapshot_path))
+        version = data[len(self.MAGIC)]
+        if version != self.VERSION:
+            raise ValueError("unsupported repository cache version {}".format(version))
+        content = json.loads(zlib.decompress(data[len(self.MAGIC) + 1:]).decode("utf-8"))
+        git_repos = [GitRepo(*entry) for entry in content["repos"]]
+        self.frecency.load(content.get("frecency", {}))
+
+        self._log_entries = 0
+        if os.path.exists(self.log_path):
+            by_key = dict((repo.key, repo) for repo in git_repos)
+            with open(self.log_path, "r", encoding="utf-8") as log:
+                for line in log:
+                    try:
+                        operation, path, name = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._log_entries += 1
+                    if operation == "use":
+                        # path is the frecency key and name the time of the use
+                        self.frecency.add(path, name)
+                        continue
+                    repo = by_key.get(GitRepo.path_key(path))
+                    if operation == "rename" and repo is not None:
+                        repo.name = name
+        self._stamp = self.stamp()
+        return git_repos
+
+    def save(self, git_repos):
+        """Writes a new snapshot of git_repos and clears the log"""
+        content = json.dumps({"repos": [[repo.name, repo.path, repo.scan_path, repo.kind, repo.parent]
+                                        for repo in git_repos],
+                              "frecency": self.frecency.to_dict()},
+                             separators=(",", ":"),
+                             ensure_ascii=False)
+        data = self.MAGIC + bytes((self.VERSION,)) + zlib.compress(content.encode("utf-8"))
+        self.atomic_write(self.snapshot_path, data)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self._log_entries = 0
+        self._stamp = self.stamp()
+
+    def append_rename(self, path, name, git_repos):
+        """Records a rename in the log, the log is compacted into a new snapshot of git_repos if it grew too large"""
+        self._append([["rename", path, name]], git_repos)
+
+    def append_use(self, keys, git_repos):
+        """Adds a use of each of keys to the frecency scores and records them in the log"""
+        now = time.time()
+        for key in keys:
+            self.frecency.add(key, now)
+        self._append([["use", key, now] for key in keys], git_repos)
+
+    def _append(self, entries, git_repos):
+        if self._log_entries + len(entries) >= self.COMPACT_THRESHOLD or not os.path.exists(self.snapshot_path):
+            self.save(git_repos)
+            return
+        with open(self.log_path, "a", encoding="utf-8") as log:
+            log.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+            log.flush()
+            os.fsync(log.fileno())
+        self._log_entries += len(entries)
+        self._stamp = self.stamp()
+
+    def _migrate(self):
+        with open(self.legacy_path, "r") as repos:
+            git_repos = json.load(repos, cls=GitRepoDecoder)
+        self.save(git_repos)
+        os.remove(self.legacy_path)
+        return git_repos
+
+    @staticmethod
+    def atomic_write(path, data):
+        """Writes data to a temporary file next to path and replaces path with it"""
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as tmp_file:
+                tmp_file.write(data)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class Frecency(object):
+    """Scores of how frequently and recently repositories and commands were used
+
+    Every use adds 1 to the score of a key, scores halve every half_life seconds. Keys of repositories are REPO followed
+    by GitRepo.key, keys of commands COMMAND or COMMAND_ALL followed by the name of the command. Other keys are the
+    targets of the items of the plugin.
+    """
+    REPO = "repo:"
+    COMMAND = "cmd:"
+    COMMAND_ALL = "cmd_all:"
+    MIN_SCORE = 0.01
+
+    def __init__(self, half_life=14 * 24 * 60 * 60):
+        self.half_life = half_life
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _decayed(self, entry, now):
+        score, used = entry
+        return score * 0.5 ** (max(0.0, now - used) / self.half_life)
+
+    def score(self, key, now=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0.0
+        return self._decayed(entry, now if now is not None else time.time())
+
+    def add(self, key, now=None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._entries[key] = (self.score(key, now) + 1.0, now)
+
+    def load(self, entries):
+        with self._lock:
+            self._entries = dict((key, tuple(entry)) for key, entry in entries.items())
+
+    def to_dict(self):
+        """Returns the scores as JSON compatible dict, scores that decayed below MIN_SCORE are dropped"""
+        now = time.time()
+        with self._lock:
+            return dict((key, list(entry)) for key, entry in self._entries.items()
+                        if self._decayed(entry, now) >= self.MIN_SCORE)
 
 
 class GitRepoDecoder(json.JSONDecoder):
@@ -527,25 +2179,1127 @@ class GitRepoDecoder(json.JSONDecoder):
         return decoded
 
 
+class GitConfig(object):
+    """Minimal reader for git config files
+
+    Keys are stored as "section.key" or "section.subsection.key" with lower case section and key names, like git
+    itself reports them with "git config --list".
+    """
+    SECTION_RE = re.compile(r'^\[\s*([^\s\]"]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]\s*(.*)$')
+
+    def __init__(self, values=None):
+        self._values = values if values is not None else {}
+
+    @classmethod
+    def read(cls, path):
+        values = {}
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as config_file:
+                lines = config_file.read().splitlines()
+        except OSError:
+            return cls(values)
+
+        section = None
+        for line in lines:
+            line = line.strip()
+            if not line or line[0] in "#;":
+                continue
+            if line.startswith("["):
+                match = cls.SECTION_RE.match(line)
+                if not match:
+                    section = None
+                    continue
+                name, subsection, line = match.groups()
+                if subsection is not None:
+                    section = "{}.{}".format(name.lower(), subsection.replace('\\"', '"').replace("\\\\", "\\"))
+                else:
+                    section = name.lower()
+                if not line or line[0] in "#;":
+                    continue
+            if section is None:
+                continue
+            key, sep, value = line.partition("=")
+            key = key.strip().lower()
+            if not key:
+                continue
+            value = cls._parse_value(value) if sep else "true"
+            values.setdefault("{}.{}".format(section, key), []).append(value)
+        return cls(values)
+
+    @staticmethod
+    def _parse_value(raw):
+        value = []
+        quoted = False
+        escaped = False
+        for char in raw.strip():
+            if escaped:
+                value.append({"n": "\n", "t": "\t", "b": "\b"}.get(char, char))
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                quoted = not quoted
+            elif char in "#;" and not quoted:
+                break
+            else:
+                value.append(char)
+        return "".join(value).strip()
+
+    def get(self, key, default=None):
+        values = self._values.get(key.lower())
+        return values[-1] if values else default
+
+    def get_all(self, key):
+        return list(self._values.get(key.lower(), []))
+
+    def get_bool(self, key, default=False):
+        value = self.get(key)
+        if value is None:
+            return default
+        return value.lower() in ("true", "yes", "on", "1")
+
+    def keys(self):
+        return self._values.keys()
+
+
+class GitDirResolver(object):
+    """Resolves the working tree of ".git" directories and gitfiles without starting a git process"""
+    GITFILE_PREFIX = "gitdir:"
+
+    @classmethod
+    def read_gitfile(cls, path):
+        """Returns the absolute git directory a gitfile (worktrees, submodules) points to or None"""
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as gitfile:
+                line = gitfile.readline().strip()
+        except OSError:
+            return None
+        if not line.startswith(cls.GITFILE_PREFIX):
+            return None
+        git_dir = line[len(cls.GITFILE_PREFIX):].strip()
+        if not git_dir:
+            return None
+        return os.path.normpath(os.path.join(os.path.dirname(path), git_dir))
+
+    @classmethod
+    def git_dir(cls, dot_git):
+        """Returns the git directory for a ".git" entry, following gitfiles, or None"""
+        if os.path.isdir(dot_git):
+            return dot_git
+        if os.path.isfile(dot_git):
+            return cls.read_gitfile(dot_git)
+        return None
+
+    @classmethod
+    def common_dir(cls, git_dir):
+        """Returns the directory that holds config and refs shared by all worktrees of git_dir"""
+        try:
+            with open(os.path.join(git_dir, "commondir"), "r", encoding="utf-8", errors="replace") as commondir:
+                common_dir = commondir.readline().strip()
+        except OSError:
+            return git_dir
+        if not common_dir:
+            return git_dir
+        return os.path.normpath(os.path.join(git_dir, common_dir))
+
+    @classmethod
+    def top_level(cls, dot_git):
+        """Returns the top level directory of the working tree for a ".git" entry
+
+        None is returned if the layout can't be decided without asking git.
+        """
+        git_dir = cls.git_dir(dot_git)
+        if not git_dir or not os.path.isfile(os.path.join(git_dir, "HEAD")):
+            return None
+
+        common_dir = cls.common_dir(git_dir)
+        if common_dir != git_dir:
+            # linked worktree, the gitfile is always in the top level directory of the worktree
+            return os.path.normpath(os.path.dirname(dot_git))
+
+        config = GitConfig.read(os.path.join(git_dir, "config"))
+        worktree = config.get("core.worktree")
+        if worktree:
+            return os.path.normpath(os.path.join(git_dir, worktree))
+        if config.get_bool("core.bare"):
+            return None
+        return os.path.normpath(os.path.dirname(dot_git))
+
+    @classmethod
+    def kind(cls, dot_git):
+        """Returns the kind (see GitRepo) and the top level directory of the parent repository for a ".git" entry
+
+        Only linked worktrees have a parent here, submodules are found through the ".gitmodules" of their parent.
+        """
+        git_dir = cls.git_dir(dot_git)
+        if git_dir:
+            common_dir = cls.common_dir(git_dir)
+            if common_dir != git_dir:
+                return GitRepo.WORKTREE, cls.top_level(common_dir)
+        return GitRepo.REPOSITORY, None
+
+    @classmethod
+    def related(cls, top_level, dot_git):
+        """Yields the kind, top level directory and parent top level directory of the repositories related to a
+        repository: the main and linked worktrees from "worktrees/*/gitdir" and the initialized submodules from
+        ".gitmodules", recursively. The repository itself isn't yielded.
+        """
+        git_dir = cls.git_dir(dot_git)
+        if not git_dir:
+            return
+        common_dir = cls.common_dir(git_dir)
+        if common_dir != git_dir:
+            main = cls.top_level(common_dir)
+            if main:
+                yield GitRepo.REPOSITORY, main, None
+        else:
+            main = top_level
+        worktrees_dir = os.path.join(common_dir, "worktrees")
+        try:
+            names = sorted(os.listdir(worktrees_dir))
+        except OSError:
+            names = []
+        for name in names:
+            gitdir_path = os.path.join(worktrees_dir, name, "gitdir")
+            try:
+                with open(gitdir_path, "r", encoding="utf-8", errors="replace") as gitdir_file:
+                    worktree_git = gitdir_file.readline().strip()
+            except OSError:
+                continue
+            worktree_git = os.path.normpath(os.path.join(os.path.dirname(gitdir_path), worktree_git))
+            worktree = os.path.dirname(worktree_git)
+            if worktree != top_level and os.path.isfile(worktree_git):
+                yield GitRepo.WORKTREE, worktree, main
+
+        parents = [top_level]
+        while parents:
+            parent = parents.pop(0)
+            gitmodules = GitConfig.read(os.path.join(parent, ".gitmodules"))
+            for key in sorted(gitmodules.keys()):
+                if not key.startswith("submodule.") or not key.endswith(".path"):
+                    continue
+                submodule = os.path.normpath(os.path.join(parent, gitmodules.get(key)))
+                if os.path.exists(os.path.join(submodule, ".git")):
+                    yield GitRepo.SUBMODULE, submodule, parent
+                    parents.append(submodule)
+
+
+class ExcludeMatcher(object):
+    """Matches directory paths against the exclude patterns of a scan path, which are compiled only once
+
+    Every pattern is matched with its filefilter, like the launcher matches it. Plain glob patterns that end with "**"
+    exclude a whole subtree, the directories they start at are combined into one regular expression, so the scan never
+    descends into such a subtree only to exclude each of its sub directories.
+    """
+    SEPARATOR = r"[\\/]+"
+    ANY_DIRS = "(?:.*{})?".format(SEPARATOR)
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._filters = [filefilter.create_filter(pattern) for pattern in self.patterns]
+        regexes = [regex for regex in map(self.subtree_regex, self.patterns) if regex is not None]
+        # most patterns start with "**", matching it once for all of them saves backtracking over the path per pattern
+        any_dirs = [regex[len(self.ANY_DIRS):] for regex in regexes if regex.startswith(self.ANY_DIRS)]
+        regexes = [regex for regex in regexes if not regex.startswith(self.ANY_DIRS)]
+        if any_dirs:
+            regexes.append(self.ANY_DIRS + self.alternatives(any_dirs))
+        if regexes:
+            self._subtree_regex = re.compile(self.alternatives(regexes), re.IGNORECASE)
+        else:
+            self._subtree_regex = None
+
+    def __repr__(self):
+        return "ExcludeMatcher({})".format(repr(self.patterns))
+
+    def match(self, path):
+        if self._subtree_regex is not None and self._subtree_regex.fullmatch(path):
+            return True
+        for filter in self._filters:
+            if filter.match(path):
+                return True
+        return False
+
+    @staticmethod
+    def alternatives(regexes):
+        return "(?:{})".format("|".join("(?:{})".format(regex) for regex in regexes))
+
+    @staticmethod
+    def is_plain_glob(pattern):
+        if not pattern or pattern[0] in "+-" or pattern.startswith("re:"):
+            return False
+        if any(char in pattern for char in "[]{}"):
+            return False
+        # a colon is only allowed after a drive letter
+        return ":" not in pattern[2:] and (":" not in pattern[:2] or pattern[1] == ":")
+
+    @classmethod
+    def subtree_regex(cls, pattern):
+        """Returns a regular expression for the directories that the subtree of a plain glob pattern ending with "**"
+        starts at, or None for other patterns"""
+        if not cls.is_plain_glob(pattern):
+            return None
+        parts = re.split(cls.SEPARATOR, pattern)
+        if len(parts) > 1 and parts[-1] == "**" and any(part not in ("", "**") for part in parts[:-1]):
+            return cls.parts_to_regex(parts[:-1])
+        return None
+
+    @classmethod
+    def glob_to_regex(cls, pattern):
+        """Translates a glob pattern into a regular expression, "*" and "?" don't match path separators"""
+        return cls.parts_to_regex(re.split(cls.SEPARATOR, pattern))
+
+    @classmethod
+    def parts_to_regex(cls, parts):
+        regex = []
+        last = len(parts) - 1
+        for i, part in enumerate(parts):
+            if part == "**":
+                regex.append(".*" if i == last else cls.ANY_DIRS)
+                continue
+            for char in part:
+                if char == "*":
+                    regex.append(r"[^\\/]*")
+                elif char == "?":
+                    regex.append(r"[^\\/]")
+                else:
+                    regex.append(re.escape(char))
+            if i != last:
+                regex.append(cls.SEPARATOR)
+        return "".join(regex)
+
+
+class RepoFileIndex(object):
+    """Bounded LRU of the files of repositories, listed with "git ls-files"
+
+    Untracked files that are ignored (e.g. node_modules) are not listed. An entry is listed again if the mtime or size
+    of the index of the repository, HEAD or the mtime of the repository directory itself changed. The files that match
+    the configured patterns are cached alongside the file list.
+    """
+    ARGS_LS_FILES = "ls-files --cached --others --exclude-standard -z"
+    BATCH_SIZE = 20
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.runner = GitProcessRunner(1)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def lookup(self, repo_path, matcher):
+        """Returns the paths of the files in repo_path that matcher matches, or None if the index isn't up to date"""
+        key = GitRepo.path_key(repo_path)
+        fingerprint = self.fingerprint(repo_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.fingerprint != fingerprint:
+                return None
+            self._entries.move_to_end(key)
+
+        matches = entry.matches.get(matcher.key)
+        if matches is None:
+            matches = [self._join(repo_path, file) for file in entry.files if matcher.match(file)]
+            entry.matches[matcher.key] = matches
+        return matches
+
+    def stream(self, repo_path, git_path, matcher):
+        """Lists the files of repo_path with git and yields batches of the paths that matcher matches
+
+        A batch, empty if there aren't enough new matches yet, is yielded after every chunk of the listing, so that the
+        caller can give up between two chunks even if the patterns match few files. The file list is only added to the
+        index if the generator is exhausted, closing it early kills git. Raises OSError if git can't list the files.
+        """
+        fingerprint = self.fingerprint(repo_path)
+        files = []
+        matches = []
+        batch = []
+        rest = b""
+        chunks = self.runner.stream("git.ls_files", '"{}" {}'.format(git_path, self.ARGS_LS_FILES), repo_path)
+        try:
+            for chunk in chunks:
+                names = (rest + chunk).split(b"\0")
+                rest = names.pop()
+                for name in names:
+                    file = name.decode("utf-8", "replace")
+                    files.append(file)
+                    if matcher.match(file):
+                        batch.append(self._join(repo_path, file))
+                if len(batch) >= self.BATCH_SIZE:
+                    matches.extend(batch)
+                    yield batch
+                    batch = []
+                else:
+                    yield []
+        finally:
+            chunks.close()
+        if batch:
+            matches.extend(batch)
+            yield batch
+
+        entry = RepoFileIndexEntry(fingerprint, files)
+        entry.matches[matcher.key] = matches
+        with self._lock:
+            self._entries[GitRepo.path_key(repo_path)] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _join(repo_path, file):
+        return os.path.join(repo_path, os.path.normpath(file))
+
+    @staticmethod
+    def fingerprint(repo_path):
+        git_dir = GitDirResolver.git_dir(os.path.join(repo_path, ".git"))
+        fingerprint = []
+        for path in (os.path.join(git_dir, "index") if git_dir else None,
+                     os.path.join(git_dir, "HEAD") if git_dir else None,
+                     repo_path):
+            try:
+                stat = os.stat(path)
+                fingerprint.append((stat.st_mtime_ns, stat.st_size))
+            except (OSError, TypeError):
+                fingerprint.append(None)
+        return tuple(fingerprint)
+
+
+class RepoFileIndexEntry(object):
+    __slots__ = ("fingerprint", "files", "matches")
+
+    def __init__(self, fingerprint, files):
+        self.fingerprint = fingerprint
+        self.files = files
+        self.matches = {}
+
+
+class FilePatternMatcher(object):
+    """Matches paths relative to a repository against all [file/*] patterns at once"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.key = tuple(self.patterns)
+        if self.patterns:
+            self._regex = re.compile("|".join("(?:{})".format(ExcludeMatcher.glob_to_regex(pattern))
+                                              for pattern in self.patterns),
+                                     re.IGNORECASE)
+        else:
+            self._regex = None
+
+    def __repr__(self):
+        return "FilePatternMatcher({})".format(repr(self.patterns))
+
+    def match(self, path):
+        return self._regex is not None and self._regex.fullmatch(path) is not None
+
+
+class RepoScanner(object):
+    """Breadth-first directory walker that searches for ".git" directories on a bounded thread pool
+
+    The directories of each depth level are listed in parallel, in chunks of up to CHUNK_SIZE directories so that
+    fast local disks don't spend their time on the thread pool. The results are always yielded in the order of the
+    given paths and the sorted directory names, so a scan of an unchanged tree yields the same order every time.
+
+    If an index of a previous scan is given, directories whose mtime and inode didn't change are not listed again,
+    their ".git" directory and sub directories are taken from the index instead. Every visited directory is recorded
+    in new_index as path -> [mtime_ns, inode, ".git" path or None, [sub directory names]].
+    """
+    INDEX_VERSION = 2
+    CHUNK_SIZE = 64
+
+    def __init__(self, max_workers, is_excluded=None, index=None, new_index=None, cancel=None, on_visit=None):
+        self._max_workers = max_workers
+        self._is_excluded = is_excluded
+        self._cancel = cancel
+        self._on_visit = on_visit
+        self._index = index if index is not None else {}
+        self.new_index = new_index if new_index is not None else {}
+        self.listed = 0
+        self.unchanged = 0
+        self.fs_time = 0.0
+
+    def scan(self, paths, max_depth):
+        """Yields the paths of all ".git" directories and gitfiles below paths
+
+        Directories that contain a ".git" entry are not scanned any further. A directory at depth level n (the
+        paths themselves are at level 0) is only listed if max_depth is negative or n-1 <= max_depth.
+        """
+        frontier = []
+        for path in paths:
+            if path not in frontier:
+                frontier.append(path)
+        depth = 0
+        with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            while frontier:
+                descend = max_depth < 0 or depth <= max_depth
+                next_frontier = []
+                # enough chunks to keep all workers busy, but not one task per directory
+                size = max(1, min(self.CHUNK_SIZE, len(frontier) // (self._max_workers * 4)))
+                chunks = [frontier[start:start + size] for start in range(0, len(frontier), size)]
+                visited = (result for chunk_results in pool.map(self._visit_dirs, chunks) for result in chunk_results)
+                for path, git_dir, children, record, listed, fs_time in visited:
+                    self.fs_time += fs_time
+                    if self._cancel is not None and self._cancel.is_set():
+                        return
+                    if self._on_visit is not None:
+                        self._on_visit()
+                    if record is not None:
+                        self.new_index[path] = record
+                        if listed:
+                            self.listed += 1
+                        else:
+                            self.unchanged += 1
+                    if git_dir:
+                        yield git_dir
+                    elif descend:
+                        next_frontier.extend(children)
+                frontier = next_frontier
+                depth += 1
+
+    def _visit_dirs(self, paths):
+        return [self._visit_dir(path) for path in paths]
+
+    def _visit_dir(self, path):
+        """Returns the ".git" directory in path (or None), its sub directories, the new index record, whether the
+        directory had to be listed and the time spent in stat and listing"""
+        if self._cancel is not None and self._cancel.is_set():
+            return path, None, [], None, False, 0.0
+        if self._is_excluded and self._is_excluded(path):
+            return path, None, [], None, False, 0.0
+        start_time = time.perf_counter()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path, None, [], None, False, time.perf_counter() - start_time
+
+        record = self._index.get(path)
+        if record and record[0] == stat.st_mtime_ns and record[1] == stat.st_ino:
+            git_dir, names = record[2], record[3]
+            listed = False
+        else:
+            git_dir, names = self._list_dir(path)
+            record = [stat.st_mtime_ns, stat.st_ino, git_dir, names]
+            listed = True
+        fs_time = time.perf_counter() - start_time
+        return path, git_dir, [os.path.join(path, name) for name in names], record, listed, fs_time
+
+    def _list_dir(self, path):
+        """Returns the ".git" directory or gitfile in path (or None) and the sorted list of sub directory names"""
+        children = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    # a gitfile is the ".git" entry of linked worktrees and submodules
+                    if entry.name == ".git":
+                        return entry.path, []
+                    try:
+                        if not entry.is_dir():
+                            continue
+                    except OSError:
+                        continue
+                    children.append(entry.name)
+        except OSError:
+            return None, []
+        children.sort()
+        return None, children
+
+
+class PerfStats(object):
+    """Lightweight recorder for counters, values and latency histograms, does nothing unless enabled"""
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._started = time.time()
+            self._counters = {}
+            self._timings = {}
+            self._values = {}
+
+    def span(self, name):
+        """Returns a context manager that records the time spent in it under name"""
+        return PerfSpan(self if self.enabled else None, name)
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        milliseconds = seconds * 1000
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = {"count": 0,
+                                                "total_ms": 0.0,
+                                                "max_ms": 0.0,
+                                                "buckets": [0] * (len(self.BUCKETS_MS) + 1)}
+            timing["count"] += 1
+            timing["total_ms"] += milliseconds
+            timing["max_ms"] = max(timing["max_ms"], milliseconds)
+            timing["buckets"][bisect.bisect_left(self.BUCKETS_MS, milliseconds)] += 1
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._values[name] = value
+
+    def to_dict(self):
+        with self._lock:
+            timings = {}
+            for name, timing in self._timings.items():
+                timing = dict(timing)
+                timing["buckets"] = dict(("<={}".format(bound), count) for bound, count
+                                         in zip(self.BUCKETS_MS + ("inf",), timing["buckets"]))
+                timings[name] = timing
+            return {"since": self._started,
+                    "counters": dict(self._counters),
+                    "timings": timings,
+                    "values": copy.deepcopy(self._values)}
+
+    def summary_lines(self):
+        stats = self.to_dict()
+        lines = ["Performance statistics of the last {:0.0f} seconds:".format(time.time() - stats["since"])]
+        for name, timing in sorted(stats["timings"].items()):
+            lines.append("  {}: {} calls, avg {:0.1f} ms, max {:0.1f} ms, p50 <= {} ms, p95 <= {} ms"
+                         .format(name,
+                                 timing["count"],
+                                 timing["total_ms"] / timing["count"],
+                                 timing["max_ms"],
+                                 self._percentile(timing, 0.5),
+                                 self._percentile(timing, 0.95)))
+        for name, value in sorted(stats["counters"].items()):
+            lines.append("  {}: {}".format(name, value))
+        for name, value in sorted(stats["values"].items()):
+            lines.append("  {}: {}".format(name, value))
+        return lines
+
+    def _percentile(self, timing, fraction):
+        needed = timing["count"] * fraction
+        seen = 0
+        for bound, count in timing["buckets"].items():
+            seen += count
+            if seen >= needed:
+                return bound[2:]
+        return "inf"
+
+
+class PerfSpan(object):
+    __slots__ = ("_stats", "_name", "_start_time")
+
+    def __init__(self, stats, name):
+        self._stats = stats
+        self._name = name
+        self._start_time = None
+
+    def __enter__(self):
+        if self._stats is not None:
+            self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._stats is not None:
+            self._stats.record(self._name, time.perf_counter() - self._start_time)
+        return False
+
+
+class RepoHealthChecker(object):
+    """Checks which repositories still exist without blocking on unreachable volumes
+
+    The paths are grouped by volume (drive or network share) and every volume is checked on its own thread. A volume
+    whose root doesn't exist, or that doesn't answer a single check within timeout seconds, is offline. The paths on
+    offline volumes are never reported as missing.
+
+    A volume is only checked by one thread at a time. While the check of a hanging volume hasn't returned, the volume
+    stays offline without a new check, so an unreachable share doesn't pile up blocked threads.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # volume -> its last VolumeCheck
+        self._checks = {}
+
+    @staticmethod
+    def volume(path):
+        """Returns the root directory of the drive or network share of path"""
+        return os.path.join(os.path.normcase(os.path.splitdrive(path)[0]), os.sep)
+
+    def check(self, paths):
+        """Returns the set of paths that don't exist and the set of offline volumes"""
+        volumes = collections.defaultdict(list)
+        for path in paths:
+            volumes[self.volume(path)].append(path)
+        checks = []
+        offline = set()
+        with self._lock:
+            for volume, volume_paths in volumes.items():
+                previous = self._checks.get(volume)
+                if previous is not None and not previous.wait(self.timeout):
+                    offline.add(volume)
+                    continue
+                check = VolumeCheck(volume, volume_paths)
+                check.start()
+                self._checks[volume] = check
+                checks.append(check)
+        missing = set()
+        for check in checks:
+            if check.wait(self.timeout) and check.reachable:
+                missing.update(check.missing)
+            else:
+                offline.add(check.volume)
+        return missing, frozenset(offline)
+
+    def probe(self, paths):
+        """Returns the set of offline volumes of paths"""
+        return self.check(set(map(self.volume, paths)))[1]
+
+
+class VolumeCheck(object):
+    """Checks the existence of paths on one volume on a daemon thread"""
+    __slots__ = "volume", "paths", "missing", "reachable", "progress", "_thread"
+
+    def __init__(self, volume, paths):
+        self.volume = volume
+        self.paths = paths
+        self.missing = []
+        self.reachable = False
+        self.progress = time.monotonic()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="GitVolumeCheck", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout):
+        """Waits until all paths are checked, returns False if a single check took longer than timeout seconds"""
+        while True:
+            self._thread.join(max(0.0, self.progress + timeout - time.monotonic()))
+            if not self._thread.is_alive():
+                return True
+            if time.monotonic() - self.progress >= timeout:
+                return False
+
+    def _run(self):
+        if not os.path.isdir(self.volume):
+            return
+        self.progress = time.monotonic()
+        self.reachable = True
+        for path in self.paths:
+            if not os.path.exists(path):
+                self.missing.append(path)
+            self.progress = time.monotonic()
+
+
+class RepoWatcher(object):
+    """Watches scan paths for added and removed directories and reports what changed
+
+    On Windows ReadDirectoryChangesW reports the changed directories. Changes inside known repositories (other than of
+    their ".git" entry) and inside excluded directories are dropped, and on_change(names, directories) is called with
+    the names of the changed scan paths and the directories to rescan per name. A name without directories, like after
+    an overflow of the notification buffer, has to be rescanned completely. Otherwise, or if the notifications can't be
+    set up, the directories of the scan index are polled every interval seconds, so only directories that are already
+    known are stat'ed, and on_change(names) is called. Changes are debounced, all changes within delay seconds are
+    reported at once.
+    """
+    FILE_LIST_DIRECTORY = 0x1
+    FILE_SHARE_READ_WRITE_DELETE = 0x7
+    OPEN_EXISTING = 3
+    FILE_FLAG_BACKUP_SEMANTICS = 0x02000000
+    FILE_FLAG_OVERLAPPED = 0x40000000
+    FILE_NOTIFY_CHANGE_DIR_NAME = 0x2
+    WAIT_TIMEOUT = 0x102
+    MAXIMUM_WAIT_OBJECTS = 64
+    INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+    BUFFER_SIZE = 64 * 1024
+
+    class Overlapped(ctypes.Structure):
+        _fields_ = [("Internal", ctypes.c_void_p),
+                    ("InternalHigh", ctypes.c_void_p),
+                    ("Offset", ctypes.c_uint32),
+                    ("OffsetHigh", ctypes.c_uint32),
+                    ("hEvent", ctypes.c_void_p)]
+
+    def __init__(self, scan_paths, get_index, on_change, interval, delay, excludes=None):
+        self._scan_paths = scan_paths
+        self._get_index = get_index
+        self._on_change = on_change
+        self._interval = interval
+        self._delay = delay
+        self._excludes = excludes or {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._watches = []
+        # indexed directories that are gone and were reported already
+        self._missing = set()
+        self._repo_dirs_index = None
+        self._repo_dirs = frozenset()
+        self.native = False
+
+    def start(self):
+        self._watches = self._open_watches()
+        self.native = bool(self._watches)
+        self._thread = threading.Thread(target=self._run, name="GitWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+
+    def _run(self):
+        try:
+            if self._watches:
+                self._wait_native()
+            if not self._stop.is_set():
+                self._poll()
+        finally:
+            self._close_watches(self._watches)
+            self._watches = []
+
+    @staticmethod
+    def _kernel32():
+        # a private instance, the argument types don't leak into other users of kernel32
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        kernel32.CreateFileW.restype = ctypes.c_void_p
+        kernel32.CreateFileW.argtypes = (ctypes.c_wchar_p, ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p,
+                                         ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p)
+        kernel32.CreateEventW.restype = ctypes.c_void_p
+        kernel32.CreateEventW.argtypes = (ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_wchar_p)
+        kernel32.ReadDirectoryChangesW.argtypes = (ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint32, ctypes.c_int,
+                                                   ctypes.c_uint32, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p)
+        kernel32.GetOverlappedResult.argtypes = (ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint32),
+                                                 ctypes.c_int)
+        kernel32.WaitForMultipleObjects.restype = ctypes.c_uint32
+        kernel32.WaitForMultipleObjects.argtypes = (ctypes.c_uint32, ctypes.c_void_p, ctypes.c_int, ctypes.c_uint32)
+        kernel32.ResetEvent.argtypes = (ctypes.c_void_p,)
+        kernel32.CancelIoEx.argtypes = (ctypes.c_void_p, ctypes.c_void_p)
+        kernel32.CloseHandle.argtypes = (ctypes.c_void_p,)
+        return kernel32
+
+    def _open_watches(self):
+        if os.name != "nt":
+            return []
+        kernel32 = self._kernel32()
+        watches = []
+        try:
+            for name, paths in self._scan_paths.items():
+                for path in paths:
+                    if not os.path.isdir(path):
+                        continue
+                    if len(watches) >= self.MAXIMUM_WAIT_OBJECTS:
+                        raise OSError("more than {} paths to watch".format(self.MAXIMUM_WAIT_OBJECTS))
+                    watch = RepoWatch(name, path, ctypes.create_string_buffer(self.BUFFER_SIZE), self.Overlapped())
+                    watches.append(watch)
+                    handle = kernel32.CreateFileW(path,
+                                                  self.FILE_LIST_DIRECTORY,
+                                                  self.FILE_SHARE_READ_WRITE_DELETE,
+                                                  None,
+                                                  self.OPEN_EXISTING,
+                                                  self.FILE_FLAG_BACKUP_SEMANTICS | self.FILE_FLAG_OVERLAPPED,
+                                                  None)
+                    if handle is None or handle == self.INVALID_HANDLE_VALUE:
+                        raise ctypes.WinError(ctypes.get_last_error())
+                    watch.handle = handle
+                    watch.event = kernel32.CreateEventW(None, True, False, None)
+                    if not watch.event:
+                        raise ctypes.WinError(ctypes.get_last_error())
+                    watch.overlapped.hEvent = watch.event
+                    self._read_changes(kernel32, watch)
+        except OSError:
+            # fall back to polling for everything
+            self._close_watches(watches)
+            return []
+        return watches
+
+    def _close_watches(self, watches):
+        if not watches:
+            return
+        kernel32 = self._kernel32()
+        transferred = ctypes.c_uint32()
+        for watch in watches:
+            if watch.handle is not None:
+                if kernel32.CancelIoEx(watch.handle, ctypes.byref(watch.overlapped)):
+                    # the buffer has to stay alive until the cancelled read is done with it
+                    kernel32.GetOverlappedResult(watch.handle, ctypes.byref(watch.overlapped),
+                                                 ctypes.byref(transferred), True)
+                kernel32.CloseHandle(watch.handle)
+            if watch.event is not None:
+                kernel32.CloseHandle(watch.event)
+
+    def _read_changes(self, kernel32, watch):
+        if not kernel32.ReadDirectoryChangesW(watch.handle,
+                                              watch.buffer,
+                                              len(watch.buffer),
+                                              True,
+                                              self.FILE_NOTIFY_CHANGE_DIR_NAME,
+                                              None,
+                                              ctypes.byref(watch.overlapped),
+                                              None):
+            raise ctypes.WinError(ctypes.get_last_error())
+
+    def _wait_native(self):
+        kernel32 = self._kernel32()
+        events = (ctypes.c_void_p * len(self._watches))(*[watch.event for watch in self._watches])
+        transferred = ctypes.c_uint32()
+        # scan path name -> changed directories, None to rescan the whole scan path
+        pending = {}
+        deadline = None
+        while not self._stop.is_set():
+            timeout = 1000
+            if deadline is not None:
+                timeout = min(timeout, max(0, int((deadline - time.time()) * 1000)))
+            result = kernel32.WaitForMultipleObjects(len(self._watches), events, False, timeout)
+            if result < len(self._watches):
+                watch = self._watches[result]
+                if not kernel32.GetOverlappedResult(watch.handle, ctypes.byref(watch.overlapped),
+                                                    ctypes.byref(transferred), False):
+                    return
+                if not transferred.value:
+                    # the buffer overflowed, the changes are unknown
+                    pending[watch.name] = None
+                else:
+                    directories = self._changed_directories(watch, transferred.value)
+                    if directories and pending.get(watch.name, ()) is not None:
+                        pending.setdefault(watch.name, set()).update(directories)
+                kernel32.ResetEvent(watch.event)
+                try:
+                    self._read_changes(kernel32, watch)
+                except OSError:
+                    return
+                if pending and deadline is None:
+                    deadline = time.time() + self._delay
+            elif result != self.WAIT_TIMEOUT:
+                return
+            if deadline is not None and time.time() >= deadline:
+                self._on_change(set(pending),
+                                dict((name, directories) for name, directories in pending.items()
+                                     if directories is not None))
+                pending = {}
+                deadline = None
+
+    def _changed_directories(self, watch, size):
+        """Returns the directories to rescan for the FILE_NOTIFY_INFORMATION records in the buffer of watch"""
+        data = watch.buffer.raw[:size]
+        directories = set()
+        offset = 0
+        while True:
+            next_offset, _, length = struct.unpack_from("<III", data, offset)
+            relative = data[offset + 12:offset + 12 + length].decode("utf-16-le", "replace")
+            directory = self._changed_directory(watch.name, watch.root, relative)
+            if directory is not None:
+                directories.add(directory)
+            if not next_offset:
+                return directories
+            offset += next_offset
+
+    def _changed_directory(self, name, root, relative):
+        """Returns the directory whose listing changed when the directory root/relative was added or removed, None if
+        the change doesn't matter to the scan of scan path name
+
+        Only the ".git" entry of a known repository matters, and nothing inside an excluded directory. The directory of
+        a ".git" entry is returned for changes inside it, that's where a repository appeared.
+        """
+        is_excluded = self._excludes.get(name)
+        repo_dirs = self._known_repo_dirs()
+        parts = relative.split(os.sep)
+        path = root
+        for index, part in enumerate(parts):
+            if path in repo_dirs:
+                return path if parts[index:] == [".git"] else None
+            if part == ".git":
+                return path
+            path = os.path.join(path, part)
+            if is_excluded is not None and is_excluded(path):
+                return None
+        return os.path.dirname(path)
+
+    def _known_repo_dirs(self):
+        index = self._get_index()
+        if index is not self._repo_dirs_index:
+            self._repo_dirs = frozenset(path for path, record in index.items() if record[2])
+            self._repo_dirs_index = index
+        return self._repo_dirs
+
+    def _poll(self):
+        while not self._stop.wait(self._interval):
+            index = self._get_index()
+            self._missing.intersection_update(index)
+            changed = set(name for name, paths in self._scan_paths.items()
+                          if self._changed(index, paths, self._missing))
+            if changed:
+                self._on_change(changed)
+
+    @staticmethod
+    def _changed(index, paths, missing):
+        """Returns True if one of the indexed directories below paths has a different mtime than in index
+
+        Directories that don't exist are added to missing and reported only once. The rescan drops them from the index,
+        except on offline volumes, whose scan paths would be rescanned every interval otherwise.
+        """
+        roots = tuple(paths)
+        prefixes = tuple(os.path.join(path, "") for path in paths)
+        for path, record in index.items():
+            if path not in roots and not path.startswith(prefixes):
+                continue
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                if path in missing:
+                    continue
+                missing.add(path)
+                return True
+            missing.discard(path)
+            if mtime_ns != record[0]:
+                return True
+        return False
+
+
+class RepoWatch(object):
+    """A scan path directory that RepoWatcher watches with ReadDirectoryChangesW"""
+    __slots__ = ("name", "root", "buffer", "overlapped", "handle", "event")
+
+    def __init__(self, name, root, buffer, overlapped):
+        self.name = name
+        self.root = root
+        self.buffer = buffer
+        self.overlapped = overlapped
+        self.handle = None
+        self.event = None
+
+
+class RescanProgress(object):
+    """Counts visited directories and found repositories of a rescan and reports them periodically"""
+    REPORT_INTERVAL = 5.0
+
+    def __init__(self, plugin, start_time):
+        self._plugin = plugin
+        self._start_time = start_time
+        self._last_report = start_time
+        self.directories = 0
+        self.repos = 0
+
+    def directory_visited(self):
+        self.directories += 1
+        now = time.time()
+        if now - self._last_report >= self.REPORT_INTERVAL:
+            self._last_report = now
+            self._plugin.info("Rescan progress: {} directories visited, {} repositories found, {:0.1f} seconds elapsed"
+                              .format(self.directories, self.repos, now - self._start_time))
+
+    def repo_found(self):
+        self.repos += 1
+
+
+class Template(object):
+    """A str.format template that is parsed once, only the {repo_path} placeholder is supported"""
+    FIELDS = ("repo_path",)
+
+    def __init__(self, template):
+        self.template = template
+        self._parts = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if field is not None and field not in self.FIELDS:
+                raise ValueError("unknown placeholder {{{}}} in '{}'".format(field, template))
+            self._parts.append((literal, field, spec, conversion))
+        if all(field is None for _, field, _, _ in self._parts):
+            self._constant = "".join(literal for literal, _, _, _ in self._parts)
+        else:
+            self._constant = None
+
+    def __repr__(self):
+        return "Template({})".format(repr(self.template))
+
+    def render(self, **values):
+        if self._constant is not None:
+            return self._constant
+        result = []
+        for literal, field, spec, conversion in self._parts:
+            result.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "a":
+                value = ascii(value)
+            result.append(format(value, spec or ""))
+        return "".join(result)
+
+
+class CommandTemplate(object):
+    """A GitCommand with its placeholders parsed and its icon loaded, built once when the configuration is read
+
+    Items of the command only carry the command name and the repository path in their data bag, the command itself
+    is looked up again by name when the item is executed.
+    """
+    __slots__ = ("command", "args", "cwd", "icon_handle", "data_bag_prefix")
+
+    def __init__(self, command, icon_handle=None):
+        self.command = command
+        self.args = Template(command.args or "")
+        self.cwd = Template(command.cwd) if command.cwd else None
+        self.icon_handle = icon_handle
+        # data bags are the JSON array [name, repo_path], the prefix is "[name,"
+        self.data_bag_prefix = json.dumps([command.name])[:-1] + ","
+
+    def __repr__(self):
+        return "CommandTemplate({})".format(repr(self.command))
+
+    def data_bag(self, repo_path):
+        return self.data_bag_prefix + json.dumps([repo_path])[1:]
+
+    @staticmethod
+    def parse_data_bag(data_bag):
+        """Returns the command name and repository path of a data bag created by data_bag()"""
+        name, repo_path = json.loads(data_bag)
+        return name, repo_path
+
+
 class GitCommand(object):
-    __slots__ = ("name", "label", "cmd", "args", "cwd", "internal")
+    __slots__ = ("name", "label", "cmd", "args", "cwd", "internal", "workers", "timeout", "network", "host_workers",
+                 "retries", "retry_delay", "fresh_for")
 
-    def __init__(self, name, cmd, label=None, args=None, cwd=None, internal=False):
+    def __init__(self, name, cmd, label=None, args=None, cwd=None, internal=False, workers=1, timeout=0,
+                 network=False, host_workers=2, retries=0, retry_delay=5, fresh_for=0):
         self.name = name
         self.cmd = cmd
         self.label = label
         self.args = args
         self.cwd = cwd
         self.internal = internal
+        self.workers = workers
+        self.timeout = timeout
+        self.network = network
+        self.host_workers = host_workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.fresh_for = fresh_for
 
     def __str__(self):
         return "{}, '{} {}'".format(self.label, self.cmd, self.args)
 
     def __repr__(self):
-        return "GitCommand(name={}, label={}, cmd={}, args={}, cwd={}, internal={})" \
+        return "GitCommand(name={}, label={}, cmd={}, args={}, cwd={}, internal={}, workers={}, timeout={}, " \
+               "network={}, host_workers={}, retries={}, retry_delay={}, fresh_for={})" \
             .format(repr(self.name),
                     repr(self.label),
                     repr(self.cmd),
                     repr(self.args),
                     repr(self.cwd),
-                    repr(self.internal))
+                    repr(self.internal),
+                    repr(self.workers),
+                    repr(self.timeout),
+                    repr(self.network),
+                    repr(self.host_workers),
+                    repr(self.retries),
+                    repr(self.retry_delay),
+                    repr(self.fresh_for))